@@ -7,20 +7,45 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
+import logging
 import os
+
 import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DjangoProject.settings')
 django.setup()
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
 from app.routing import websocket_urlpatterns
+from assistant import Assistant
+
+logger = logging.getLogger(__name__)
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            if settings.ASSISTANT_WARMUP and not settings.USE_FAKE_ASSISTANT:
+                try:
+                    await Assistant().warm_up()
+                except Exception:
+                    # Прогрев не обязателен: ассистент инициализируется при первом запросе.
+                    logger.exception("Assistant warm-up failed")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await Assistant.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
+    "lifespan": lifespan,
     "websocket": AllowedHostsOriginValidator(
         AuthMiddlewareStack(
             URLRouter(
@@ -13,9 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 
-from qdrant_client import QdrantClient
-
-from assistant import Assistant
+from django.utils.functional import SimpleLazyObject
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -172,20 +170,51 @@ QDRANT_PORT = os.getenv("QDRANT_PORT", "6333")
 QDRANT_URL = os.getenv("QDRANT_URL", f"http://{QDRANT_HOST}:{QDRANT_PORT}")
 QDRANT_IN_MEMORY = os.getenv("QDRANT_IN_MEMORY") == "1"
 
-QDRANT = QdrantClient(":memory:") if QDRANT_IN_MEMORY else QdrantClient(url=QDRANT_URL)
+def _get_qdrant():
+    from retrieval import get_qdrant
+
+    return get_qdrant()
+
+
+# Клиенты создаются (и тяжелые модули импортируются) при первом обращении,
+# чтобы импорт настроек не ходил в сеть.
+QDRANT = SimpleLazyObject(_get_qdrant)
+# Имя базы знаний в Qdrant - alias на текущую версию коллекции (que_v1, que_v2, ...),
+# которую переключает manage.py reindex_knowledge.
 COLLECTION = os.getenv("QDRANT_COLLECTION", "que")
+# Сколько секунд админка может показывать закэшированное число записей; любая запись в базу знаний сбрасывает кэш сразу.
+KNOWLEDGE_COUNT_TTL = int(os.getenv("KNOWLEDGE_COUNT_TTL", "300"))
 
 USE_FAKE_ASSISTANT = os.getenv("USE_FAKE_ASSISTANT") == "1"
 
 class DummyAssistant:
+    async def get_embedding_model(self):
+        return "fake"
+
     async def __call__(self, message, max_related=5):
+        from assistant import Assistant
+
         return Assistant.Response(answer=f"stub: {message}", related_questions=[])
 
     async def answers(self, message):
         return []
 
-    async def get_embedding(self, message):
+    async def get_embedding(self, message, priority=None):
         return [0.0, 0.0, 0.0]
 
+    def metrics(self):
+        return {}
+
+    def knowledge_changed(self, upserted=None, deleted=None):
+        pass
+
+
+def _get_assistant():
+    from assistant import Assistant
+
+    return DummyAssistant() if USE_FAKE_ASSISTANT else Assistant()
+
+
+assistant = SimpleLazyObject(_get_assistant)
 
-assistant = DummyAssistant() if USE_FAKE_ASSISTANT else Assistant()
+ASSISTANT_WARMUP = os.getenv("ASSISTANT_WARMUP") == "1"
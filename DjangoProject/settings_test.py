@@ -3,6 +3,7 @@ import os
 os.environ.setdefault("USE_FAKE_ASSISTANT", "1")
 os.environ.setdefault("QDRANT_IN_MEMORY", "1")
 os.environ.setdefault("TEST_USE_SQLITE", "1")
+os.environ.setdefault("EMBEDDING_CACHE_PATH", "")
 
 from .settings import *  # noqa
 
@@ -0,0 +1,73 @@
+import asyncio
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from retrieval import get_async_qdrant, get_qdrant
+
+
+class Command(BaseCommand):
+    help = (
+        "Измеряет задержку event loop при конкурентных поисковых запросах в Qdrant: "
+        "синхронный клиент внутри корутин против асинхронной обертки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--collection", default=settings.COLLECTION)
+        parser.add_argument("--concurrency", type=int, default=50, help="Число одновременных чатов")
+        parser.add_argument("--requests", type=int, default=500, help="Всего поисковых запросов")
+        parser.add_argument("--tick-ms", type=float, default=1.0, help="Период зонда задержки event loop")
+
+    def handle(self, *args, **options):
+        client = get_qdrant()
+        collection = options["collection"]
+        dimension = client.get_collection(collection).config.params.vectors.size
+
+        for mode in ("sync", "async"):
+            report = asyncio.run(self.run_load(mode, collection, dimension, options))
+            self.stdout.write(
+                f"{mode:>5}: {report['rps']:.1f} req/s, loop lag p50={report['p50']:.2f} ms, "
+                f"p99={report['p99']:.2f} ms, max={report['max']:.2f} ms"
+            )
+
+    async def run_load(self, mode, collection, dimension, options):
+        sync_client = get_qdrant()
+        async_client = get_async_qdrant()
+        tick = options["tick_ms"] / 1000
+        lags = []
+        remaining = options["requests"]
+        stop = asyncio.Event()
+
+        async def probe():
+            while not stop.is_set():
+                started = time.perf_counter()
+                await asyncio.sleep(tick)
+                lags.append((time.perf_counter() - started - tick) * 1000)
+
+        async def chat():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                query = [random.random() for _ in range(dimension)]
+                if mode == "sync":
+                    sync_client.query_points(collection_name=collection, query=query, limit=5, with_payload=True)
+                else:
+                    await async_client.query_points(collection_name=collection, query=query, limit=5, with_payload=True)
+
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(chat() for _ in range(options["concurrency"])))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe_task
+
+        lags.sort()
+        return {
+            "rps": options["requests"] / elapsed,
+            "p50": statistics.median(lags) if lags else 0.0,
+            "p99": lags[int(len(lags) * 0.99) - 1] if lags else 0.0,
+            "max": lags[-1] if lags else 0.0,
+        }
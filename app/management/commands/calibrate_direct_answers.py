@@ -0,0 +1,115 @@
+import asyncio
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from app.models import Message
+from assistant import Assistant
+from concurrency import Priority
+from embeddings import LocalEmbeddings
+from retrieval import get_async_qdrant
+
+OPERATOR_REPLY = "Перевожу вас на оператора"
+
+
+def choose_threshold(samples: list[tuple[float, bool]], target_precision: float, min_support: int):
+    """Наименьший порог, при котором доля верных прямых ответов среди вопросов выше порога не ниже target_precision.
+
+    samples - пары (близость лучшей записи базы знаний, подошел ли ее ответ).
+    Возвращает (порог, точность, число вопросов выше порога) или None.
+    """
+    best = None
+    positives = 0
+    for count, (score, correct) in enumerate(sorted(samples, reverse=True), start=1):
+        positives += correct
+        if count >= min_support and positives / count >= target_precision:
+            best = (score, positives / count, count)
+    return best
+
+
+class Command(BaseCommand):
+    help = (
+        "Подбирает DIRECT_ANSWER_THRESHOLD по истории чатов: для вопросов, на которые отвечала модель, "
+        "сравнивает ее ответ с ответом ближайшей записи базы знаний."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--collection", default=settings.COLLECTION)
+        parser.add_argument("--limit", type=int, default=2000, help="Сколько последних ответов модели взять")
+        parser.add_argument("--target-precision", type=float, default=0.95)
+        parser.add_argument("--min-support", type=int, default=20, help="Минимум вопросов выше порога")
+        parser.add_argument(
+            "--agreement", type=float, default=0.5,
+            help="Минимальная близость ответа модели и ответа из базы, чтобы считать их совпадающими",
+        )
+
+    def handle(self, *args, **options):
+        pairs = self.collect_pairs(options["limit"])
+        if not pairs:
+            self.stdout.write("В истории нет ответов модели для калибровки.")
+            return
+
+        samples = asyncio.run(self.score_pairs(pairs, options["collection"], options["agreement"]))
+        scores = np.array([score for score, _ in samples])
+        self.stdout.write(f"Вопросов: {len(samples)}, совпадений с базой знаний: {sum(c for _, c in samples)}")
+        for quantile in (0.5, 0.75, 0.9, 0.95, 0.99):
+            threshold = float(np.quantile(scores, quantile))
+            above = [correct for score, correct in samples if score >= threshold]
+            self.stdout.write(
+                f"порог {threshold:.4f}: прямых ответов {len(above) / len(samples):6.1%}, "
+                f"точность {sum(above) / len(above):6.1%}"
+            )
+
+        best = choose_threshold(samples, options["target_precision"], options["min_support"])
+        if best is None:
+            self.stdout.write(self.style.WARNING("Нет порога с нужной точностью - прямые ответы лучше не включать."))
+            return
+
+        threshold, precision, count = best
+        self.stdout.write(self.style.SUCCESS(
+            f"DIRECT_ANSWER_THRESHOLD={threshold:.4f} "
+            f"(точность {precision:.1%}, прямых ответов {count / len(samples):.1%})"
+        ))
+
+    def collect_pairs(self, limit: int) -> list[tuple[str, str]]:
+        """Пары (вопрос пользователя, следующий за ним ответ модели)."""
+        # Ответы модели до появления поля source отличаются от ответов оператора наличием response_time.
+        replies = (
+            Message.objects
+            .filter(role="assistant")
+            .filter(Q(source="llm") | Q(source__isnull=True, response_time__isnull=False))
+            .exclude(content__startswith=OPERATOR_REPLY)
+            .order_by("-created_at")[:limit]
+        )
+
+        pairs = []
+        for reply in replies:
+            question = (
+                Message.objects
+                .filter(chat_id=reply.chat_id, role="user", created_at__lte=reply.created_at)
+                .order_by("-created_at")
+                .first()
+            )
+            if question is not None and question.content.strip():
+                pairs.append((question.content, reply.content))
+        return pairs
+
+    async def score_pairs(self, pairs, collection: str, agreement: float) -> list[tuple[float, bool]]:
+        assistant = Assistant()
+        qdrant = get_async_qdrant()
+        comparer = LocalEmbeddings()
+
+        samples = []
+        vectors = await assistant.get_embeddings([question for question, _ in pairs], priority=Priority.ADMIN)
+        for (question, reply), vector in zip(pairs, vectors):
+            hits = (await qdrant.query_points(
+                collection_name=collection, query=vector, limit=1, with_payload=True
+            )).points
+            if not hits:
+                continue
+
+            kb_answer, llm_answer = comparer.transform([hits[0].payload["answer"], reply])
+            samples.append((hits[0].score, bool(kb_answer @ llm_answer >= agreement)))
+        return samples
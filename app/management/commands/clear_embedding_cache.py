@@ -0,0 +1,20 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from caches import EmbeddingCache
+
+
+class Command(BaseCommand):
+    help = "Очищает дисковый кэш эмбеддингов всех моделей (например, чтобы освободить место после смены модели)."
+
+    def handle(self, *args, **options):
+        path = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+        if not path:
+            self.stdout.write("Дисковый кэш эмбеддингов отключен (EMBEDDING_CACHE_PATH пуст).")
+            return
+
+        cache = EmbeddingCache(model=os.getenv("GIGACHAT_EMBEDDING_MODEL", "Embeddings"), path=path)
+        cache.clear()
+        cache.close()
+        self.stdout.write(self.style.SUCCESS(f"Кэш эмбеддингов {path} очищен."))
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from knowledge import dump_snapshot
+from retrieval import get_qdrant
+
+
+class Command(BaseCommand):
+    help = (
+        "Сохраняет векторы и payload коллекции базы знаний в снимок: vectors.npy (float32), "
+        "payloads.jsonl и meta.json. Снимок загружается командой load_knowledge без вызовов GigaChat."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Каталог снимка")
+        parser.add_argument("--collection", default=settings.COLLECTION)
+
+    def handle(self, *args, **options):
+        count = dump_snapshot(get_qdrant(), options["collection"], options["path"])
+        self.stdout.write(self.style.SUCCESS(f"Сохранено {count} записей из {options['collection']} в {options['path']}"))
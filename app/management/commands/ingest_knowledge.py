@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from assistant import Assistant
+from knowledge import IngestCheckpoint, ingest_knowledge, read_rows, resolve_path, row_to_record
+from retrieval import get_async_qdrant
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает базу знаний из файла (xlsx, csv или jsonl) в Qdrant: эмбеддинги считаются батчами параллельно, "
+        "запись идет чанками, прерванная загрузка продолжается с места остановки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default="база знаний.xlsx")
+        parser.add_argument("--collection", default=settings.COLLECTION)
+        parser.add_argument("--batch-size", type=int, default=64, help="Записей в одном чанке")
+        parser.add_argument("--concurrency", type=int, default=4, help="Чанков в обработке одновременно")
+        parser.add_argument("--checkpoint", help="Файл чекпоинта (по умолчанию .ingest-<коллекция>.json)")
+        parser.add_argument("--restart", action="store_true", help="Игнорировать чекпоинт и загрузить все заново")
+
+    def handle(self, *args, **options):
+        path = resolve_path(options["path"])
+        collection = options["collection"]
+        stat = os.stat(path)
+        checkpoint = IngestCheckpoint(
+            options["checkpoint"] or f".ingest-{collection}.json",
+            key=f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{collection}|{options['batch_size']}",
+        )
+        if options["restart"]:
+            checkpoint.clear()
+        elif checkpoint.done:
+            self.stdout.write(f"Продолжаю загрузку: уже загружено чанков - {len(checkpoint.done)}")
+
+        def on_chunk(report, elapsed):
+            self.stdout.write(f"  {report.rows} записей, {report.rows / elapsed:.1f} записей/с")
+
+        async def run():
+            try:
+                report = await ingest_knowledge(
+                    (row_to_record(row) for row in read_rows(path)),
+                    embed=Assistant().get_embeddings,
+                    model=await Assistant().get_embedding_model(),
+                    qdrant=get_async_qdrant(),
+                    collection=collection,
+                    batch_size=options["batch_size"],
+                    concurrency=options["concurrency"],
+                    checkpoint=checkpoint,
+                    on_chunk=on_chunk,
+                )
+                # Запасная коллекция (EMBEDDING_FALLBACK) повторяет ту, из которой читает Assistant.
+                if collection == settings.COLLECTION:
+                    await Assistant().sync_fallback_collection(get_async_qdrant())
+                return report
+            finally:
+                await Assistant.shutdown()
+
+        report = asyncio.run(run())
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Загружено {report.rows} записей ({report.chunks} чанков) в {collection} "
+            f"за {report.elapsed:.1f} с: {report.rows_per_second:.1f} записей/с"
+            + (f", пропущено по чекпоинту {report.skipped}" if report.skipped else "")
+        ))
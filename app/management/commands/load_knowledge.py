@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from knowledge import load_snapshot
+from retrieval import get_qdrant
+
+
+class Command(BaseCommand):
+    help = "Загружает снимок из dump_knowledge в коллекцию пакетными upsert, без пересчета эмбеддингов."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Каталог снимка")
+        parser.add_argument("--collection", default=settings.COLLECTION)
+        parser.add_argument("--batch-size", type=int, default=512)
+        parser.add_argument("--recreate", action="store_true", help="Удалить коллекцию перед загрузкой")
+
+    def handle(self, *args, **options):
+        started_at = time.monotonic()
+        count = load_snapshot(
+            get_qdrant(), options["path"], options["collection"],
+            batch_size=options["batch_size"], recreate=options["recreate"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Загружено {count} записей в {options['collection']} за {time.monotonic() - started_at:.1f} с"
+        ))
@@ -0,0 +1,97 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from assistant import Assistant
+from knowledge import (
+    alias_target,
+    collection_versions,
+    read_rows,
+    reindex_knowledge,
+    resolve_path,
+    rollback_knowledge,
+    row_to_record,
+)
+from retrieval import get_async_qdrant
+
+
+class Command(BaseCommand):
+    help = (
+        "Полная переиндексация без простоя: база знаний загружается в новую версию коллекции "
+        "(<alias>_v<N>), прогревается и атомарно подключается под alias. Предыдущая версия "
+        "сохраняется для мгновенного отката (--rollback)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default="база знаний.xlsx")
+        parser.add_argument("--alias", default=settings.COLLECTION, help="Alias, через который читают Assistant и админка")
+        parser.add_argument("--batch-size", type=int, default=64)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--keep", type=int, default=2, help="Сколько версий хранить, включая новую и предыдущую")
+        parser.add_argument("--rollback", action="store_true", help="Вернуть alias на предыдущую версию")
+        parser.add_argument("--status", action="store_true", help="Показать версии и текущую цель alias")
+
+    def handle(self, *args, **options):
+        alias = options["alias"]
+        qdrant = get_async_qdrant()
+
+        if options["status"]:
+            async def status():
+                return await alias_target(qdrant, alias), await collection_versions(qdrant, alias)
+
+            target, versions = asyncio.run(status())
+            for name in versions:
+                self.stdout.write(f"{'*' if name == target else ' '} {name}")
+            if target is None:
+                self.stdout.write(f"Alias {alias} не создан")
+            return
+
+        if options["rollback"]:
+            async def rollback():
+                collection = await rollback_knowledge(qdrant, alias)
+                if alias == settings.COLLECTION:
+                    try:
+                        await Assistant().sync_fallback_collection(qdrant)
+                    finally:
+                        await Assistant.shutdown()
+                return collection
+
+            try:
+                collection = asyncio.run(rollback())
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"{alias} -> {collection}"))
+            return
+
+        path = resolve_path(options["path"])
+
+        def on_chunk(report, elapsed):
+            self.stdout.write(f"  {report.rows} записей, {report.rows / elapsed:.1f} записей/с")
+
+        async def run():
+            assistant = Assistant()
+            try:
+                report = await reindex_knowledge(
+                    (row_to_record(row) for row in read_rows(path)),
+                    embed=assistant.get_embeddings,
+                    qdrant=qdrant,
+                    alias=alias,
+                    model=await assistant.get_embedding_model(),
+                    batch_size=options["batch_size"],
+                    concurrency=options["concurrency"],
+                    keep=options["keep"],
+                    on_chunk=on_chunk,
+                )
+                if alias == settings.COLLECTION:
+                    await assistant.sync_fallback_collection(qdrant)
+                return report
+            finally:
+                await Assistant.shutdown()
+
+        report = asyncio.run(run())
+        self.stdout.write(self.style.SUCCESS(
+            f"{alias} -> {report.collection} (было: {report.previous or 'нет'}), "
+            f"{report.ingest.rows} записей за {report.ingest.elapsed:.1f} с"
+            + (f", удалены старые версии: {', '.join(report.dropped)}" if report.dropped else "")
+        ))
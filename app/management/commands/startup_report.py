@@ -0,0 +1,61 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+PROBE = """
+import json, os, time
+started = time.perf_counter()
+import django
+imported = time.perf_counter()
+django.setup()
+configured = time.perf_counter()
+from DjangoProject import asgi
+loaded = time.perf_counter()
+print(json.dumps({
+    "import django": imported - started,
+    "django.setup()": configured - imported,
+    "import DjangoProject.asgi": loaded - configured,
+    "total": loaded - started,
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Показывает, сколько времени занимают импорт и django.setup() в чистом процессе."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=10, help="Сколько самых медленных импортов показать")
+
+    def handle(self, *args, **options):
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "DjangoProject.settings")}
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", PROBE],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            self.stderr.write(result.stderr)
+            return
+
+        for stage, seconds in json.loads(result.stdout.strip().splitlines()[-1]).items():
+            self.stdout.write(f"{stage:<28} {seconds * 1000:10.1f} ms")
+
+        # Строки -X importtime: "import time: self [us] | cumulative | imported package"
+        imports = []
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, module = line[len("import time:"):].split("|")
+            if not module.startswith("  "):
+                imports.append((int(cumulative), module.strip()))
+
+        self.stdout.write("")
+        self.stdout.write("Самые медленные импорты верхнего уровня:")
+        for cumulative, module in sorted(imports, reverse=True)[:options["top"]]:
+            self.stdout.write(f"{module:<40} {cumulative / 1000:10.1f} ms")
@@ -0,0 +1,54 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from assistant import Assistant
+from knowledge import read_rows, resolve_path, row_to_record, sync_knowledge
+from retrieval import get_async_qdrant
+
+
+class Command(BaseCommand):
+    help = (
+        "Синхронизирует коллекцию Qdrant с файлом базы знаний (xlsx, csv или jsonl): эмбеддинги пересчитываются "
+        "только для новых и измененных вопросов, правки ответов обновляют payload, удаленные строки удаляются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default="база знаний.xlsx")
+        parser.add_argument("--collection", default=settings.COLLECTION)
+        parser.add_argument("--batch-size", type=int, default=64)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--keep-missing", action="store_true", help="Не удалять записи, которых нет в файле")
+        parser.add_argument("--dry-run", action="store_true", help="Только показать, что изменится")
+
+    def handle(self, *args, **options):
+        path = resolve_path(options["path"])
+
+        async def run():
+            assistant = Assistant()
+            try:
+                report = await sync_knowledge(
+                    (row_to_record(row) for row in read_rows(path)),
+                    embed=assistant.get_embeddings,
+                    qdrant=get_async_qdrant(),
+                    collection=options["collection"],
+                    model=await assistant.get_embedding_model(),
+                    batch_size=options["batch_size"],
+                    concurrency=options["concurrency"],
+                    delete_missing=not options["keep_missing"],
+                    dry_run=options["dry_run"],
+                )
+                # Запасная коллекция (EMBEDDING_FALLBACK) повторяет ту, из которой читает Assistant.
+                if not options["dry_run"] and options["collection"] == settings.COLLECTION:
+                    await assistant.sync_fallback_collection(get_async_qdrant())
+                return report
+            finally:
+                await Assistant.shutdown()
+
+        report = asyncio.run(run())
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Будет: ' if options['dry_run'] else ''}новых {report.added}, пересчитано {report.reembedded}, "
+            f"обновлен payload {report.payload_updated}, удалено {report.deleted}, "
+            f"без изменений {report.unchanged} ({report.elapsed:.1f} с)"
+        ))
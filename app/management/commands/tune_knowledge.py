@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from qdrant_client.models import (
+    CollectionParamsDiff,
+    Disabled,
+    HnswConfigDiff,
+    PayloadSchemaType,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+)
+
+from knowledge import alias_target
+from retrieval import get_async_qdrant, get_qdrant
+
+
+def recall(expected: list, found: list) -> float:
+    """Доля точных top-k результатов, найденных приближенным поиском."""
+    return len(set(expected) & set(found)) / len(expected) if expected else 1.0
+
+
+def vector_bytes(dimension: int, quantized: bool) -> int:
+    """Сколько байт вектор занимает в памяти поиска: float32 или int8 после скалярной квантизации."""
+    return dimension * (1 if quantized else 4)
+
+
+def parse_payload_index(value: str) -> tuple[str, PayloadSchemaType]:
+    field, _, schema = value.partition(":")
+    try:
+        return field, PayloadSchemaType(schema or "keyword")
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Тип индекса {schema!r} не поддерживается: {', '.join(t.value for t in PayloadSchemaType)}"
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Применяет и показывает настройки коллекции базы знаний: HNSW m/ef_construct, скалярная "
+        "квантизация int8 с rescoring, payload на диске, payload-индексы. С --benchmark измеряет "
+        "recall и задержку поиска при текущих настройках против точного поиска."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--collection", default=settings.COLLECTION, help="Коллекция или alias")
+        parser.add_argument("--m", type=int, help="HNSW: число связей на узел")
+        parser.add_argument("--ef-construct", type=int, help="HNSW: ширина поиска при построении графа")
+        parser.add_argument("--quantization", choices=["int8", "none"], help="Скалярная квантизация векторов")
+        parser.add_argument("--quantile", type=float, default=0.99, help="Квантиль для границ int8")
+        parser.add_argument(
+            "--quantized-on-disk", action="store_true", help="Не держать квантованные векторы в RAM"
+        )
+        parser.add_argument(
+            "--on-disk-payload", action=argparse.BooleanOptionalAction, help="Хранить payload на диске"
+        )
+        parser.add_argument(
+            "--payload-index", type=parse_payload_index, action="append", default=[], metavar="FIELD[:TYPE]",
+            help="Создать payload-индекс, например content_hash:keyword или question:text",
+        )
+        parser.add_argument("--benchmark", action="store_true", help="Измерить recall и задержку поиска")
+        parser.add_argument("--queries", type=int, default=100, help="Сколько запросов в бенчмарке")
+        parser.add_argument("--limit", type=int, default=10, help="k для recall@k")
+        parser.add_argument("--ef", default="16,32,64,128", help="Значения hnsw_ef через запятую")
+        parser.add_argument("--oversampling", type=float, default=2.0, help="Oversampling при rescoring")
+        parser.add_argument("--noise", type=float, default=0.05, help="Шум к векторам записей, из которых делаются запросы")
+
+    def handle(self, *args, **options):
+        client = get_qdrant()
+        # Настройки меняются у самой коллекции, а не у alias.
+        collection = asyncio.run(alias_target(get_async_qdrant(), options["collection"])) or options["collection"]
+        if not client.collection_exists(collection):
+            raise CommandError(f"Коллекция {collection} не найдена")
+
+        self.apply(client, collection, options)
+        self.report(client, collection)
+        if options["benchmark"]:
+            self.benchmark(client, collection, options)
+
+    def apply(self, client, collection: str, options):
+        changes = {}
+        if options["m"] is not None or options["ef_construct"] is not None:
+            changes["hnsw_config"] = HnswConfigDiff(m=options["m"], ef_construct=options["ef_construct"])
+        if options["quantization"] == "int8":
+            changes["quantization_config"] = ScalarQuantization(scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8, quantile=options["quantile"], always_ram=not options["quantized_on_disk"],
+            ))
+        elif options["quantization"] == "none":
+            changes["quantization_config"] = Disabled.DISABLED
+        if options["on_disk_payload"] is not None:
+            changes["collection_params"] = CollectionParamsDiff(on_disk_payload=options["on_disk_payload"])
+
+        if changes:
+            client.update_collection(collection_name=collection, **changes)
+            self.stdout.write(self.style.SUCCESS(f"Обновлено: {', '.join(changes)}"))
+        for field, schema in options["payload_index"]:
+            client.create_payload_index(collection_name=collection, field_name=field, field_schema=schema, wait=True)
+            self.stdout.write(self.style.SUCCESS(f"Payload-индекс {field}: {schema.value}"))
+
+    def report(self, client, collection: str):
+        info = client.get_collection(collection)
+        params = info.config.params
+        hnsw = info.config.hnsw_config
+        quantized = info.config.quantization_config is not None
+        dimension = params.vectors.size
+        points = info.points_count or 0
+
+        self.stdout.write(f"Коллекция {collection}: {points} точек, размерность {dimension}, {params.vectors.distance.value}")
+        self.stdout.write(f"  HNSW: m={hnsw.m}, ef_construct={hnsw.ef_construct}, проиндексировано {info.indexed_vectors_count}")
+        quantization = info.config.quantization_config
+        if isinstance(quantization, ScalarQuantization):
+            quantization = (
+                f"{quantization.scalar.type.value}, quantile={quantization.scalar.quantile}, "
+                f"always_ram={quantization.scalar.always_ram}"
+            )
+        self.stdout.write(f"  квантизация: {quantization or 'нет'}")
+        self.stdout.write(f"  payload на диске: {'да' if params.on_disk_payload else 'нет'}")
+        self.stdout.write(f"  payload-индексы: {', '.join(info.payload_schema) or 'нет'}")
+        per_vector = vector_bytes(dimension, quantized)
+        self.stdout.write(
+            f"  векторы в памяти поиска: {per_vector} Б/вектор, {per_vector * points / 2 ** 20:.1f} МиБ всего"
+            + ("" if quantized else f" (с int8 - {vector_bytes(dimension, True)} Б/вектор)")
+        )
+
+    def benchmark(self, client, collection: str, options):
+        quantized = client.get_collection(collection).config.quantization_config is not None
+        points, _ = client.scroll(
+            collection_name=collection, limit=options["queries"], with_payload=False, with_vectors=True
+        )
+        if not points:
+            self.stdout.write("Коллекция пуста - бенчмарк пропущен.")
+            return
+
+        # Запросы - векторы записей со случайным шумом, иначе лучший результат всегда совпадает с самой записью.
+        rng = np.random.default_rng(0)
+        queries = [
+            (np.asarray(point.vector) + rng.normal(0, options["noise"], len(point.vector))).tolist()
+            for point in points
+        ]
+        limit = options["limit"]
+        exact = [
+            [hit.id for hit in client.query_points(
+                collection_name=collection, query=query, limit=limit, search_params=SearchParams(exact=True)
+            ).points]
+            for query in queries
+        ]
+
+        self.stdout.write(f"Бенчмарк: {len(queries)} запросов, recall@{limit} против точного поиска")
+        for ef in (int(value) for value in options["ef"].split(",")):
+            for rescore in ((True, False) if quantized else (None,)):
+                search_params = SearchParams(
+                    hnsw_ef=ef,
+                    quantization=None if rescore is None else QuantizationSearchParams(
+                        rescore=rescore, oversampling=options["oversampling"]
+                    ),
+                )
+                recalls, latencies = [], []
+                for query, expected in zip(queries, exact):
+                    started_at = time.perf_counter()
+                    hits = client.query_points(
+                        collection_name=collection, query=query, limit=limit, search_params=search_params
+                    ).points
+                    latencies.append((time.perf_counter() - started_at) * 1000)
+                    recalls.append(recall(expected, [hit.id for hit in hits]))
+
+                mode = "" if rescore is None else (" rescore" if rescore else " без rescore")
+                self.stdout.write(
+                    f"  ef={ef:<4}{mode}: recall {statistics.fmean(recalls):.3f}, "
+                    f"p50 {statistics.median(latencies):.2f} мс, "
+                    f"p95 {np.percentile(latencies, 95):.2f} мс"
+                )
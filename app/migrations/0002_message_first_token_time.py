@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='first_token_time',
+            field=models.FloatField(blank=True, help_text='Время до первого токена в секундах', null=True),
+        ),
+    ]
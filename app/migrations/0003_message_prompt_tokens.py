@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_message_first_token_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='prompt_tokens',
+            field=models.PositiveIntegerField(blank=True, help_text='Размер промпта к модели в токенах', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_message_prompt_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='source',
+            field=models.CharField(blank=True, choices=[('llm', 'LLM'), ('knowledge_base', 'Knowledge base'), ('cache', 'Cache')], help_text='Чем сформирован ответ бота', max_length=14, null=True),
+        ),
+    ]
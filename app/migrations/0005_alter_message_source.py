@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 21:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_message_source'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='source',
+            field=models.CharField(blank=True, choices=[('llm', 'LLM'), ('knowledge_base', 'Knowledge base'), ('cache', 'Cache'), ('degraded', 'Degraded')], help_text='Чем сформирован ответ бота', max_length=14, null=True),
+        ),
+    ]
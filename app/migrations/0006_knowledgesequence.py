@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_alter_message_source'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeSequence',
+            fields=[
+                ('collection', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('next_id', models.BigIntegerField(help_text='Следующий свободный id')),
+            ],
+        ),
+    ]
@@ -1,7 +1,7 @@
 import uuid
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
 
@@ -18,12 +18,23 @@ class Chat(models.Model):
 
 class Message(models.Model):
     ROLE_CHOICES = [("user", "User"), ("assistant", "Assistant")]
+    SOURCE_CHOICES = [
+        ("llm", "LLM"),
+        ("knowledge_base", "Knowledge base"),
+        ("cache", "Cache"),
+        ("degraded", "Degraded"),
+    ]
 
     chat = models.ForeignKey(Chat, related_name="messages", on_delete=models.CASCADE)
     role = models.CharField(max_length=9, choices=ROLE_CHOICES)
     content = models.TextField()
     created_at = models.DateTimeField(default=timezone.now)
     response_time = models.FloatField(null=True, blank=True, help_text="Время ответа в секундах")
+    first_token_time = models.FloatField(null=True, blank=True, help_text="Время до первого токена в секундах")
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True, help_text="Размер промпта к модели в токенах")
+    source = models.CharField(
+        max_length=14, choices=SOURCE_CHOICES, null=True, blank=True, help_text="Чем сформирован ответ бота"
+    )
 
     class Meta:
         ordering = ["created_at"]
@@ -44,3 +55,29 @@ class SiteAdministrator(User):
         proxy = True
         verbose_name = "Administrator"
         verbose_name_plural = "Administrators"
+
+
+class KnowledgeSequence(models.Model):
+    """Счетчик id записей базы знаний в коллекции Qdrant.
+
+    Блоки id выдаются под блокировкой строки, поэтому параллельные правки из разных
+    процессов не получают одинаковых id.
+    """
+
+    collection = models.CharField(max_length=255, primary_key=True)
+    next_id = models.BigIntegerField(help_text="Следующий свободный id")
+
+    @classmethod
+    def allocate(cls, collection: str, count: int, floor: int = 1) -> list[int]:
+        """Выдает count новых id, не меньших floor."""
+        with transaction.atomic():
+            sequence, _ = cls.objects.select_for_update().get_or_create(
+                collection=collection, defaults={"next_id": floor}
+            )
+            start = max(sequence.next_id, floor)
+            sequence.next_id = start + count
+            sequence.save(update_fields=["next_id"])
+        return list(range(start, start + count))
+
+    def __str__(self) -> str:
+        return f"{self.collection}: {self.next_id}"
@@ -1,5 +1,7 @@
 import asyncio
+import json
 import os
+import time
 from datetime import datetime, timedelta, timezone
 from unittest.mock import AsyncMock, patch
 
@@ -7,39 +9,55 @@ from django.test import SimpleTestCase
 from qdrant_client.models import Distance, VectorParams, PointStruct
 
 from assistant import Assistant
+from knowledge import content_hash, switch_alias, sync_knowledge
+from retrieval import get_async_qdrant, get_qdrant
 
 
-def _fake_requests_post(url, headers=None, data=None, verify=None):
-    class Resp:
-        def json(self_inner):
-            return {
-                "access_token": "token-from-auth",
-                "expires_at": int((datetime.now(timezone.utc) + timedelta(hours=1)).timestamp() * 1000),
-            }
+class FakeStream:
+    def __init__(self, lines, delay=0.0):
+        self._lines = list(lines)
+        self._delay = delay
 
-    return Resp()
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._lines:
+            raise StopAsyncIteration
+        await asyncio.sleep(self._delay)
+        return self._lines.pop(0)
 
 
 class FakeResponse:
-    def __init__(self, payload):
+    def __init__(self, payload, status=200, headers=None, delay=0.0):
         self._payload = payload
+        self.status = status
+        self.headers = headers or {}
+        self.content = FakeStream(payload if isinstance(payload, list) else [], delay)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
 
     async def json(self):
         return self._payload
 
 
 class FakeSession:
+    created = 0
+
     def __init__(self, payload_factory):
+        FakeSession.created += 1
         self.payload_factory = payload_factory
+        self.closed = False
 
-    async def __aenter__(self):
-        return self
-
-    async def __aexit__(self, exc_type, exc, tb):
-        return False
+    async def close(self):
+        self.closed = True
 
-    async def post(self, url, headers=None, data=None, ssl=None):
-        return FakeResponse(self.payload_factory(url))
+    def post(self, url, headers=None, data=None, ssl=None):
+        return self.payload_factory(url, data, headers)
 
 
 class TestAssistant(SimpleTestCase):
@@ -48,26 +66,55 @@ class TestAssistant(SimpleTestCase):
         os.environ.setdefault("QDRANT_IN_MEMORY", "1")
         Assistant._Assistant__instance = None  # reset singleton across tests
 
-        self.requests_patcher = patch("assistant.requests.post", side_effect=_fake_requests_post)
-        self.requests_patcher.start()
-        self.addCleanup(self.requests_patcher.stop)
+        self.embedding_requests = []
+        self.oauth_requests = 0
+        self.rejected_tokens = set()
+        self.failing_paths = set()
+        self.throttled_once = set()
+        self.retry_after = "0.05"
+        self.stream_delay = 0.0
+
+        def respond(url, data, headers):
+            if headers.get("Authorization", "").removeprefix("Bearer ") in self.rejected_tokens:
+                return FakeResponse({"message": "Token has expired"}, status=401)
+            for path in list(self.throttled_once):
+                if url.endswith(path):
+                    self.throttled_once.discard(path)
+                    return FakeResponse({"message": "Too many requests"}, status=429, headers={"Retry-After": self.retry_after})
+            if any(url.endswith(path) for path in self.failing_paths):
+                return FakeResponse({"message": "Service unavailable"}, status=503)
+            return FakeResponse(payload_factory(url, data), delay=self.stream_delay)
 
-        def payload_factory(url):
+        def payload_factory(url, data):
             if url.endswith("/embeddings"):
-                return {"data": [{"embedding": [0.1, 0.2, 0.3]}]}
+                inputs = json.loads(data)["input"]
+                self.embedding_requests.append(inputs)
+                return {"data": [{"embedding": [0.1, 0.2, 0.3], "index": idx} for idx in range(len(inputs))]}
             if url.endswith("/oauth"):
+                self.oauth_requests += 1
                 return {
                     "access_token": "refreshed-token",
                     "expires_at": int((datetime.now(timezone.utc) + timedelta(hours=1)).timestamp() * 1000),
                 }
+            if json.loads(data).get("stream"):
+                return [
+                    b'data: {"choices": [{"delta": {"content": "generated "}}]}\n',
+                    b"\n",
+                    b'data: {"choices": [{"delta": {"content": "answer"}}]}\n',
+                    b"data: [DONE]\n",
+                ]
             return {"choices": [{"message": {"content": "generated answer"}}]}
 
-        self.session_patcher = patch("assistant.aiohttp.ClientSession", lambda: FakeSession(payload_factory))
+        FakeSession.created = 0
+        self.session_patcher = patch("assistant.aiohttp.ClientSession", lambda **kwargs: FakeSession(respond))
         self.session_patcher.start()
         self.addCleanup(self.session_patcher.stop)
 
         self.assistant = Assistant()
-        client = self.assistant._Assistant__qdrant
+        # Имитируем уже прогретый экземпляр с действующим токеном.
+        self.assistant._Assistant__access_token = "token-from-auth"
+        self.assistant._Assistant__expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+        client = get_qdrant()
         collection = self.assistant._Assistant__collection
         client.recreate_collection(
             collection_name=collection,
@@ -92,9 +139,372 @@ class TestAssistant(SimpleTestCase):
         answers = asyncio.run(self.assistant.answers("hello"))
         self.assertEqual(sorted(answers), ["A1", "A2"])
 
+    def test_answers_merge_lexical_hits_and_follow_knowledge_edits(self):
+        point = PointStruct(
+            id=3,
+            vector=[-0.3, 0.2, -0.1],
+            payload={"question": "Роутер ZXHN H298A", "answer": "A3", "related_questions": []},
+        )
+        get_qdrant().upsert(collection_name=self.assistant._Assistant__collection, points=[point])
+        # В тестовой базе всего три записи, поэтому IDF у любых слов невелик.
+        self.assistant._Assistant__min_lexical_score = 0.0
+
+        answers = asyncio.run(self.assistant.answers("Настройка ZXHN H298A"))
+        self.assertEqual(answers[0], "A3")
+
+        self.assistant.knowledge_changed(deleted=[3])
+        self.assertEqual(self.assistant.metrics()["lexical_index"]["documents"], 2)
+
+    def test_alias_switch_to_new_version_rebuilds_lexical_index(self):
+        client = get_qdrant()
+        for version, count in (("alias_switch_v1", 1), ("alias_switch_v2", 2)):
+            client.recreate_collection(version, vectors_config=VectorParams(size=3, distance=Distance.COSINE))
+            client.upsert(version, points=[
+                PointStruct(id=idx, vector=[0.1, 0.2, 0.3], payload={"question": f"Q{idx}", "answer": version})
+                for idx in range(1, count + 1)
+            ])
+        asyncio.run(switch_alias(get_async_qdrant(), "alias_switch", "alias_switch_v1"))
+        self.assistant._Assistant__collection = "alias_switch"
+        self.assistant._Assistant__alias_check_interval = 0
+
+        self.assertEqual(asyncio.run(self.assistant.answers("Q1")), ["alias_switch_v1"])
+        self.assertEqual(self.assistant.metrics()["lexical_index"]["documents"], 1)
+
+        asyncio.run(switch_alias(get_async_qdrant(), "alias_switch", "alias_switch_v2"))
+        self.assertEqual(asyncio.run(self.assistant.answers("Q1")), ["alias_switch_v2"] * 2)
+        self.assertEqual(self.assistant.metrics()["lexical_index"]["documents"], 2)
+
+    def test_writes_from_other_processes_drop_caches(self):
+        self.assistant._Assistant__alias_check_interval = 0
+        self.assertEqual(sorted(asyncio.run(self.assistant.answers("Q1"))), ["A1", "A2"])
+
+        # sync_knowledge в отдельной команде: Assistant этого процесса о правке не знает.
+        asyncio.run(sync_knowledge(
+            [{"id": 3, "question": "Q3", "answer": "A3", "related_questions": []}],
+            embed=self.assistant.get_embeddings,
+            qdrant=get_async_qdrant(),
+            collection=self.assistant._Assistant__collection,
+            model="m",
+            delete_missing=False,
+        ))
+
+        self.assertEqual(sorted(asyncio.run(self.assistant.answers("Q3"))), ["A1", "A2", "A3"])
+        self.assertEqual(self.assistant.metrics()["lexical_index"]["documents"], 3)
+
+    def test_writes_from_other_processes_are_noticed_before_response_cache(self):
+        self.assistant._Assistant__alias_check_interval = 0
+        self.assertNotEqual(asyncio.run(self.assistant("hello")).source, "cache")
+        self.assertEqual(asyncio.run(self.assistant("hello")).source, "cache")
+
+        asyncio.run(sync_knowledge(
+            [{"id": 3, "question": "Q3", "answer": "A3", "related_questions": []}],
+            embed=self.assistant.get_embeddings,
+            qdrant=get_async_qdrant(),
+            collection=self.assistant._Assistant__collection,
+            model="m",
+            delete_missing=False,
+        ))
+
+        self.assertNotEqual(asyncio.run(self.assistant("hello")).source, "cache")
+
+    def test_confident_match_is_answered_from_knowledge_base(self):
+        self.assistant._Assistant__direct_answer_threshold = 0.99
+        process = AsyncMock()
+        with patch.object(Assistant, "_Assistant__process_message", new=process):
+            result = asyncio.run(self.assistant("hello", max_related=2))
+
+        process.assert_not_awaited()
+        self.assertEqual(result.source, "knowledge_base")
+        self.assertIn(result.answer, {"A1", "A2"})
+        self.assertEqual(len(result.related_questions), 2)
+        self.assertEqual(self.assistant.metrics()["direct_answers"]["served"], 1)
+
     def test_call_uses_process_message_result(self):
         expected = Assistant.Response(answer="done", related_questions=["r1"])
         with patch.object(Assistant, "_Assistant__process_message", new=AsyncMock(return_value=expected)):
             result = asyncio.run(self.assistant("payload", max_related=1))
         self.assertEqual(result.answer, "done")
         self.assertEqual(result.related_questions, ["r1"])
+
+    def test_http_session_is_reused_until_closed(self):
+        async def scenario():
+            await self.assistant.get_embedding("one")
+            await self.assistant.get_embedding("two")
+            created_before_close = FakeSession.created
+            await Assistant.shutdown()
+            await self.assistant.get_embedding("three")
+            return created_before_close
+
+        self.assertEqual(asyncio.run(scenario()), 1)
+        self.assertEqual(FakeSession.created, 2)
+
+    def test_concurrent_embeddings_are_sent_in_one_batch(self):
+        async def scenario():
+            return await asyncio.gather(*(self.assistant.get_embedding(f"q{idx}") for idx in range(5)))
+
+        vectors = asyncio.run(scenario())
+        self.assertEqual(vectors, [[0.1, 0.2, 0.3]] * 5)
+        self.assertEqual(self.embedding_requests, [["q0", "q1", "q2", "q3", "q4"]])
+
+    def test_get_embeddings_skips_cached_messages(self):
+        asyncio.run(self.assistant.get_embedding("cached"))
+        vectors = asyncio.run(self.assistant.get_embeddings(["cached", "fresh", "fresh"]))
+        self.assertEqual(len(vectors), 3)
+        self.assertEqual(self.embedding_requests, [["cached"], ["fresh"]])
+
+    def test_repeated_question_is_served_from_response_cache(self):
+        expected = Assistant.Response(answer="done", related_questions=["r1"])
+        process = AsyncMock(return_value=expected)
+        with patch.object(Assistant, "_Assistant__process_message", new=process):
+            asyncio.run(self.assistant("payload"))
+            cached = asyncio.run(self.assistant("payload again"))
+            self.assistant.knowledge_changed()
+            asyncio.run(self.assistant("payload"))
+
+        self.assertEqual(cached.answer, "done")
+        self.assertEqual(process.await_count, 2)
+        self.assertEqual(self.assistant.metrics()["response_cache"]["hits"], 1)
+
+    def test_stream_yields_deltas_then_response(self):
+        async def scenario():
+            return [chunk async for chunk in self.assistant.stream("hello", max_related=2)]
+
+        chunks = asyncio.run(scenario())
+        self.assertEqual(chunks[:-1], ["generated ", "answer"])
+        self.assertEqual(chunks[-1].answer, "generated answer")
+        self.assertEqual(len(chunks[-1].related_questions), 2)
+        self.assertGreater(chunks[-1].prompt_tokens, 0)
+
+    def test_stream_longer_than_completion_timeout_is_not_cut_off(self):
+        self.assistant._Assistant__completion_timeout = 0.05
+        self.assistant._Assistant__stream_idle_timeout = 0.08
+        self.stream_delay = 0.03
+
+        async def scenario(message):
+            return [chunk async for chunk in self.assistant.stream(message)]
+
+        # Четыре строки по 0.03 с - дольше общего таймаута, но паузы между фрагментами короче idle-таймаута.
+        chunks = asyncio.run(scenario("hello"))
+        self.assertEqual(chunks[-1].answer, "generated answer")
+        self.assertEqual(chunks[-1].source, "llm")
+
+        self.assistant._Assistant__response_cache.clear()
+        self.stream_delay = 0.2
+        chunks = asyncio.run(scenario("stalled"))
+        self.assertEqual(chunks[-1].source, "degraded")
+        self.assertIn("TimeoutError", self.assistant.metrics()["circuit_breakers"]["completions"]["last_error"])
+
+    def test_concurrent_callers_share_one_token_refresh(self):
+        self.assistant._Assistant__expires_at = datetime.now(timezone.utc) - timedelta(seconds=10)
+
+        async def scenario():
+            await asyncio.gather(*(self.assistant.get_embeddings([f"q{idx}"]) for idx in range(5)))
+
+        asyncio.run(scenario())
+        self.assertEqual(self.oauth_requests, 1)
+
+    def test_unauthorized_response_refreshes_token_and_retries(self):
+        self.rejected_tokens.add("token-from-auth")
+        embedding = asyncio.run(self.assistant.get_embedding("hello"))
+        self.assertEqual(embedding, [0.1, 0.2, 0.3])
+        self.assertEqual(self.oauth_requests, 1)
+        self.assertEqual(self.assistant._Assistant__access_token, "refreshed-token")
+
+    def test_token_is_renewed_in_background_before_expiry(self):
+        self.assistant._Assistant__expires_at = datetime.now(timezone.utc) + timedelta(seconds=60)
+
+        async def scenario():
+            await self.assistant.get_embedding("hello")
+            await asyncio.sleep(0.01)
+            await self.assistant.close()
+
+        asyncio.run(scenario())
+        self.assertEqual(self.oauth_requests, 1)
+        self.assertEqual(self.assistant._Assistant__access_token, "refreshed-token")
+
+    def test_init_does_not_touch_network_and_first_call_fetches_token(self):
+        Assistant._Assistant__instance = None
+        assistant = Assistant()
+        self.assertEqual(self.oauth_requests, 0)
+
+        asyncio.run(assistant.get_embedding("hello"))
+        self.assertEqual(self.oauth_requests, 1)
+
+    def test_token_refresher_survives_first_token_fetch(self):
+        Assistant._Assistant__instance = None
+        assistant = Assistant()
+
+        async def scenario():
+            await assistant.get_embedding("hello")
+            await asyncio.sleep(0.01)
+            refresher = assistant._Assistant__token_refresher
+            self.assertFalse(refresher.done(), refresher.done() and refresher.exception())
+            await assistant.close()
+
+        asyncio.run(scenario())
+        self.assertEqual(self.oauth_requests, 1)
+
+    def test_slow_remote_embeddings_fall_back_to_local_collection(self):
+        env = {"EMBEDDING_FALLBACK": "local", "EMBEDDING_FALLBACK_TIMEOUT": "0.05", "LOCAL_EMBEDDINGS_DIM": "16"}
+        with patch.dict(os.environ, env):
+            Assistant._Assistant__instance = None
+            assistant = Assistant()
+        assistant._Assistant__access_token = "token-from-auth"
+        assistant._Assistant__expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+
+        fallback = assistant._Assistant__fallback_embedder
+        get_qdrant().recreate_collection(
+            collection_name="que_local",
+            vectors_config=VectorParams(size=16, distance=Distance.COSINE),
+        )
+        get_qdrant().upsert(
+            collection_name="que_local",
+            points=[PointStruct(
+                id=1,
+                vector=fallback.transform(["hello"])[0].tolist(),
+                payload={"question": "hello", "answer": "local answer", "related_questions": []},
+            )],
+        )
+
+        async def slow_submit(message):
+            await asyncio.sleep(1)
+            return [0.1, 0.2, 0.3]
+
+        with patch.object(assistant._Assistant__embedding_batcher, "submit", new=slow_submit):
+            answers = asyncio.run(assistant.answers("hello"))
+
+        self.assertEqual(answers, ["local answer"])
+        self.assertEqual(assistant.metrics()["embeddings"]["fallbacks"], 1)
+
+    def test_local_backend_reports_model_without_reading_corpus_on_the_loop(self):
+        with patch.dict(os.environ, {"EMBEDDING_BACKEND": "local", "LOCAL_EMBEDDINGS_DIM": "16"}):
+            Assistant._Assistant__instance = None
+            assistant = Assistant()
+        embedder = assistant._Assistant__embedder
+
+        self.assertIsNone(assistant.metrics()["embeddings"]["model"])
+        self.assertFalse(embedder.prepared)
+
+        model = asyncio.run(assistant.get_embedding_model())
+        self.assertTrue(model.startswith("local-char-ngram-16-"))
+        self.assertEqual(assistant.metrics()["embeddings"]["model"], model)
+
+    def test_fallback_collection_follows_main_collection(self):
+        env = {"EMBEDDING_FALLBACK": "local", "LOCAL_EMBEDDINGS_DIM": "16"}
+        with patch.dict(os.environ, env):
+            Assistant._Assistant__instance = None
+            assistant = Assistant()
+        if get_qdrant().collection_exists("que_local"):
+            get_qdrant().delete_collection("que_local")
+        fallback = assistant._Assistant__fallback_embedder
+
+        report = asyncio.run(assistant.sync_fallback_collection(get_async_qdrant()))
+
+        self.assertEqual(report.added, 2)
+        points = get_qdrant().retrieve("que_local", ids=[1, 2], with_vectors=True)
+        self.assertEqual([point.payload["answer"] for point in points], ["A1", "A2"])
+        self.assertEqual(len(points[0].vector), 16)
+        self.assertEqual(points[0].payload["content_hash"], content_hash("Q1", fallback.model))
+
+        record = {"id": 3, "question": "Q3", "answer": "A3", "related_questions": []}
+        asyncio.run(assistant.apply_fallback_changes(get_async_qdrant(), [record], deleted=[1]))
+        self.assertEqual(sorted(point.id for point in get_qdrant().scroll("que_local")[0]), [2, 3])
+
+        # Повторная синхронизация ничего не пересчитывает, но убирает записи, которых нет в основной.
+        report = asyncio.run(assistant.sync_fallback_collection(get_async_qdrant()))
+        self.assertEqual((report.added, report.reembedded, report.deleted), (1, 0, 1))
+        self.assertEqual(sorted(point.id for point in get_qdrant().scroll("que_local")[0]), [1, 2])
+
+    def test_completion_outage_serves_knowledge_base_and_opens_breaker(self):
+        self.failing_paths.add("/chat/completions")
+        breaker = self.assistant._Assistant__completion_breaker
+        breaker.failure_threshold = 2
+
+        async def scenario():
+            return [await self.assistant(f"hello {idx}") for idx in range(3)]
+
+        responses = asyncio.run(scenario())
+
+        self.assertTrue(all(response.source == "degraded" for response in responses))
+        self.assertIn(responses[0].answer, {"A1", "A2"})
+        metrics = self.assistant.metrics()
+        self.assertEqual(metrics["circuit_breakers"]["completions"]["state"], "open")
+        self.assertEqual(metrics["degraded_responses"], 3)
+
+    def test_embedding_outage_without_keyword_match_hands_off_to_operator(self):
+        self.failing_paths.add("/embeddings")
+        response = asyncio.run(self.assistant("hello"))
+
+        self.assertEqual(response.source, "degraded")
+        self.assertIn("оператор", response.answer)
+
+    def test_rate_limited_call_waits_for_retry_after_and_shrinks_limit(self):
+        self.throttled_once.add("/embeddings")
+        started = time.monotonic()
+        embedding = asyncio.run(self.assistant.get_embedding("hello"))
+
+        self.assertEqual(embedding, [0.1, 0.2, 0.3])
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+        limiter = self.assistant.metrics()["rate_limiters"]["embeddings"]
+        self.assertEqual(limiter["throttled"], 1)
+        self.assertEqual(limiter["decreases"], 1)
+
+    def test_retry_after_longer_than_call_timeout_does_not_trip_breaker(self):
+        self.assistant._Assistant__embedding_timeout = 0.05
+        breaker = self.assistant._Assistant__embedding_breaker
+        breaker.failure_threshold = 1
+        self.throttled_once.add("/embeddings")
+        self.retry_after = "0.2"
+
+        started = time.monotonic()
+        embedding = asyncio.run(self.assistant.get_embedding("hello"))
+
+        self.assertEqual(embedding, [0.1, 0.2, 0.3])
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+        self.assertEqual(breaker.stats()["state"], "closed")
+        self.assertIsNone(breaker.stats()["last_error"])
+
+    def test_identical_concurrent_questions_share_one_pipeline(self):
+        async def slow_process(*args):
+            await asyncio.sleep(0.01)
+            return Assistant.Response(answer="done", related_questions=[])
+
+        process = AsyncMock(side_effect=slow_process)
+        with patch.object(Assistant, "_Assistant__process_message", new=process):
+            async def scenario():
+                return await asyncio.gather(
+                    self.assistant("Нет интернета"),
+                    self.assistant("  нет   ИНТЕРНЕТА "),
+                    self.assistant("Нет интернета"),
+                )
+
+            results = asyncio.run(scenario())
+
+        self.assertEqual([result.answer for result in results], ["done"] * 3)
+        self.assertEqual(process.await_count, 1)
+        self.assertEqual(len(self.embedding_requests), 1)
+        self.assertEqual(self.assistant.metrics()["coalescing"]["coalesced"], 2)
+
+    def test_identical_concurrent_streams_share_one_completion(self):
+        completions = []
+
+        async def scenario():
+            async def read(message):
+                return [chunk async for chunk in self.assistant.stream(message, max_related=2)]
+
+            return await asyncio.gather(read("Нет интернета"), read(" нет ИНТЕРНЕТА"), read("Нет интернета"))
+
+        original = Assistant._Assistant__stream_completion
+
+        def counting(assistant, data):
+            completions.append(data)
+            return original(assistant, data)
+
+        with patch.object(Assistant, "_Assistant__stream_completion", new=counting):
+            first, *others = asyncio.run(scenario())
+
+        self.assertEqual(len(completions), 1)
+        self.assertEqual(first[:-1], ["generated ", "answer"])
+        for chunks in others:
+            self.assertEqual(chunks, ["generated answer", first[-1]])
+        self.assertEqual(self.assistant.metrics()["coalescing"]["coalesced"], 2)
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from assistant import Assistant
+from caches import EmbeddingCache, SemanticResponseCache
+
+
+class TestEmbeddingCache(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "embeddings.sqlite3")
+
+    def test_memory_lru_evicts_oldest_and_counts_hits(self):
+        cache = EmbeddingCache(model="m", max_entries=2)
+
+        async def scenario():
+            await cache.put("a", [1.0])
+            await cache.put("b", [2.0])
+            self.assertEqual(await cache.get("  A "), [1.0])
+            await cache.put("c", [3.0])
+            return await cache.get("b"), await cache.get("a")
+
+        evicted, kept = asyncio.run(scenario())
+        self.assertIsNone(evicted)
+        self.assertEqual(kept, [1.0])
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 1))
+
+    def test_memory_tier_is_bounded_by_bytes(self):
+        cache = EmbeddingCache(model="m", max_entries=100, max_bytes=3 * 1024 * 4)
+
+        async def scenario():
+            for idx in range(5):
+                await cache.put(f"q{idx}", [float(idx)] * 1024)
+            return [await cache.get(f"q{idx}") for idx in range(5)]
+
+        vectors = asyncio.run(scenario())
+        self.assertEqual(vectors[:2], [None, None])
+        self.assertEqual(vectors[4], [4.0] * 1024)
+        self.assertIsInstance(vectors[4], list)
+        # float32: 4 байта на измерение.
+        self.assertEqual(cache.stats()["memory_bytes"], 3 * 1024 * 4)
+
+    def test_disk_tier_survives_restart_and_keeps_models_apart(self):
+        first = EmbeddingCache(model="m1", path=self.path)
+        asyncio.run(first.put("вопрос", [0.5, 0.25]))
+        first.close()
+
+        second = EmbeddingCache(model="m1", path=self.path)
+        self.assertEqual(asyncio.run(second.get("Вопрос")), [0.5, 0.25])
+        self.assertEqual(second.stats()["disk_hits"], 1)
+        second.close()
+
+        third = EmbeddingCache(model="m2", path=self.path)
+        self.assertIsNone(asyncio.run(third.get("вопрос")))
+        third.close()
+
+        # Открытие файла с другой моделью не стирает векторы первой.
+        fourth = EmbeddingCache(model="m1", path=self.path)
+        self.assertEqual(asyncio.run(fourth.get("вопрос")), [0.5, 0.25])
+        fourth.close()
+
+    def test_disk_tier_is_bounded(self):
+        cache = EmbeddingCache(model="m", max_entries=1, path=self.path, max_disk_entries=2)
+
+        async def scenario():
+            for idx in range(4):
+                await cache.put(f"q{idx}", [float(idx)])
+            return [await cache.get(f"q{idx}") for idx in range(4)]
+
+        self.assertEqual(asyncio.run(scenario()), [None, None, [2.0], [3.0]])
+        cache.close()
+
+
+class TestSemanticResponseCache(SimpleTestCase):
+    def test_similar_question_gets_cached_answer(self):
+        cache = SemanticResponseCache(threshold=0.95, ttl=60, max_entries=4)
+        cache.put([1.0, 0.0, 0.0], Assistant.Response(answer="a", related_questions=["r1", "r2"]), 5, 1.5)
+
+        hit = cache.get([0.99, 0.05, 0.0], max_related=1)
+        miss = cache.get([0.0, 1.0, 0.0], max_related=1)
+
+        self.assertEqual(hit.answer, "a")
+        self.assertEqual(hit.related_questions, ["r1"])
+        self.assertIsNone(miss)
+        self.assertEqual(cache.stats()["latency_saved_s"], 1.5)
+
+    def test_expired_and_cleared_entries_are_not_served(self):
+        expired = SemanticResponseCache(threshold=0.9, ttl=-1, max_entries=4)
+        expired.put([1.0, 0.0], Assistant.Response(answer="a", related_questions=[]), 5, 1.0)
+        self.assertIsNone(expired.get([1.0, 0.0], max_related=5))
+
+        cleared = SemanticResponseCache(threshold=0.9, ttl=60, max_entries=4)
+        cleared.put([1.0, 0.0], Assistant.Response(answer="a", related_questions=[]), 5, 1.0)
+        cleared.clear()
+        self.assertIsNone(cleared.get([1.0, 0.0], max_related=5))
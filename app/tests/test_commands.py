@@ -0,0 +1,61 @@
+import os
+import warnings
+from io import StringIO
+
+import numpy as np
+from django.core.management import call_command
+from django.test import SimpleTestCase
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+from app.management.commands.calibrate_direct_answers import choose_threshold
+from app.management.commands.tune_knowledge import recall, vector_bytes
+from retrieval import get_qdrant
+
+
+class TestCalibrateDirectAnswers(SimpleTestCase):
+    def test_picks_lowest_threshold_with_target_precision(self):
+        samples = [(0.99, True), (0.97, True), (0.95, True), (0.93, False), (0.92, True), (0.80, False)]
+
+        self.assertEqual(choose_threshold(samples, target_precision=1.0, min_support=2), (0.95, 1.0, 3))
+        self.assertEqual(choose_threshold(samples, target_precision=0.8, min_support=2), (0.92, 0.8, 5))
+        self.assertIsNone(choose_threshold(samples, target_precision=1.0, min_support=4))
+
+
+class TestTuneKnowledge(SimpleTestCase):
+    def test_recall_and_int8_memory_estimate(self):
+        self.assertEqual(recall([1, 2, 3, 4], [4, 3, 9, 8]), 0.5)
+        self.assertEqual(recall([], []), 1.0)
+        self.assertEqual(vector_bytes(1024, quantized=False), 4096)
+        self.assertEqual(vector_bytes(1024, quantized=True), 1024)
+
+    def test_applies_settings_reports_and_benchmarks(self):
+        os.environ.setdefault("QDRANT_IN_MEMORY", "1")
+        client = get_qdrant()
+        client.recreate_collection("tune_test", vectors_config=VectorParams(size=16, distance=Distance.COSINE))
+        vectors = np.random.default_rng(1).normal(size=(50, 16))
+        client.upsert("tune_test", points=[
+            PointStruct(id=idx, vector=vector.tolist(), payload={"question": f"Q{idx}", "content_hash": str(idx)})
+            for idx, vector in enumerate(vectors, start=1)
+        ])
+
+        out = StringIO()
+        with warnings.catch_warnings():
+            # Локальный клиент ищет точным перебором и предупреждает, что search_params не действуют.
+            warnings.simplefilter("ignore", UserWarning)
+            call_command(
+                "tune_knowledge", "--collection", "tune_test", "--m", "8", "--ef-construct", "64",
+                "--quantization", "int8", "--payload-index", "content_hash:keyword",
+                "--benchmark", "--queries", "10", "--limit", "5", "--ef", "16,64", stdout=out,
+            )
+        output = out.getvalue()
+
+        self.assertIn("Обновлено: hnsw_config, quantization_config", output)
+        self.assertIn("Payload-индекс content_hash: keyword", output)
+        self.assertIn("Коллекция tune_test: 50 точек, размерность 16, Cosine", output)
+        self.assertIn("  HNSW: m=", output)
+        self.assertIn("  квантизация: ", output)
+        self.assertIn("Б/вектор", output)
+        self.assertIn("Бенчмарк: 10 запросов, recall@5 против точного поиска", output)
+        # Локальный клиент ищет точно, поэтому recall против точного поиска - 1.
+        self.assertRegex(output, r"ef=16 .*: recall 1\.000, p50 [\d.]+ мс, p95 [\d.]+ мс")
+        self.assertRegex(output, r"ef=64 .*: recall 1\.000")
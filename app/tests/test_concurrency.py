@@ -0,0 +1,219 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from concurrency import (
+    AdaptiveLimiter,
+    CircuitBreaker,
+    CircuitOpen,
+    Priority,
+    Scheduler,
+    SchedulerOverloaded,
+    SingleFlight,
+)
+
+
+class TestScheduler(SimpleTestCase):
+    def test_limits_concurrent_tasks(self):
+        scheduler = Scheduler(concurrency=2, max_queue=10)
+        active = 0
+        peak = 0
+
+        async def job():
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return "ok"
+
+        async def scenario():
+            return await asyncio.gather(*(scheduler.run(Priority.CHAT, job) for _ in range(6)))
+
+        results = asyncio.run(scenario())
+        self.assertEqual(results, ["ok"] * 6)
+        self.assertEqual(peak, 2)
+        self.assertEqual(scheduler.stats()["completed"], 6)
+
+    def test_higher_priority_runs_first(self):
+        scheduler = Scheduler(concurrency=1, max_queue=10)
+        order = []
+
+        async def job(name):
+            order.append(name)
+            await asyncio.sleep(0)
+
+        async def scenario():
+            release = asyncio.Event()
+            blocker = asyncio.create_task(scheduler.run(Priority.CHAT, release.wait))
+            await asyncio.sleep(0)
+            waiting = [
+                asyncio.create_task(scheduler.run(Priority.ADMIN, job, "admin")),
+                asyncio.create_task(scheduler.run(Priority.SUGGESTIONS, job, "suggestions")),
+                asyncio.create_task(scheduler.run(Priority.CHAT, job, "chat")),
+            ]
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.stats()["queue_depth"], 3)
+            release.set()
+            await asyncio.gather(blocker, *waiting)
+
+        asyncio.run(scenario())
+        self.assertEqual(order, ["chat", "suggestions", "admin"])
+
+    def test_rejects_when_queue_is_full(self):
+        scheduler = Scheduler(concurrency=1, max_queue=1)
+
+        async def scenario():
+            release = asyncio.Event()
+            blocker = asyncio.create_task(scheduler.run(Priority.CHAT, release.wait))
+            await asyncio.sleep(0)
+            queued = asyncio.create_task(scheduler.run(Priority.CHAT, asyncio.sleep, 0))
+            await asyncio.sleep(0)
+            with self.assertRaises(SchedulerOverloaded):
+                await scheduler.run(Priority.CHAT, asyncio.sleep, 0)
+            release.set()
+            await asyncio.gather(blocker, queued)
+
+        asyncio.run(scenario())
+        self.assertEqual(scheduler.stats()["rejected"], 1)
+
+
+class TestSingleFlight(SimpleTestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "token"
+
+        async def scenario():
+            return await asyncio.gather(*(flight.do("key", fetch) for _ in range(4)))
+
+        self.assertEqual(asyncio.run(scenario()), ["token"] * 4)
+        self.assertEqual(calls, 1)
+        self.assertEqual(flight.coalesced, 3)
+        self.assertEqual(flight.in_flight, 0)
+
+
+class TestCircuitBreaker(SimpleTestCase):
+    def test_opens_after_failures_and_recovers_through_trial_call(self):
+        breaker = CircuitBreaker("upstream", failure_threshold=2, recovery_timeout=0.05)
+        calls = 0
+
+        async def failing():
+            nonlocal calls
+            calls += 1
+            raise ConnectionError("down")
+
+        async def ok():
+            return "ok"
+
+        async def scenario():
+            for _ in range(2):
+                with self.assertRaises(ConnectionError):
+                    await breaker.call(failing)
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+            with self.assertRaises(CircuitOpen):
+                await breaker.call(failing)
+            self.assertEqual(calls, 2)
+
+            await asyncio.sleep(0.06)
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertEqual(await breaker.call(ok), "ok")
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        asyncio.run(scenario())
+        self.assertEqual(breaker.stats()["rejected"], 1)
+
+    def test_ignored_errors_do_not_open_circuit(self):
+        breaker = CircuitBreaker("upstream", failure_threshold=1, ignore=(PermissionError,))
+
+        async def throttled():
+            raise PermissionError("429")
+
+        async def scenario():
+            for _ in range(3):
+                with self.assertRaises(PermissionError):
+                    await breaker.call(throttled)
+
+        asyncio.run(scenario())
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_timeout_counts_as_failure(self):
+        breaker = CircuitBreaker("upstream", failure_threshold=1, recovery_timeout=60)
+
+        async def scenario():
+            with self.assertRaises(asyncio.TimeoutError):
+                await breaker.call(asyncio.sleep, 1, timeout=0.01)
+
+        asyncio.run(scenario())
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+class FakeClock:
+    """Часы для AdaptiveLimiter: идут только при обращении и при явном сдвиге, а не от загрузки машины."""
+
+    def __init__(self, step: float = 0.001):
+        self.now = 100.0
+        self.step = step
+
+    def __call__(self) -> float:
+        self.now += self.step
+        return self.now
+
+
+class TestAdaptiveLimiter(SimpleTestCase):
+    def test_limit_grows_while_healthy_and_caps_concurrency(self):
+        limiter = AdaptiveLimiter("upstream", initial_limit=2, max_limit=3, clock=FakeClock(step=0))
+        active = 0
+        peak = 0
+
+        async def call():
+            nonlocal active, peak
+            async with limiter.slot() as permit:
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0)
+                permit.responded()
+                active -= 1
+
+        async def scenario():
+            await asyncio.gather(*(call() for _ in range(20)))
+
+        asyncio.run(scenario())
+        self.assertEqual(peak, 3)
+        self.assertEqual(limiter.limit, 3)
+
+    def test_throttling_halves_limit_once_and_pauses_new_calls(self):
+        clock = FakeClock()
+        limiter = AdaptiveLimiter("upstream", initial_limit=8, clock=clock)
+
+        async def throttled():
+            async with limiter.slot() as permit:
+                await asyncio.sleep(0)
+                permit.throttled(0.05)
+
+        async def call():
+            async with limiter.slot() as permit:
+                permit.responded()
+
+        async def scenario():
+            await asyncio.gather(*(throttled() for _ in range(4)))
+            self.assertEqual(limiter.limit, 4)
+
+            task = asyncio.create_task(call())
+            await asyncio.sleep(0)
+            self.assertFalse(task.done())
+            self.assertEqual(limiter.stats()["queue_depth"], 1)
+
+            clock.now += 0.05
+            await asyncio.wait_for(task, timeout=5)
+
+        asyncio.run(scenario())
+        self.assertEqual(limiter.stats()["calls"], 5)
+        self.assertEqual(limiter.stats()["throttled"], 4)
+        self.assertEqual(limiter.stats()["decreases"], 1)
@@ -0,0 +1,92 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+import numpy as np
+
+from embeddings import EmbeddingBatcher, LocalEmbeddings
+
+
+class TestEmbeddingBatcher(SimpleTestCase):
+    def test_full_batch_is_sent_without_waiting_and_duplicates_are_merged(self):
+        sent = []
+
+        async def send_batch(texts):
+            sent.append(texts)
+            return [[float(len(text))] for text in texts]
+
+        batcher = EmbeddingBatcher(send_batch, max_batch_size=3, max_delay=10)
+
+        async def scenario():
+            return await asyncio.wait_for(
+                asyncio.gather(batcher.submit("a"), batcher.submit("bb"), batcher.submit("a")),
+                timeout=1,
+            )
+
+        self.assertEqual(asyncio.run(scenario()), [[1.0], [2.0], [1.0]])
+        self.assertEqual(sent, [["a", "bb"]])
+        self.assertEqual(batcher.stats()["batches"], 1)
+
+    def test_errors_are_propagated_to_every_caller(self):
+        async def send_batch(texts):
+            raise RuntimeError("upstream failed")
+
+        batcher = EmbeddingBatcher(send_batch, max_batch_size=10, max_delay=0.001)
+
+        async def scenario():
+            return await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+
+        results = asyncio.run(scenario())
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+
+class TestLocalEmbeddings(SimpleTestCase):
+    def setUp(self):
+        self.embeddings = LocalEmbeddings(dimension=256).fit([
+            "Как подключить интернет?",
+            "Как оплатить услуги связи?",
+            "Не работает телевидение",
+        ])
+
+    def test_vectors_are_normalized_and_deterministic(self):
+        first = asyncio.run(self.embeddings.embed(["Как подключить интернет"]))[0]
+        second = asyncio.run(self.embeddings.embed(["как  подключить ИНТЕРНЕТ"]))[0]
+        self.assertEqual(len(first), 256)
+        self.assertAlmostEqual(float(np.linalg.norm(first)), 1.0, places=5)
+        np.testing.assert_allclose(first, second, rtol=1e-6)
+
+    def test_paraphrase_is_closer_than_unrelated_question(self):
+        query, paraphrase, unrelated = self.embeddings.transform([
+            "подключить интернет",
+            "Как подключить домашний интернет?",
+            "Не работает телевидение",
+        ])
+        self.assertGreater(query @ paraphrase, query @ unrelated)
+
+    def test_missing_corpus_falls_back_to_uniform_weights(self):
+        embeddings = LocalEmbeddings(dimension=64, corpus_path="missing.xlsx")
+        vector = embeddings.transform(["вопрос"])[0]
+        self.assertAlmostEqual(float(np.linalg.norm(vector)), 1.0, places=5)
+
+    def test_model_changes_with_corpus(self):
+        same = LocalEmbeddings(dimension=256).fit([
+            "Не работает телевидение",
+            "как подключить интернет?",
+            "Как оплатить услуги связи?",
+        ])
+        changed = LocalEmbeddings(dimension=256).fit(["Как подключить интернет?"])
+
+        self.assertEqual(same.model, self.embeddings.model)
+        self.assertNotEqual(changed.model, self.embeddings.model)
+        self.assertTrue(self.embeddings.model.startswith("local-char-ngram-256-"))
+
+    def test_model_is_unavailable_until_corpus_is_read_off_the_event_loop(self):
+        embeddings = LocalEmbeddings(dimension=64, corpus_path="missing.xlsx")
+
+        self.assertFalse(embeddings.prepared)
+        with self.assertRaises(RuntimeError):
+            embeddings.model
+
+        asyncio.run(embeddings.prepare())
+        self.assertTrue(embeddings.prepared)
+        self.assertTrue(embeddings.model.startswith("local-char-ngram-64-"))
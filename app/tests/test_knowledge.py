@@ -0,0 +1,238 @@
+import asyncio
+import os
+import tempfile
+import threading
+
+from django.test import SimpleTestCase
+
+from knowledge import (
+    IngestCheckpoint,
+    alias_target,
+    dump_snapshot,
+    ingest_knowledge,
+    load_snapshot,
+    read_rows,
+    reindex_knowledge,
+    rollback_knowledge,
+    row_to_record,
+    sync_knowledge,
+)
+from retrieval import get_async_qdrant, get_qdrant
+
+
+def records(count):
+    return [
+        {"id": idx, "question": f"Вопрос {idx}", "answer": f"Ответ {idx}", "related_questions": []}
+        for idx in range(1, count + 1)
+    ]
+
+
+class TestIngestKnowledge(SimpleTestCase):
+    collection = "ingest_test"
+
+    def setUp(self):
+        os.environ.setdefault("QDRANT_IN_MEMORY", "1")
+        if get_qdrant().collection_exists(self.collection):
+            get_qdrant().delete_collection(self.collection)
+        self.embedded = []
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint_path = os.path.join(directory.name, "checkpoint.json")
+
+    async def embed(self, texts):
+        self.embedded.append(len(texts))
+        return [[1.0, float(len(text)), 0.5] for text in texts]
+
+    def ingest(self, rows, **kwargs):
+        return asyncio.run(ingest_knowledge(
+            rows, embed=self.embed, qdrant=get_async_qdrant(), collection=self.collection, batch_size=4, **kwargs
+        ))
+
+    def test_rows_are_embedded_and_upserted_in_chunks(self):
+        report = self.ingest(records(10), concurrency=2)
+
+        self.assertEqual((report.rows, report.chunks), (10, 3))
+        self.assertEqual(sorted(self.embedded), [2, 4, 4])
+        self.assertEqual(get_qdrant().count(self.collection).count, 10)
+
+    def test_interrupted_run_resumes_from_checkpoint(self):
+        calls = 0
+
+        async def flaky_embed(texts):
+            nonlocal calls
+            calls += 1
+            if calls == 2:
+                raise ConnectionError("upstream down")
+            return await self.embed(texts)
+
+        checkpoint = IngestCheckpoint(self.checkpoint_path, key="source")
+        with self.assertRaises(ConnectionError):
+            asyncio.run(ingest_knowledge(
+                records(12), embed=flaky_embed, qdrant=get_async_qdrant(), collection=self.collection,
+                batch_size=4, concurrency=1, checkpoint=checkpoint, retries=1,
+            ))
+        self.assertEqual(IngestCheckpoint(self.checkpoint_path, key="source").done, {0})
+
+        report = self.ingest(records(12), checkpoint=IngestCheckpoint(self.checkpoint_path, key="source"))
+        self.assertEqual((report.rows, report.skipped), (8, 4))
+        self.assertEqual(get_qdrant().count(self.collection).count, 12)
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_sync_reembeds_only_changed_questions(self):
+        asyncio.run(sync_knowledge(
+            records(6), embed=self.embed, qdrant=get_async_qdrant(), collection=self.collection, model="m1",
+        ))
+        self.embedded.clear()
+
+        rows = records(7)[1:]
+        rows[0]["question"] = "Новый вопрос 2"
+        rows[1]["answer"] = "Новый ответ 3"
+        report = asyncio.run(sync_knowledge(
+            rows, embed=self.embed, qdrant=get_async_qdrant(), collection=self.collection, model="m1",
+        ))
+
+        self.assertEqual(
+            (report.added, report.reembedded, report.payload_updated, report.deleted, report.unchanged),
+            (1, 1, 1, 1, 3),
+        )
+        self.assertEqual(sum(self.embedded), 2)
+        points = {point.id: point.payload for point in get_qdrant().scroll(self.collection, limit=100)[0]}
+        self.assertEqual(sorted(points), [2, 3, 4, 5, 6, 7])
+        self.assertEqual(points[3]["answer"], "Новый ответ 3")
+
+        self.embedded.clear()
+        report = asyncio.run(sync_knowledge(
+            rows, embed=self.embed, qdrant=get_async_qdrant(), collection=self.collection, model="m2",
+        ))
+        self.assertEqual(report.reembedded, 6)
+
+    def test_sync_streams_source_off_the_event_loop(self):
+        read = []
+        loop_thread = threading.get_ident()
+
+        def source():
+            for record in records(40):
+                read.append(threading.get_ident())
+                yield record
+
+        read_before_first_embed = None
+
+        async def embed(texts):
+            nonlocal read_before_first_embed
+            if read_before_first_embed is None:
+                read_before_first_embed = len(read)
+            return await self.embed(texts)
+
+        report = asyncio.run(sync_knowledge(
+            source(), embed=embed, qdrant=get_async_qdrant(), collection=self.collection, model="m1",
+            batch_size=4, concurrency=1,
+        ))
+
+        self.assertEqual(report.added, 40)
+        self.assertEqual(get_qdrant().count(self.collection).count, 40)
+        # Файл разбирается в пуле потоков, а эмбеддинги начинаются до того, как он прочитан целиком.
+        self.assertNotIn(loop_thread, read)
+        self.assertLess(read_before_first_embed, 40)
+
+    def test_row_to_record_splits_related_questions(self):
+        record = row_to_record({
+            "Номер вопроса": 7, "Вопрос": " Как? ", "Ответ": "Так", "Связанные вопросы": "Первый / Второй /",
+        })
+        self.assertEqual(record["id"], 7)
+        self.assertEqual(record["question"], "Как?")
+        self.assertEqual(record["related_questions"], ["Первый", "Второй"])
+
+    def test_snapshot_round_trip_restores_vectors_and_payloads(self):
+        self.ingest(records(10), model="m1")
+        snapshot = os.path.join(os.path.dirname(self.checkpoint_path), "snapshot")
+        self.assertEqual(dump_snapshot(get_qdrant(), self.collection, snapshot, page_size=3), 10)
+
+        self.addCleanup(get_qdrant().delete_collection, "snapshot_test")
+        self.assertEqual(load_snapshot(get_qdrant(), snapshot, "snapshot_test", batch_size=4, recreate=True), 10)
+        original = get_qdrant().retrieve(self.collection, ids=[7], with_vectors=True)[0]
+        restored = get_qdrant().retrieve("snapshot_test", ids=[7], with_vectors=True)[0]
+        self.assertEqual(restored.payload, original.payload)
+        for restored_value, original_value in zip(restored.vector, original.vector):
+            self.assertAlmostEqual(restored_value, original_value, places=6)
+
+    def test_read_rows_streams_csv_and_jsonl(self):
+        directory = os.path.dirname(self.checkpoint_path)
+        csv_path = os.path.join(directory, "kb.csv")
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write("Номер вопроса,Вопрос,Ответ,Связанные вопросы\n1,Как?,Так,Первый / Второй\n")
+        jsonl_path = os.path.join(directory, "kb.jsonl")
+        with open(jsonl_path, "w", encoding="utf-8") as f:
+            f.write('{"id": 1, "question": "Как?", "answer": "Так", "related_questions": ["Первый", "Второй"]}\n\n')
+
+        expected = [{"id": 1, "question": "Как?", "answer": "Так", "related_questions": ["Первый", "Второй"]}]
+        self.assertEqual([row_to_record(row) for row in read_rows(csv_path)], expected)
+        self.assertEqual([row_to_record(row) for row in read_rows(jsonl_path)], expected)
+        with self.assertRaises(ValueError):
+            read_rows(os.path.join(directory, "kb.txt"))
+
+
+class TestReindexKnowledge(SimpleTestCase):
+    alias = "reindex_test"
+
+    def setUp(self):
+        os.environ.setdefault("QDRANT_IN_MEMORY", "1")
+        for collection in get_qdrant().get_collections().collections:
+            if collection.name.startswith(f"{self.alias}_v"):
+                get_qdrant().delete_collection(collection.name)
+
+    async def embed(self, texts):
+        return [[1.0, float(len(text)), 0.5] for text in texts]
+
+    def reindex(self, rows, **kwargs):
+        return asyncio.run(reindex_knowledge(
+            rows, embed=self.embed, qdrant=get_async_qdrant(), alias=self.alias, batch_size=4, **kwargs
+        ))
+
+    def test_new_version_is_swapped_in_and_previous_kept_for_rollback(self):
+        first = self.reindex(records(3))
+        self.assertEqual((first.collection, first.previous), (f"{self.alias}_v1", None))
+        self.assertEqual(get_qdrant().count(self.alias).count, 3)
+
+        second = self.reindex(records(5))
+        self.assertEqual((second.collection, second.previous), (f"{self.alias}_v2", f"{self.alias}_v1"))
+        self.assertEqual(get_qdrant().count(self.alias).count, 5)
+
+        third = self.reindex(records(7))
+        self.assertEqual(third.dropped, [f"{self.alias}_v1"])
+
+        self.assertEqual(asyncio.run(rollback_knowledge(get_async_qdrant(), self.alias)), f"{self.alias}_v2")
+        self.assertEqual(asyncio.run(alias_target(get_async_qdrant(), self.alias)), f"{self.alias}_v2")
+        self.assertEqual(get_qdrant().count(self.alias).count, 5)
+
+    def test_plain_collection_becomes_first_version_and_rollback_target(self):
+        alias = "reindex_plain"
+        client = get_qdrant()
+        for name in (alias, f"{alias}_v0", f"{alias}_v1"):
+            if client.collection_exists(name):
+                client.delete_collection(name)
+        asyncio.run(ingest_knowledge(records(4), embed=self.embed, qdrant=get_async_qdrant(), collection=alias))
+        vector = client.retrieve(alias, ids=[1], with_vectors=True)[0].vector
+
+        report = asyncio.run(reindex_knowledge(
+            records(6), embed=self.embed, qdrant=get_async_qdrant(), alias=alias, batch_size=4,
+        ))
+
+        self.assertEqual((report.collection, report.previous), (f"{alias}_v1", f"{alias}_v0"))
+        self.assertEqual(client.count(f"{alias}_v0").count, 4)
+        for copied, original in zip(client.retrieve(f"{alias}_v0", ids=[1], with_vectors=True)[0].vector, vector):
+            self.assertAlmostEqual(copied, original, places=5)
+        self.assertEqual(asyncio.run(rollback_knowledge(get_async_qdrant(), alias)), f"{alias}_v0")
+        self.assertEqual(client.count(alias).count, 4)
+
+    def test_failed_build_leaves_live_version_untouched(self):
+        self.reindex(records(3))
+
+        async def broken_embed(texts):
+            raise ConnectionError("upstream down")
+
+        with self.assertRaises(ConnectionError):
+            asyncio.run(reindex_knowledge(
+                records(5), embed=broken_embed, qdrant=get_async_qdrant(), alias=self.alias, batch_size=4, retries=1,
+            ))
+        self.assertEqual(asyncio.run(alias_target(get_async_qdrant(), self.alias)), f"{self.alias}_v1")
+        self.assertFalse(get_qdrant().collection_exists(f"{self.alias}_v2"))
@@ -0,0 +1,191 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+from django.test import SimpleTestCase
+from qdrant_client.http.models import AliasDescription, CollectionsAliasesResponse, QueryResponse
+
+from concurrency import CircuitBreaker
+from knowledge import alias_target
+from retrieval import (
+    BM25Index,
+    ContextBuilder,
+    FallbackVectorStore,
+    LocalVectorStore,
+    NumpyIndex,
+    SearchHit,
+    estimate_tokens,
+    reciprocal_rank_fusion,
+    truncate_to_tokens,
+)
+
+
+def hit(score, question, answer):
+    return SimpleNamespace(score=score, payload={"question": question, "answer": answer, "related_questions": []})
+
+
+class TestTokenEstimation(SimpleTestCase):
+    def test_estimate_counts_words_and_punctuation(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("Да, тариф."), 5)
+        self.assertGreater(estimate_tokens("подключение интернета"), 2)
+
+    def test_truncate_respects_budget(self):
+        text = " ".join(["слово"] * 100)
+        shortened = truncate_to_tokens(text, 20)
+        self.assertTrue(shortened.endswith("…"))
+        self.assertLessEqual(estimate_tokens(shortened), 21)
+        self.assertEqual(truncate_to_tokens("коротко", 20), "коротко")
+
+
+class TestContextBuilder(SimpleTestCase):
+    def test_drops_low_scores_and_duplicates(self):
+        builder = ContextBuilder(min_score=0.5, max_tokens=500)
+        context, used = builder.build([
+            hit(0.9, "Как оплатить?", "Оплатить можно картой в личном кабинете"),
+            hit(0.8, "Как внести оплату?", "Оплатить можно картой в личном кабинете"),
+            hit(0.7, "Где офис?", "Адреса офисов есть на сайте"),
+            hit(0.2, "Погода", "Не знаю"),
+        ])
+
+        self.assertEqual([item.payload["question"] for item in used], ["Как оплатить?", "Где офис?"])
+        self.assertIn("Адреса офисов", context)
+        self.assertNotIn("Погода", context)
+        stats = builder.stats()
+        self.assertEqual((stats["below_score"], stats["duplicates"]), (1, 1))
+
+    def test_context_fits_token_budget(self):
+        builder = ContextBuilder(min_score=0.0, max_tokens=120, max_answer_tokens=80)
+        long_answer = " ".join(["тариф"] * 300)
+        context, used = builder.build([hit(0.9, f"Вопрос {idx}", f"{long_answer} {idx}") for idx in range(5)])
+
+        self.assertLessEqual(estimate_tokens(context), 120)
+        self.assertEqual(len(used), 2)
+        self.assertEqual(builder.stats()["truncated"], 2)
+
+
+class TestBM25Index(SimpleTestCase):
+    def setUp(self):
+        self.index = BM25Index()
+        self.index.upsert(1, {"question": "Как подключить тариф Игровой?", "answer": "Подключите тариф в личном кабинете"})
+        self.index.upsert(2, {"question": "Как настроить роутер ZXHN H298A?", "answer": "Инструкция для роутера на сайте"})
+        self.index.upsert(3, {"question": "Как оплатить услуги?", "answer": "Картой или через банк"})
+
+    def test_exact_terms_and_word_forms_are_found(self):
+        self.assertEqual(self.index.search("роутер h298a", limit=1)[0].id, 2)
+        self.assertEqual(self.index.search("тарифы игровые", limit=1)[0].id, 1)
+
+    def test_index_follows_updates_and_removals(self):
+        self.index.upsert(3, {"question": "Как сменить тариф?", "answer": "Через оператора"})
+        self.index.remove(2)
+
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.search("роутер"), [])
+        self.assertEqual(self.index.search("оплатить"), [])
+        self.assertEqual({hit.id for hit in self.index.search("тариф")}, {1, 3})
+
+
+class TestReciprocalRankFusion(SimpleTestCase):
+    def test_hits_found_by_both_searches_rank_first(self):
+        vector = [SearchHit(1, {}, 0.9), SearchHit(2, {}, 0.8)]
+        lexical = [SearchHit(3, {}, 7.0), SearchHit(2, {}, 5.0)]
+
+        fused = reciprocal_rank_fusion(vector, lexical)
+
+        self.assertEqual([hit.id for hit in fused], [2, 1, 3])
+        self.assertEqual((fused[0].vector_score, fused[0].lexical_score), (0.8, 5.0))
+        self.assertIsNone(fused[2].vector_score)
+
+
+class TestNumpyIndex(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.vectors = rng.normal(size=(200, 16)).astype(np.float32)
+        self.index = NumpyIndex(self.vectors, list(range(1, 201)), [{"answer": f"A{i}"} for i in range(1, 201)])
+
+    def test_top_k_matches_full_sort(self):
+        query = self.vectors[7] + 0.1
+        normalized = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        expected = (np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:5] + 1).tolist()
+
+        hits = self.index.search(query, limit=5)
+        self.assertEqual([hit.id for hit in hits], expected)
+        self.assertEqual(hits[0].payload, {"answer": f"A{expected[0]}"})
+        self.assertEqual(len(self.index.search(query, limit=500)), 200)
+
+    def test_index_follows_updates_and_removals(self):
+        self.index.upsert(8, [1.0] + [0.0] * 15, {"answer": "new"})
+        self.index.upsert(500, [0.0, 1.0] + [0.0] * 14, {"answer": "added"})
+        self.index.remove(1)
+
+        self.assertEqual(len(self.index), 200)
+        self.assertEqual(self.index.search([1.0] + [0.0] * 15, limit=1)[0].payload, {"answer": "new"})
+        self.assertEqual(self.index.search([0.0, 1.0] + [0.0] * 14, limit=1)[0].id, 500)
+        self.assertNotIn(1, [hit.id for hit in self.index.search(self.vectors[0], limit=200)])
+
+
+class UnreachableQdrant:
+    def __init__(self):
+        self.calls = 0
+
+    async def query_points(self, **kwargs):
+        self.calls += 1
+        raise ConnectionError("qdrant is down")
+
+
+class FlakyQdrant:
+    """Qdrant с alias que -> que_v1, который отвечает, пока up=True."""
+
+    def __init__(self):
+        self.up = True
+
+    async def get_aliases(self):
+        if not self.up:
+            raise ConnectionError("qdrant is down")
+        return CollectionsAliasesResponse(aliases=[AliasDescription(alias_name="que", collection_name="que_v1")])
+
+    async def query_points(self, **kwargs):
+        if not self.up:
+            raise ConnectionError("qdrant is down")
+        return QueryResponse(points=[])
+
+
+class TestFallbackVectorStore(SimpleTestCase):
+    def test_reads_switch_to_local_index_when_qdrant_is_unreachable(self):
+        index = NumpyIndex([[1.0, 0.0], [0.0, 1.0]], [1, 2], [{"answer": "A1"}, {"answer": "A2"}])
+        primary = UnreachableQdrant()
+        store = FallbackVectorStore(
+            primary, LocalVectorStore(lambda collection: index), CircuitBreaker("Qdrant", failure_threshold=2)
+        )
+
+        async def query():
+            return (await store.query_points(collection_name="que", query=[0.9, 0.1], limit=1)).points
+
+        for _ in range(4):
+            self.assertEqual(asyncio.run(query())[0].id, 1)
+        # После failure_threshold ошибок цепь разомкнута, и Qdrant больше не дергается.
+        self.assertEqual(primary.calls, 2)
+        self.assertEqual(store.stats()["fallbacks"], 4)
+
+    def test_alias_target_survives_qdrant_outage(self):
+        index = NumpyIndex([[1.0, 0.0], [0.0, 1.0]], [1, 2], [{"answer": "A1"}, {"answer": "A2"}])
+        primary = FlakyQdrant()
+        store = FallbackVectorStore(
+            primary, LocalVectorStore(lambda collection: index), CircuitBreaker("Qdrant", failure_threshold=1)
+        )
+
+        async def run():
+            before = await alias_target(store, "que")
+            await store.query_points(collection_name="que", query=[1.0, 0.0], limit=1)
+            await asyncio.sleep(0)  # фоновая загрузка локального индекса
+            primary.up = False
+            after = await alias_target(store, "que")
+            hits = (await store.query_points(collection_name="que", query=[0.1, 0.9], limit=1)).points
+            return before, after, hits
+
+        before, after, hits = asyncio.run(run())
+        # Пропавший при аварии alias читался бы как переключение версии и сбрасывал локальный индекс.
+        self.assertEqual(before, "que_v1")
+        self.assertEqual(after, "que_v1")
+        self.assertEqual(hits[0].id, 2)
+        self.assertEqual(store.stats()["local"]["collections"], {"que": 2})
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import uuid
 from datetime import timedelta
@@ -5,25 +6,53 @@ from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.http import JsonResponse
-from django.test import Client, TestCase, override_settings
+from django.test import AsyncClient, Client, TestCase, override_settings
 from django.utils import timezone
 from qdrant_client.models import Distance, PointStruct, VectorParams
 
 from app.models import Chat, Message
+from app.views import knowledge_count_key
 from assistant import Assistant
+from knowledge import knowledge_state
+from retrieval import get_async_qdrant
 
 
 class FakeAssistant:
+    async def get_embedding_model(self):
+        return "fake"
+
     async def __call__(self, message, max_related=5):
         return Assistant.Response(answer=f"echo:{message}", related_questions=["rel1", "rel2"][:max_related])
 
+    async def stream(self, message, max_related=5):
+        yield "echo:"
+        yield message
+        yield Assistant.Response(answer=f"echo:{message}", related_questions=["rel1"])
+
     async def answers(self, message):
         return [f"suggest:{message.lower()}"]
 
-    async def get_embedding(self, message):
+    async def get_embedding(self, message, priority=None):
         return [0.1, 0.2, 0.3]
 
+    async def get_embeddings(self, messages, priority=None):
+        return [[0.1, 0.2, 0.3] for _ in messages]
+
+    def metrics(self):
+        return {"scheduler": {"queue_depth": 0}}
+
+    def knowledge_changed(self, upserted=None, deleted=None):
+        pass
+
+    async def sync_fallback_collection(self, qdrant, source=None):
+        return None
+
+    async def apply_fallback_changes(self, qdrant, records, deleted):
+        pass
+
 
 @override_settings(ROOT_URLCONF="app.urlconf_testing")
 class TestViews(TestCase):
@@ -42,6 +71,7 @@ class TestViews(TestCase):
 
     def setUp(self):
         self.client = Client()
+        cache.clear()
         def _render_stub(request, template_name, context=None):
             data = context or {}
             return JsonResponse(json.loads(json.dumps(data, default=str)))
@@ -73,6 +103,20 @@ class TestViews(TestCase):
         self.assertEqual(Chat.objects.count(), 1)
         self.assertEqual(Message.objects.count(), 2)
 
+    async def test_chat_view_streams_reply_and_saves_first_token_time(self):
+        payload = {"message": "Привет", "chat_id": str(uuid.uuid4()), "stream": True}
+        response = await AsyncClient().post("/", data=json.dumps(payload), content_type="application/json")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        events = [json.loads(line) for line in body.decode().splitlines()]
+
+        self.assertEqual([event["delta"] for event in events[:-1]], ["echo:", "Привет"])
+        self.assertEqual(events[-1]["reply"], "echo:Привет")
+        self.assertTrue(events[-1]["done"])
+        reply = await Message.objects.aget(role="assistant")
+        self.assertIsNotNone(reply.first_token_time)
+        self.assertLessEqual(reply.first_token_time, reply.response_time)
+
     def test_chat_view_switches_to_operator(self):
         chat_id = str(uuid.uuid4())
         payload = {"message": "Позови оператора", "chat_id": chat_id}
@@ -151,6 +195,12 @@ class TestViews(TestCase):
         payload = response.json()
         self.assertIn("total_chats", payload.get("stats", {}))
 
+    def test_admin_metrics_returns_assistant_metrics(self):
+        self.client.force_login(self.admin)
+        response = self.client.get("/admin/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("scheduler", response.json())
+
     def test_admin_generate_pdf_returns_file(self):
         self.client.force_login(self.admin)
         with patch("app.views.AdminGeneratePDFView.render_to_pdf", return_value=b"pdf-bytes"):
@@ -216,7 +266,7 @@ class TestViews(TestCase):
             ],
         )
 
-        list_resp = self.client.get("/admin/knowledge/list/?page=1")
+        list_resp = self.client.get("/admin/knowledge/list/")
         self.assertEqual(list_resp.status_code, 200)
         self.assertGreaterEqual(list_resp.json()["pagination"]["total_items"], 1)
 
@@ -243,6 +293,121 @@ class TestViews(TestCase):
         deleted = self.client.delete("/admin/knowledge/1/")
         self.assertEqual(deleted.status_code, 200)
 
+    def test_admin_knowledge_list_pages_by_cursor_with_cached_count(self):
+        self._ensure_qdrant_ready()
+        self.client.force_login(self.admin)
+        settings.QDRANT.upsert(
+            collection_name=settings.COLLECTION,
+            points=[
+                PointStruct(id=point_id, vector=[0.1, 0.2, 0.3], payload={"question": "q", "answer": "a"})
+                for point_id in range(800, 825)
+            ],
+        )
+
+        seen, cursor, total = [], None, None
+        while True:
+            response = self.client.get("/admin/knowledge/list/", {"cursor": cursor} if cursor else {})
+            self.assertEqual(response.status_code, 200)
+            seen += [item["id"] for item in response.json()["items"]]
+            total = response.json()["pagination"]["total_items"]
+            cursor = response.json()["pagination"]["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertTrue(set(range(800, 825)) <= set(seen))
+        self.assertEqual(total, len(seen))
+
+        state = asyncio.run(knowledge_state(get_async_qdrant(), settings.COLLECTION))
+        self.assertEqual(cache.get(knowledge_count_key(state)), total)
+
+        # Запись из другого процесса (команда, другой воркер) меняет состояние, а с ним и ключ кэша.
+        settings.QDRANT.delete(settings.COLLECTION, points_selector=[824])
+        fresh = self.client.get("/admin/knowledge/list/").json()["pagination"]["total_items"]
+        self.assertEqual(fresh, total - 1)
+        self.client.delete("/admin/knowledge/823/")
+        fresh = self.client.get("/admin/knowledge/list/").json()["pagination"]["total_items"]
+        self.assertEqual(fresh, total - 2)
+
+        self.assertEqual(self.client.get("/admin/knowledge/list/", {"cursor": "!!"}).status_code, 400)
+
+    def test_admin_knowledge_bulk_applies_operations_with_fresh_ids(self):
+        self._ensure_qdrant_ready()
+        self.client.force_login(self.admin)
+        settings.QDRANT.upsert(
+            collection_name=settings.COLLECTION,
+            points=[
+                PointStruct(id=point_id, vector=[0.1, 0.2, 0.3], payload={"question": "q", "answer": "a"})
+                for point_id in (700, 701)
+            ],
+        )
+
+        item = {"question": ["new"], "answer": "a", "related_questions": ["r"]}
+        response = self.client.post(
+            "/admin/knowledge/bulk/",
+            data=json.dumps({"operations": [
+                {"op": "create", **item},
+                {"op": "create", **item},
+                {"op": "update", "id": 700, **item, "answer": "updated"},
+                {"op": "delete", "id": 701},
+            ]}),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        created = response.json()["created"]
+        self.assertEqual(len(set(created)), 2)
+        self.assertGreater(min(created), 701)
+        self.assertEqual(settings.QDRANT.retrieve(settings.COLLECTION, ids=[700])[0].payload["answer"], "updated")
+        self.assertEqual(settings.QDRANT.retrieve(settings.COLLECTION, ids=[701]), [])
+
+        # Точка, записанная в обход счетчика (импорт, sync_knowledge), не должна быть перезаписана.
+        settings.QDRANT.upsert(
+            collection_name=settings.COLLECTION,
+            points=[PointStruct(id=900, vector=[0.1, 0.2, 0.3], payload={"question": "q", "answer": "imported"})],
+        )
+        response = self.client.post(
+            "/admin/knowledge/bulk/",
+            data=json.dumps({"operations": [{"op": "create", **item}]}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()["created"], [901])
+        self.assertEqual(settings.QDRANT.retrieve(settings.COLLECTION, ids=[900])[0].payload["answer"], "imported")
+
+        # Следующие выдачи после собственных записей не проходят по коллекции заново.
+        with patch("app.views.max_point_id") as max_point_id:
+            response = self.client.post(
+                "/admin/knowledge/bulk/",
+                data=json.dumps({"operations": [{"op": "create", **item}]}),
+                content_type="application/json",
+            )
+        self.assertEqual(response.json()["created"], [902])
+        max_point_id.assert_not_called()
+
+        invalid = self.client.post(
+            "/admin/knowledge/bulk/",
+            data=json.dumps({"operations": [{"op": "create", "question": []}]}),
+            content_type="application/json",
+        )
+        self.assertEqual(invalid.status_code, 400)
+
+    def test_admin_knowledge_import_accepts_csv(self):
+        self._ensure_qdrant_ready()
+        self.client.force_login(self.admin)
+        upload = SimpleUploadedFile(
+            "kb.csv",
+            "Номер вопроса;Вопрос;Ответ;Связанные вопросы\n501;Как?;Так;Первый / Второй\n".encode("utf-8"),
+        )
+
+        response = self.client.post("/admin/knowledge/import/", {"file": upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["report"]["added"], 1)
+        point = settings.QDRANT.retrieve(settings.COLLECTION, ids=[501])[0]
+        self.assertEqual(point.payload["related_questions"], ["Первый", "Второй"])
+
+        rejected = self.client.post("/admin/knowledge/import/", {"file": SimpleUploadedFile("kb.txt", b"x")})
+        self.assertEqual(rejected.status_code, 400)
+
     def test_admin_and_operator_pages_render(self):
         self.client.force_login(self.admin)
         knowledge_page = self.client.get("/admin/knowledge/")
@@ -14,11 +14,14 @@ urlpatterns = [
     path('operator/close/<uuid:chat_id>/', views.CloseChatView.as_view(), name='close_chat'),
     path('admin/dashboard/stats/', views.AdminStatsAPIView.as_view(), name='admin_stats_api'),
     path('admin/dashboard/', views.AdminDashboardView.as_view(), name='admin_dashboard'),
+    path('admin/metrics/', views.AdminAssistantMetricsView.as_view(), name='admin_assistant_metrics'),
     path('admin/report/', views.AdminGeneratePDFView.as_view(), name='admin_report'),
     path('admin/staff/', views.AdminStaffView.as_view(), name='admin_staff'),
     path('admin/staff/list/', views.AdminStaffListView.as_view(), name='admin_staff_list'),
     path('admin/staff/<int:user_id>/', views.AdminStaffUserView.as_view(), name='admin_staff_user'),
     path('admin/knowledge/', views.AdminKnowledgeView.as_view(), name='admin_knowledge'),
     path('admin/knowledge/list/', views.AdminKnowledgeListView.as_view(), name='admin_knowledge_list'),
+    path('admin/knowledge/bulk/', views.AdminKnowledgeBulkView.as_view(), name='admin_knowledge_bulk'),
+    path('admin/knowledge/import/', views.AdminKnowledgeImportView.as_view(), name='admin_knowledge_import'),
     path('admin/knowledge/<int:knowledge_id>/', views.AdminKnowledgeItemView.as_view(), name='admin_knowledge_item'),
 ]
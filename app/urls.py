@@ -26,8 +26,11 @@ urlpatterns = [
     # API-маршруты для админ-панели
     path('admin/generate-pdf/', AdminGeneratePDFView.as_view(), name='admin_generate_pdf'),
     path('admin/api/knowledge/', AdminKnowledgeListView.as_view(), name='admin_knowledge_list'),
+    path('admin/api/knowledge/bulk/', AdminKnowledgeBulkView.as_view(), name='admin_knowledge_bulk'),
+    path('admin/api/knowledge/import/', AdminKnowledgeImportView.as_view(), name='admin_knowledge_import'),
     path('admin/api/knowledge/<int:knowledge_id>/', AdminKnowledgeItemView.as_view(), name='admin_knowledge_item'),
     path('admin/api/staff/', AdminStaffListView.as_view(), name='admin_staff_list'),
     path('admin/api/staff/<int:user_id>/', AdminStaffUserView.as_view(), name='admin_staff_user'),
     path('admin/api/stats/', AdminStatsAPIView.as_view(), name='admin_stats_api'),
+    path('admin/api/metrics/', AdminAssistantMetricsView.as_view(), name='admin_assistant_metrics'),
 ]
@@ -1,9 +1,14 @@
 import asyncio
+import base64
 import io
 import json
+import logging
 import os
+import tempfile
 import uuid
+from dataclasses import asdict
 from datetime import datetime, timedelta
+from functools import partial
 
 from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
@@ -12,8 +17,9 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import Group, User
 from django.contrib.auth.views import LoginView
+from django.core.cache import cache
 from django.db.models import Avg
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.template.loader import get_template
 from django.utils import timezone
@@ -23,8 +29,22 @@ from qdrant_client.http.models import PointIdsList
 from qdrant_client.models import PointStruct
 
 
-from app.models import Chat, Message
+from app.models import Chat, KnowledgeSequence, Message
 from assistant import Assistant
+from concurrency import Priority, SchedulerOverloaded
+from knowledge import (
+    ROW_READERS,
+    bump_knowledge_version,
+    knowledge_state,
+    max_point_id,
+    read_rows,
+    record_payload,
+    row_to_record,
+    sync_knowledge,
+)
+from retrieval import get_async_qdrant
+
+logger = logging.getLogger(__name__)
 
 
 class CustomLogoutView(View):
@@ -167,6 +187,12 @@ class ChatView(View):
 
             user_msg_time = timezone.now()
 
+            if data.get("stream") and chat.bot_active:
+                return StreamingHttpResponse(
+                    self.stream_reply(chat, user_msg, user_msg_time),
+                    content_type="application/x-ndjson",
+                )
+
             response: Assistant.Response = await Assistant()(user_msg)
             switch_to_operator = "оператор" in user_msg.lower() or "оператор" in response.answer.lower()
 
@@ -184,6 +210,8 @@ class ChatView(View):
                     role="assistant",
                     content=reply,
                     response_time=response_time,
+                    prompt_tokens=response.prompt_tokens,
+                    source=response.source,
                 )
 
                 return JsonResponse(
@@ -215,6 +243,8 @@ class ChatView(View):
                 role="assistant",
                 content=reply,
                 response_time=response_time,
+                prompt_tokens=response.prompt_tokens,
+                source=response.source,
             )
 
             return JsonResponse(
@@ -225,9 +255,58 @@ class ChatView(View):
                 },
                 json_dumps_params={"ensure_ascii": False},
             )
+        except SchedulerOverloaded as e:
+            return JsonResponse({"error": str(e)}, status=503)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=400)
 
+    async def stream_reply(self, chat, user_msg, user_msg_time):
+        first_token_time = None
+        response = None
+
+        try:
+            async for chunk in Assistant().stream(user_msg):
+                if not isinstance(chunk, str):
+                    response = chunk
+                    break
+
+                if first_token_time is None:
+                    first_token_time = (timezone.now() - user_msg_time).total_seconds()
+                yield json.dumps({"delta": chunk}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+            return
+
+        operator_mode = "оператор" in user_msg.lower() or "оператор" in response.answer.lower()
+        if operator_mode:
+            chat.bot_active = False
+            await database_sync_to_async(chat.save)()
+            reply = "Перевожу вас на оператора. Пожалуйста, ожидайте..."
+            suggestions = []
+        else:
+            reply = response.answer
+            suggestions = response.related_questions
+
+        await database_sync_to_async(Message.objects.create)(
+            chat=chat,
+            role="assistant",
+            content=reply,
+            response_time=(timezone.now() - user_msg_time).total_seconds(),
+            first_token_time=first_token_time,
+            prompt_tokens=response.prompt_tokens,
+            source=response.source,
+        )
+
+        yield json.dumps(
+            {
+                "done": True,
+                "reply": reply,
+                "suggestions": suggestions,
+                "operator_mode": operator_mode,
+            },
+            ensure_ascii=False,
+        ) + "\n"
+
 
 class OperatorView(LoginRequiredMixin, UserPassesTestMixin, View):
     template_name = "operator.html"
@@ -512,6 +591,27 @@ class AdminGeneratePDFView(LoginRequiredMixin, UserPassesTestMixin, View):
         }
 
 
+class AdminAssistantMetricsView(LoginRequiredMixin, UserPassesTestMixin, View):
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = request.user
+        if not user.is_authenticated:
+            return redirect(settings.ADMIN_LOGIN_URL)
+
+        has_permission = await sync_to_async(self.test_func)()
+        if not has_permission:
+            return HttpResponseForbidden("У вас нет прав для доступа к этой странице")
+
+        handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+        return await handler(request, *args, **kwargs)
+
+    def test_func(self):
+        return self.request.user.is_superuser
+
+    async def get(self, request, *args, **kwargs):
+        return JsonResponse(Assistant().metrics())
+
+
 class AdminStaffUserView(LoginRequiredMixin, UserPassesTestMixin, View):
 
     async def dispatch(self, request, *args, **kwargs):
@@ -765,6 +865,114 @@ class AdminStaffListView(LoginRequiredMixin, UserPassesTestMixin, View):
             return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 
+def parse_knowledge_item(data: dict) -> dict | None:
+    """Тело запроса на создание/изменение записи -> запись базы знаний; None, если не заполнены обязательные поля."""
+    question = data.get('question', [])
+    answer = data.get('answer', '')
+    related_questions = data.get('related_questions', [])
+
+    if len(question) == 0 or len(answer) == 0 or len(related_questions) == 0:
+        return None
+
+    return {'question': " / ".join(question), 'answer': answer, 'related_questions': related_questions}
+
+
+def knowledge_id_floor_key(state: str) -> str:
+    return f"knowledge-id-floor:{settings.COLLECTION}:{state}"
+
+
+async def knowledge_id_floor(state: str) -> int:
+    """Наименьший id, которого точно нет в коллекции в состоянии state.
+
+    Импорт, синхронизация и переиндексация пишут точки с id из таблицы и счетчик не двигают,
+    поэтому граница берется из самой коллекции - но полный проход делается один раз
+    на состояние базы знаний (knowledge_state), а не при каждой выдаче.
+    """
+    floor = await cache.aget(knowledge_id_floor_key(state))
+    if floor is None:
+        floor = await max_point_id(get_async_qdrant(), settings.COLLECTION) + 1
+        await cache.aset(knowledge_id_floor_key(state), floor, settings.KNOWLEDGE_COUNT_TTL)
+    return floor
+
+
+async def allocate_knowledge_ids(count: int) -> list[int]:
+    """Новые id записей из KnowledgeSequence, всегда больше максимального id в коллекции."""
+    if count == 0:
+        return []
+
+    floor = await knowledge_id_floor(await knowledge_state(get_async_qdrant(), settings.COLLECTION))
+    return await database_sync_to_async(KnowledgeSequence.allocate)(settings.COLLECTION, count, floor)
+
+
+def knowledge_count_key(state: str) -> str:
+    return f"knowledge-count:{settings.COLLECTION}:{state}"
+
+
+async def knowledge_count() -> int:
+    """Число записей в коллекции; кэшируется до ближайшей записи в базу знаний, но не дольше KNOWLEDGE_COUNT_TTL.
+
+    В ключе - knowledge_state, поэтому кэш в памяти процесса устаревает и от записей
+    других воркеров и команд (загрузка, синхронизация, переключение alias).
+    """
+    key = knowledge_count_key(await knowledge_state(get_async_qdrant(), settings.COLLECTION))
+    total = await cache.aget(key)
+    if total is None:
+        total = (await get_async_qdrant().count(settings.COLLECTION)).count
+        await cache.aset(key, total, settings.KNOWLEDGE_COUNT_TTL)
+    return total
+
+
+def encode_cursor(offset) -> str | None:
+    """next_page_offset из scroll -> непрозрачный курсор для клиента."""
+    if offset is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(offset).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    offset = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    if not isinstance(offset, (int, str)) or isinstance(offset, bool):
+        raise ValueError(cursor)
+    return offset
+
+
+async def apply_knowledge_changes(records: list[dict], deleted: list[int]) -> list[PointStruct]:
+    """Записывает изменения базы знаний: один батч эмбеддингов, один upsert и одно удаление."""
+    state = await knowledge_state(get_async_qdrant(), settings.COLLECTION)
+    points = []
+    if records:
+        vectors = await Assistant().get_embeddings([record['question'] for record in records], priority=Priority.ADMIN)
+        model = await Assistant().get_embedding_model()
+        points = [
+            PointStruct(id=record['id'], vector=vector, payload=record_payload(record, model))
+            for record, vector in zip(records, vectors)
+        ]
+        await get_async_qdrant().upsert(collection_name=settings.COLLECTION, points=points, wait=True)
+
+    if deleted:
+        await get_async_qdrant().delete(
+            collection_name=settings.COLLECTION,
+            points_selector=PointIdsList(points=deleted),
+            wait=True,
+        )
+
+    await bump_knowledge_version(get_async_qdrant(), settings.COLLECTION)
+    floor = await cache.aget(knowledge_id_floor_key(state))
+    if floor is not None:
+        # Свои записи не требуют нового прохода по коллекции: их id уже выданы счетчиком.
+        floor = max([floor, *(point.id + 1 for point in points)])
+        new_state = await knowledge_state(get_async_qdrant(), settings.COLLECTION)
+        await cache.aset(knowledge_id_floor_key(new_state), floor, settings.KNOWLEDGE_COUNT_TTL)
+    Assistant().knowledge_changed(upserted=points, deleted=deleted)
+    try:
+        await Assistant().apply_fallback_changes(get_async_qdrant(), records, deleted)
+    except Exception as e:
+        # Основная коллекция уже записана; запасную догонит следующий sync_knowledge.
+        logger.warning("Failed to update fallback collection: %r", e)
+    return points
+
+
 class AdminKnowledgeView(LoginRequiredMixin, UserPassesTestMixin, View):
     template_name = "admin/knowledge.html"
     login_url = settings.ADMIN_LOGIN_URL
@@ -809,17 +1017,17 @@ class AdminKnowledgeListView(LoginRequiredMixin, UserPassesTestMixin, View):
         return self.request.user.is_superuser
 
     async def get(self, request, *args, **kwargs):
-        page = int(request.GET.get('page', 1))
-        per_page = 10
-
-        start_idx = (page - 1) * per_page
-        if page > 1:
-            start_idx += 1
+        # Страницы листаются курсором из next_page_offset: offset в scroll - это id точки, а не номер строки.
+        per_page = min(max(int(request.GET.get('per_page', 10)), 1), 100)
+        try:
+            offset = decode_cursor(request.GET['cursor']) if request.GET.get('cursor') else None
+        except ValueError:
+            return JsonResponse({'error': 'Некорректный курсор'}, status=400)
 
-        points, _ = settings.QDRANT.scroll(
+        points, next_offset = await get_async_qdrant().scroll(
             collection_name=settings.COLLECTION,
             limit=per_page,
-            offset=start_idx,
+            offset=offset,
             with_payload=True,
         )
 
@@ -833,13 +1041,13 @@ class AdminKnowledgeListView(LoginRequiredMixin, UserPassesTestMixin, View):
             for point in points
         ]
 
-        total_items = settings.QDRANT.count(settings.COLLECTION).count
+        total_items = await knowledge_count()
         total_pages = (total_items + per_page - 1) // per_page
 
         return JsonResponse({
             'items': current_page_items,
             'pagination': {
-                'current_page': page,
+                'next_cursor': encode_cursor(next_offset),
                 'total_pages': total_pages,
                 'total_items': total_items,
                 'per_page': per_page
@@ -848,35 +1056,17 @@ class AdminKnowledgeListView(LoginRequiredMixin, UserPassesTestMixin, View):
 
     async def post(self, request, *args, **kwargs):
         try:
-            data = json.loads(request.body)
-            question = data.get('question', [])
-            answer = data.get('answer', '')
-            related_questions = data.get('related_questions', [])
-
-            if len(question) == 0 or len(answer) == 0 or len(related_questions) == 0:
+            record = parse_knowledge_item(json.loads(request.body))
+            if record is None:
                 return JsonResponse({
                     'success': False,
                     'error': 'Не указаны обязательные поля'
                 }, status=400)
 
-            question = " / ".join(question)
+            record['id'] = (await allocate_knowledge_ids(1))[0]
+            await apply_knowledge_changes([record], [])
 
-            settings.QDRANT.upsert(
-                collection_name=settings.COLLECTION,
-                points=[
-                    PointStruct(
-                        id=settings.QDRANT.count(settings.COLLECTION).count + 1,
-                        vector=await Assistant().get_embedding(question),
-                        payload={
-                            "question": question,
-                            "answer": answer,
-                            "related_questions": related_questions,
-                        },
-                    )
-                ],
-            )
-
-            return JsonResponse({'success': True})
+            return JsonResponse({'success': True, 'id': record['id']})
 
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)}, status=400)
@@ -901,7 +1091,7 @@ class AdminKnowledgeItemView(LoginRequiredMixin, UserPassesTestMixin, View):
 
     async def get(self, request, knowledge_id, *args, **kwargs):
         try:
-            response = settings.QDRANT.retrieve(
+            response = await get_async_qdrant().retrieve(
                 collection_name=settings.COLLECTION,
                 ids=[knowledge_id],
                 with_payload=True
@@ -921,32 +1111,15 @@ class AdminKnowledgeItemView(LoginRequiredMixin, UserPassesTestMixin, View):
 
     async def put(self, request, knowledge_id, *args, **kwargs):
         try:
-            data = json.loads(request.body)
-            question = data.get('question', '')
-            answer = data.get('answer', '')
-            related_questions = data.get('related_questions', [])
-
-            if len(question) == 0 or len(answer) == 0 or len(related_questions) == 0:
+            record = parse_knowledge_item(json.loads(request.body))
+            if record is None:
                 return JsonResponse({
                     'success': False,
                     'error': 'Не указаны обязательные поля'
                 }, status=400)
 
-            question = " / ".join(question)
-            settings.QDRANT.upsert(
-                collection_name=settings.COLLECTION,
-                points=[
-                    PointStruct(
-                        id=knowledge_id,
-                        vector=await Assistant().get_embedding(question),
-                        payload={
-                            "question": question,
-                            "answer": answer,
-                            "related_questions": related_questions,
-                        },
-                    )
-                ],
-            )
+            record['id'] = knowledge_id
+            await apply_knowledge_changes([record], [])
 
             return JsonResponse({'success': True})
 
@@ -955,12 +1128,130 @@ class AdminKnowledgeItemView(LoginRequiredMixin, UserPassesTestMixin, View):
 
     async def delete(self, request, knowledge_id, *args, **kwargs):
         try:
-            settings.QDRANT.delete(
-                collection_name=settings.COLLECTION,
-                points_selector=PointIdsList(points=[knowledge_id]),
-            )
+            await apply_knowledge_changes([], [knowledge_id])
 
             return JsonResponse({'success': True, 'id': knowledge_id})
 
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+
+class AdminKnowledgeBulkView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """Пакет операций над базой знаний: {"operations": [{"op": "create" | "update" | "delete", ...}]}.
+
+    Все вопросы эмбеддятся одним запросом, изменения записываются одним upsert и одним удалением.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = request.user
+        if not user.is_authenticated:
+            return redirect(settings.ADMIN_LOGIN_URL)
+
+        has_permission = await sync_to_async(self.test_func)()
+        if not has_permission:
+            return HttpResponseForbidden("У вас нет прав для доступа к этой странице")
+
+        handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+        return await handler(request, *args, **kwargs)
+
+    def test_func(self):
+        return self.request.user.is_superuser
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            operations = json.loads(request.body).get('operations', [])
+            created, records, deleted, errors = [], [], [], []
+            for index, operation in enumerate(operations):
+                op = operation.get('op')
+                if op == 'delete':
+                    deleted.append(int(operation['id']))
+                    continue
+                if op not in ('create', 'update'):
+                    errors.append(f"{index}: неизвестная операция {op!r}")
+                    continue
+
+                record = parse_knowledge_item(operation)
+                if record is None:
+                    errors.append(f"{index}: не указаны обязательные поля")
+                    continue
+                if op == 'update':
+                    record['id'] = int(operation['id'])
+                else:
+                    created.append(record)
+                records.append(record)
+
+            if errors:
+                return JsonResponse({'success': False, 'error': '; '.join(errors)}, status=400)
+
+            for record, point_id in zip(created, await allocate_knowledge_ids(len(created))):
+                record['id'] = point_id
+            await apply_knowledge_changes(records, deleted)
+
+            return JsonResponse({
+                'success': True,
+                'created': [record['id'] for record in created],
+                'updated': len(records) - len(created),
+                'deleted': len(deleted),
+            })
+
+        except Exception as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+
+class AdminKnowledgeImportView(LoginRequiredMixin, UserPassesTestMixin, View):
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = request.user
+        if not user.is_authenticated:
+            return redirect(settings.ADMIN_LOGIN_URL)
+
+        has_permission = await sync_to_async(self.test_func)()
+        if not has_permission:
+            return HttpResponseForbidden("У вас нет прав для доступа к этой странице")
+
+        handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+        return await handler(request, *args, **kwargs)
+
+    def test_func(self):
+        return self.request.user.is_superuser
+
+    @staticmethod
+    def save_upload(upload) -> str:
+        # Файл копируется на диск по частям, чтобы потом читать его построчно, не держа целиком в памяти.
+        suffix = os.path.splitext(upload.name)[1].lower()
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            for chunk in upload.chunks():
+                f.write(chunk)
+        return f.name
+
+    async def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return JsonResponse({'success': False, 'error': 'Файл не выбран'}, status=400)
+        if os.path.splitext(upload.name)[1].lower() not in ROW_READERS:
+            return JsonResponse({
+                'success': False,
+                'error': f"Поддерживаются файлы {', '.join(ROW_READERS)}"
+            }, status=400)
+
+        path = await sync_to_async(self.save_upload)(upload)
+        try:
+            report = await sync_knowledge(
+                (row_to_record(row) for row in read_rows(path)),
+                embed=partial(Assistant().get_embeddings, priority=Priority.ADMIN),
+                qdrant=get_async_qdrant(),
+                collection=settings.COLLECTION,
+                model=await Assistant().get_embedding_model(),
+                delete_missing=request.POST.get('replace') == '1',
+            )
+        except Exception as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        finally:
+            os.remove(path)
+
+        Assistant().knowledge_changed()
+        try:
+            await Assistant().sync_fallback_collection(get_async_qdrant())
+        except Exception as e:
+            logger.warning("Failed to sync fallback collection: %r", e)
+        return JsonResponse({'success': True, 'report': asdict(report)})
@@ -1,20 +1,44 @@
 import asyncio
 import json
+import logging
 import os
+import time
 import uuid
-from dataclasses import dataclass
-from datetime import datetime, timezone
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from functools import wraps
 
 import aiohttp
-import requests
-from qdrant_client import QdrantClient
+from qdrant_client.http.models import PointIdsList
+
+from caches import EmbeddingCache, SemanticResponseCache, normalize_text
+from concurrency import AdaptiveLimiter, CircuitBreaker, Priority, Scheduler, SchedulerOverloaded, SingleFlight
+from embeddings import EmbeddingBatcher, LocalEmbeddings, RemoteEmbeddings
+from knowledge import SyncReport, alias_target, collection_records, ingest_knowledge, sync_knowledge
+from retrieval import BM25Index, ContextBuilder, estimate_tokens, get_vector_store, reciprocal_rank_fusion
 
 try:
     from gigachat.models.assistants import Assistant as GigachatAssistant  # noqa: F401
 except ModuleNotFoundError:
     GigachatAssistant = None
 
+logger = logging.getLogger(__name__)
+
+OPERATOR_HANDOFF = "Сервис ответов временно недоступен, подключаю оператора."
+
+# Служебные события потока ответа: запрос ждет слота ограничителя / запрос отправлен.
+_STREAM_QUEUED = object()
+_STREAM_SENT = object()
+
+
+class GigaChatError(Exception):
+    pass
+
+
+class GigaChatRateLimited(GigaChatError):
+    """GigaChat отвечает 429 и после повторов: сервис жив, просто перегружен нами."""
+
 
 class Assistant:
     __instance = None
@@ -24,6 +48,10 @@ class Assistant:
     class Response:
         answer: str
         related_questions: list[str]
+        prompt_tokens: int | None = None
+        # llm - ответ сгенерирован моделью, knowledge_base - взят из базы знаний как есть, cache - из кэша ответов,
+        # degraded - GigaChat недоступен, ответ взят из базы знаний или чат передан оператору.
+        source: str = "llm"
 
     def __new__(cls, *args, **kwargs):
         if not cls.__instance:
@@ -34,23 +62,208 @@ class Assistant:
         if self.__initialized:
             return
 
-        self._initialized = True
-        self.__queue = []
+        self.__scheduler = Scheduler(
+            concurrency=int(os.getenv("ASSISTANT_CONCURRENCY", "8")),
+            max_queue=int(os.getenv("ASSISTANT_MAX_QUEUE", "512")),
+        )
         self.__authurl = "https://ngw.devices.sberbank.ru:9443/api/v2"
         self.__baseurl = "https://gigachat.devices.sberbank.ru/api/v1"
-        qdrant_host = os.getenv("QDRANT_HOST", "qdrant")
-        qdrant_port = os.getenv("QDRANT_PORT", "6333")
-        qdrant_url = os.getenv("QDRANT_URL", f"http://{qdrant_host}:{qdrant_port}")
-        use_memory_qdrant = os.getenv("QDRANT_IN_MEMORY", False) == "1"
-
-        self.__qdrant = QdrantClient(":memory:") if use_memory_qdrant else QdrantClient(url=qdrant_url)
+        self.__session = None
+        self.__session_loop = None
+        self.__token_flight = SingleFlight()
+        self.__message_flight = SingleFlight()
+        self.__token_refresher = None
+        self.__token_refresh_margin = timedelta(seconds=float(os.getenv("GIGACHAT_TOKEN_REFRESH_MARGIN", "120")))
+        self.__timeout = aiohttp.ClientTimeout(
+            total=float(os.getenv("GIGACHAT_TIMEOUT", "60")),
+            connect=float(os.getenv("GIGACHAT_CONNECT_TIMEOUT", "10")),
+        )
+        # Таймауты отдельных HTTP-запросов: при зависшем GigaChat запрос не ждет общего таймаута сессии.
+        # Ожидание слота ограничителя (в том числе Retry-After после 429) в них не входит.
+        self.__embedding_timeout = float(os.getenv("GIGACHAT_EMBEDDING_TIMEOUT", "5"))
+        self.__completion_timeout = float(os.getenv("GIGACHAT_COMPLETION_TIMEOUT", "20"))
+        # Потоковый ответ ограничен не целиком: до первого фрагмента - GIGACHAT_COMPLETION_TIMEOUT,
+        # дальше - паузой между фрагментами.
+        self.__stream_idle_timeout = float(os.getenv("GIGACHAT_STREAM_IDLE_TIMEOUT", "10"))
+        failure_threshold = int(os.getenv("GIGACHAT_BREAKER_FAILURES", "5"))
+        recovery_timeout = float(os.getenv("GIGACHAT_BREAKER_RECOVERY", "30"))
+        self.__embedding_breaker = CircuitBreaker(
+            "GigaChat embeddings", failure_threshold, recovery_timeout, ignore=(GigaChatRateLimited,)
+        )
+        self.__completion_breaker = CircuitBreaker(
+            "GigaChat completions", failure_threshold, recovery_timeout, ignore=(GigaChatRateLimited,)
+        )
+        self.__degraded_responses = 0
+        # Отдельные адаптивные лимиты: 429 на чат-модели не должен душить эмбеддинги, и наоборот.
+        self.__embedding_limiter = AdaptiveLimiter(
+            "embeddings",
+            initial_limit=int(os.getenv("GIGACHAT_EMBEDDING_CONCURRENCY", "4")),
+            max_limit=int(os.getenv("GIGACHAT_EMBEDDING_CONCURRENCY_MAX", "16")),
+        )
+        self.__completion_limiter = AdaptiveLimiter(
+            "completions",
+            initial_limit=int(os.getenv("GIGACHAT_COMPLETION_CONCURRENCY", "4")),
+            max_limit=int(os.getenv("GIGACHAT_COMPLETION_CONCURRENCY_MAX", "32")),
+            latency_tolerance=3.0,
+        )
+        self.__rate_limit_retries = int(os.getenv("GIGACHAT_RATE_LIMIT_RETRIES", "1"))
+        self.__qdrant = get_vector_store()
         self.__collection = os.getenv("QDRANT_COLLECTION", "que")
+        self.__context_builder = ContextBuilder(
+            min_score=float(os.getenv("RAG_MIN_SCORE", "0.5")),
+            max_tokens=int(os.getenv("RAG_CONTEXT_TOKENS", "1200")),
+            max_answer_tokens=int(os.getenv("RAG_ANSWER_TOKENS", "300")),
+            duplicate_threshold=float(os.getenv("RAG_DUPLICATE_THRESHOLD", "0.9")),
+        )
+        self.__vector_limit = int(os.getenv("RAG_VECTOR_LIMIT", "3"))
+        self.__lexical_limit = int(os.getenv("RAG_LEXICAL_LIMIT", "3"))
+        self.__min_lexical_score = float(os.getenv("RAG_MIN_LEXICAL_SCORE", "2.0"))
+        threshold = os.getenv("DIRECT_ANSWER_THRESHOLD")
+        self.__direct_answer_threshold = float(threshold) if threshold else None
+        self.__direct_answers = 0
+        self.__lexical_index = None
+        self.__lexical_generation = 0
+        self.__lexical_flight = SingleFlight()
+        self.__lexical_searches = 0
+        self.__lexical_time = 0.0
+        # QDRANT_COLLECTION - alias; reindex_knowledge переключает его на новую версию коллекции.
+        # Цель alias и версия базы знаний, увиденные при последней проверке.
+        self.__knowledge_state = None
+        self.__alias_checked_at = float("-inf")
+        self.__alias_check_interval = float(os.getenv("KNOWLEDGE_ALIAS_CHECK_INTERVAL", "30"))
+        self.__embedding_model = os.getenv("GIGACHAT_EMBEDDING_MODEL", "Embeddings")
+        self.__embedder = self.__make_embedder(os.getenv("EMBEDDING_BACKEND", "gigachat"))
+        # Запасной локальный бэкенд: если GigaChat не ответил за EMBEDDING_FALLBACK_TIMEOUT,
+        # поиск идет по отдельной коллекции, проиндексированной локальными эмбеддингами.
+        self.__fallback_embedder = None
+        if os.getenv("EMBEDDING_FALLBACK") == "local" and self.__embedder.remote:
+            self.__fallback_embedder = self.__make_embedder("local")
+        self.__fallback_timeout = float(os.getenv("EMBEDDING_FALLBACK_TIMEOUT", "2"))
+        self.__fallback_collection = os.getenv("EMBEDDING_FALLBACK_COLLECTION", f"{self.__collection}_local")
+        self.__embedding_fallbacks = 0
+        # Создается при первом обращении: модель локального бэкенда известна только после чтения корпуса.
+        self.__embedding_cache = None
+        self.__response_cache = SemanticResponseCache(
+            threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.97")),
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", "900")),
+            max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+        )
+        self.__embedding_batcher = EmbeddingBatcher(
+            self.__embed_batch,
+            max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "16")),
+            max_delay=float(os.getenv("EMBEDDING_BATCH_DELAY_MS", "5")) / 1000,
+        )
 
         self.__gigatoken = os.getenv("GIGATOKEN", None)
         if not self.__gigatoken:
             raise Exception("Необходимо указать переменную окружения GIGATOKEN для подключения GigaChat.")
 
-        response = requests.post(
+        # Токен запрашивается при первом обращении к API (или в warm_up), а не при создании.
+        self.__access_token = None
+        self.__expires_at = None
+        self.__initialized = True
+
+    def __get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self.__session is None or self.__session.closed or self.__session_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=int(os.getenv("GIGACHAT_POOL_SIZE", "100")),
+                limit_per_host=int(os.getenv("GIGACHAT_POOL_PER_HOST", "32")),
+                ttl_dns_cache=int(os.getenv("GIGACHAT_DNS_CACHE_TTL", "300")),
+                keepalive_timeout=float(os.getenv("GIGACHAT_KEEPALIVE", "30")),
+                ssl=False,
+            )
+            self.__session = aiohttp.ClientSession(connector=connector, timeout=self.__timeout)
+            self.__session_loop = loop
+        return self.__session
+
+    async def __post(self, url: str, **kwargs) -> dict:
+        async with self.__get_session().post(url, **kwargs) as response:
+            return await response.json()
+
+    async def __api_post(self, path: str, body: dict, limiter: AdaptiveLimiter, timeout: float | None = None) -> dict:
+        seen = []
+        while True:
+            token = self.__access_token
+            async with limiter.slot() as permit, asyncio.timeout(timeout):
+                async with self.__get_session().post(
+                    f"{self.__baseurl}{path}",
+                    headers={
+                        "Authorization": f"Bearer {token}",
+                        "Accept": "application/json",
+                        "Content-Type": "application/json",
+                    },
+                    data=json.dumps(body),
+                ) as response:
+                    permit.responded()
+                    if response.status < 400:
+                        return await response.json()
+                    if response.status == 429:
+                        permit.throttled(self.__retry_after(response))
+            await self.__prepare_retry(path, response.status, token, seen)
+
+    async def __prepare_retry(self, path: str, status: int, token: str, seen: list[int]):
+        """Готовит повтор запроса после ответа status или бросает GigaChatError, если повторять не нужно."""
+        seen.append(status)
+        if status == 401 and seen.count(401) == 1:
+            await self.__refresh_token(stale_token=token)
+            return
+        if status == 429:
+            if seen.count(429) <= self.__rate_limit_retries:
+                # Повтор сам дождется Retry-After: до этого ограничитель не выдает новых слотов.
+                return
+            raise GigaChatRateLimited(f"GigaChat {path} вернул {status}")
+        raise GigaChatError(f"GigaChat {path} вернул {status}")
+
+    @staticmethod
+    def __retry_after(response) -> float:
+        value = response.headers.get("Retry-After")
+        if not value:
+            return 1.0
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                return 1.0
+        return min(max(seconds, 0.0), 60.0)
+
+    async def close(self):
+        if self.__token_refresher is not None:
+            self.__token_refresher.cancel()
+            self.__token_refresher = None
+        if self.__session is not None and not self.__session.closed:
+            await self.__session.close()
+        self.__session = None
+        self.__session_loop = None
+
+    async def warm_up(self):
+        await self.__get_embedding_cache()
+        if self.__fallback_embedder is not None:
+            await self.__fallback_embedder.prepare()
+        await self.__ensure_token()
+        self.__get_session()
+        await self.__qdrant.get_collections()
+
+    @classmethod
+    async def shutdown(cls):
+        if cls.__instance is not None and cls.__instance.__initialized:
+            await cls.__instance.close()
+
+    async def __ensure_token(self):
+        self.__start_token_refresher()
+        if self.__expires_at is None or datetime.now(timezone.utc) >= self.__expires_at:
+            await self.__refresh_token(stale_token=self.__access_token)
+
+    async def __refresh_token(self, stale_token: str | None = None):
+        # Токен мог обновиться, пока вызывающий ждал ответа 401 или своей очереди.
+        if stale_token is not None and stale_token != self.__access_token:
+            return
+        await self.__token_flight.do("token", self.__fetch_token)
+
+    async def __fetch_token(self):
+        response = await self.__post(
             f"{self.__authurl}/oauth",
             headers={
                 "Authorization": f"Basic {self.__gigatoken}",
@@ -61,71 +274,267 @@ class Assistant:
             data={
                 "scope": "GIGACHAT_API_PERS",
             },
-            verify=False
         )
 
-        response = response.json()
         self.__access_token = response["access_token"]
         self.__expires_at = datetime.fromtimestamp(response["expires_at"] / 1000, timezone.utc)
 
+    def __start_token_refresher(self):
+        loop = asyncio.get_running_loop()
+        if self.__token_refresher is None or self.__token_refresher.done() or self.__token_refresher.get_loop() is not loop:
+            self.__token_refresher = loop.create_task(self.__refresh_token_periodically())
+
+    async def __refresh_token_periodically(self):
+        while True:
+            # Пока токена нет, ждать нечего: запрос присоединится к первому получению токена в __ensure_token.
+            if self.__expires_at is not None:
+                refresh_at = self.__expires_at - self.__token_refresh_margin
+                await asyncio.sleep(max((refresh_at - datetime.now(timezone.utc)).total_seconds(), 0))
+            try:
+                await self.__token_flight.do("token", self.__fetch_token)
+            except Exception:
+                await asyncio.sleep(5)
+
     def authorized(func):
         @wraps(func)
         async def wrapper(self, *args, **kwargs):
-            if datetime.now(timezone.utc) >= self.__expires_at:
-                async with aiohttp.ClientSession() as session:
-                    response = await session.post(
-                        f"{self.__authurl}/oauth",
-                        headers={
-                            "Authorization": f"Basic {self.__gigatoken}",
-                            "Content-Type": "application/x-www-form-urlencoded",
-                            "Accept": "application/json",
-                            "RqUID": str(uuid.uuid4()),
-                        },
-                        data={
-                            "scope": "GIGACHAT_API_PERS",
-                        },
-                        ssl=False
-                    )
-                    response = await response.json()
-
-                self.__access_token = response["access_token"]
-                self.__expires_at = datetime.fromtimestamp(response["expires_at"] / 1000, timezone.utc)
-
+            await self.__ensure_token()
             return await func(self, *args, **kwargs)
 
         return wrapper
 
-    @authorized
-    async def get_embedding(self, message: str) -> list[float]:
-        async with aiohttp.ClientSession() as session:
-            response = await session.post(
-                f"{self.__baseurl}/embeddings",
-                headers={
-                    "Authorization": f"Bearer {self.__access_token}",
-                    "Accept": "application/json",
-                    "Content-Type": "application/json",
-                },
-                data=json.dumps(
-                    {
-                        "model": "Embeddings",
-                        "input": message
-                    }
-                ),
-                ssl=False
+    def __make_embedder(self, backend: str):
+        if backend == "gigachat":
+            return RemoteEmbeddings("gigachat", self.__embedding_model, self.__embed_batch)
+        if backend == "local":
+            return LocalEmbeddings(
+                dimension=int(os.getenv("LOCAL_EMBEDDINGS_DIM", "1024")),
+                corpus_path=os.getenv("LOCAL_EMBEDDINGS_CORPUS", "база знаний.xlsx"),
             )
-            # print(response.status, await response.json())
-            return (await response.json())["data"][0]["embedding"]
+        raise ValueError(f"Неизвестный бэкенд эмбеддингов: {backend}")
+
+    async def __get_embedding_cache(self) -> EmbeddingCache:
+        if self.__embedding_cache is None:
+            await self.__embedder.prepare()
+            if self.__embedding_cache is None:
+                self.__embedding_cache = EmbeddingCache(
+                    model=self.__embedder.model,
+                    max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+                    path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3"),
+                    max_disk_entries=int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", "200000")),
+                    max_bytes=int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "64")) * 2 ** 20),
+                )
+        return self.__embedding_cache
+
+    async def get_embedding(self, message: str, priority: Priority | None = None) -> list[float]:
+        cache = await self.__get_embedding_cache()
+        vector = await cache.get(message)
+        if vector is not None:
+            return vector
+
+        if priority is not None:
+            vector = await self.__scheduler.run(priority, self.__embed, message)
+        else:
+            vector = await self.__embed(message)
+
+        await cache.put(message, vector)
+        return vector
+
+    async def get_embedding_model(self) -> str:
+        """Модель текущего бэкенда эмбеддингов; векторы разных моделей несравнимы."""
+        await self.__embedder.prepare()
+        return self.__embedder.model
+
+    async def sync_fallback_collection(self, qdrant, source: str | None = None) -> SyncReport | None:
+        """Приводит запасную коллекцию (EMBEDDING_FALLBACK) к основной: те же записи с локальными векторами.
+
+        Эмбеддинги пересчитываются только для новых и измененных вопросов (sync_knowledge).
+        Возвращает None, если запасной бэкенд не настроен.
+        """
+        if self.__fallback_embedder is None:
+            return None
+        await self.__fallback_embedder.prepare()
+        return await sync_knowledge(
+            collection_records(qdrant, source or self.__collection),
+            embed=self.__fallback_embedder.embed,
+            qdrant=qdrant,
+            collection=self.__fallback_collection,
+            model=self.__fallback_embedder.model,
+        )
+
+    async def apply_fallback_changes(self, qdrant, records: list[dict], deleted: list[int]):
+        """Повторяет в запасной коллекции правки, записанные в основную (records - записи с id)."""
+        if self.__fallback_embedder is None:
+            return
+        await self.__fallback_embedder.prepare()
+        if records:
+            await ingest_knowledge(
+                records,
+                embed=self.__fallback_embedder.embed,
+                qdrant=qdrant,
+                collection=self.__fallback_collection,
+                model=self.__fallback_embedder.model,
+            )
+        if deleted and await qdrant.collection_exists(self.__fallback_collection):
+            await qdrant.delete(
+                collection_name=self.__fallback_collection,
+                points_selector=PointIdsList(points=deleted),
+                wait=True,
+            )
+
+    async def get_embeddings(self, messages: list[str], priority: Priority | None = None) -> list[list[float]]:
+        cache = await self.__get_embedding_cache()
+        vectors = [await cache.get(message) for message in messages]
+        missing = list(dict.fromkeys(message for message, vector in zip(messages, vectors) if vector is None))
+
+        computed = {}
+        batch_size = self.__embedding_batcher.max_batch_size
+        for start in range(0, len(missing), batch_size):
+            chunk = missing[start:start + batch_size]
+            if priority is not None:
+                chunk_vectors = await self.__scheduler.run(priority, self.__embedder.embed, chunk)
+            else:
+                chunk_vectors = await self.__embedder.embed(chunk)
+            for message, vector in zip(chunk, chunk_vectors):
+                computed[message] = vector
+                await cache.put(message, vector)
+
+        return [vector if vector is not None else computed[message] for message, vector in zip(messages, vectors)]
+
+    def clear_embedding_cache(self):
+        if self.__embedding_cache is not None:
+            self.__embedding_cache.clear()
+
+    async def __embed(self, message: str) -> list[float]:
+        if not self.__embedder.remote:
+            return (await self.__embedder.embed([message]))[0]
+        return await self.__embedding_batcher.submit(message)
+
+    async def __embed_query(self, message: str) -> tuple[list[float], str]:
+        """Эмбеддинг пользовательского запроса и коллекция, в которой по нему искать."""
+        if self.__fallback_embedder is None:
+            return await self.get_embedding(message), self.__collection
+
+        # Удаленный запрос не отменяем по таймауту: результат все равно попадет в кэш.
+        task = asyncio.ensure_future(self.get_embedding(message))
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.__fallback_timeout), self.__collection
+        except Exception:
+            self.__embedding_fallbacks += 1
+            return (await self.__fallback_embedder.embed([message]))[0], self.__fallback_collection
+
+    async def __embed_batch(self, messages: list[str]) -> list[list[float]]:
+        return await self.__embedding_breaker.call(self.__request_embeddings, messages)
 
     @authorized
-    async def __process_message(self, message: str, max_related: int) -> Response:
+    async def __request_embeddings(self, messages: list[str]) -> list[list[float]]:
+        response = await self.__api_post(
+            "/embeddings",
+            {
+                "model": self.__embedding_model,
+                "input": messages
+            },
+            self.__embedding_limiter,
+            self.__embedding_timeout,
+        )
+        return [item["embedding"] for item in sorted(response["data"], key=lambda item: item.get("index", 0))]
+
+    async def __check_collection_version(self):
+        """Раз в KNOWLEDGE_ALIAS_CHECK_INTERVAL сверяет цель alias и версию базы знаний.
+
+        Если alias переключен или коллекцию изменил другой процесс (команды загрузки, другие воркеры),
+        сбрасывает лексический индекс и кэш ответов.
+        """
+        now = time.monotonic()
+        if now - self.__alias_checked_at < self.__alias_check_interval:
+            return
+        self.__alias_checked_at = now
+        try:
+            state = (
+                await alias_target(self.__qdrant, self.__collection),
+                await self.__qdrant.knowledge_version(self.__collection),
+            )
+        except Exception as e:
+            logger.warning("Failed to check knowledge base version %s: %r", self.__collection, e)
+            return
+        if self.__knowledge_state is not None and state != self.__knowledge_state:
+            self.knowledge_changed()
+        self.__knowledge_state = state
+
+    async def __get_lexical_index(self) -> BM25Index:
+        await self.__check_collection_version()
+        if self.__lexical_index is None:
+            return await self.__lexical_flight.do("bm25", self.__load_lexical_index)
+        return self.__lexical_index
+
+    async def __load_lexical_index(self) -> BM25Index:
+        generation = self.__lexical_generation
+        index = BM25Index()
+        offset = None
+        while True:
+            points, offset = await self.__qdrant.scroll(
+                collection_name=self.__collection,
+                limit=256,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            for point in points:
+                index.upsert(point.id, point.payload)
+            if offset is None:
+                break
 
-        query_vec = await self.get_embedding(message)
-        hits = self.__qdrant.query_points(
-            collection_name=self.__collection,
+        # Если база знаний изменилась во время загрузки, индекс уже устарел.
+        if generation == self.__lexical_generation:
+            self.__lexical_index = index
+        return index
+
+    async def __search(self, message: str, query_vec: list[float], collection: str, limit: int, lexical_limit: int):
+        """Гибридный поиск: векторные и BM25-результаты, объединенные через RRF."""
+        hits = (await self.__qdrant.query_points(
+            collection_name=collection,
             query=query_vec,
-            limit=5,
+            limit=limit,
             with_payload=True,
-        ).points
+        )).points
+
+        index = await self.__get_lexical_index()
+        started_at = time.perf_counter()
+        lexical_hits = index.search(message, limit=lexical_limit, min_score=self.__min_lexical_score)
+        self.__lexical_time += time.perf_counter() - started_at
+        self.__lexical_searches += 1
+
+        return reciprocal_rank_fusion(hits, lexical_hits)
+
+    def __direct_answer(self, hits, max_related: int) -> Response | None:
+        """Ответ из базы знаний без обращения к модели, если лучшая запись достаточно близка к вопросу."""
+        if self.__direct_answer_threshold is None:
+            return None
+
+        scored = [hit for hit in hits if hit.vector_score is not None]
+        if not scored:
+            return None
+
+        top = max(scored, key=lambda hit: hit.vector_score)
+        if top.vector_score < self.__direct_answer_threshold:
+            return None
+
+        related_questions = list(top.payload["related_questions"])
+        for hit in hits:
+            if hit is not top:
+                related_questions.extend(hit.payload["related_questions"])
+
+        self.__direct_answers += 1
+        return Assistant.Response(
+            answer=top.payload["answer"],
+            related_questions=related_questions[:max_related],
+            prompt_tokens=0,
+            source="knowledge_base",
+        )
+
+    async def __build_completion(self, message: str, hits) -> tuple[dict, list[str]]:
+        context, hits = self.__context_builder.build(hits)
 
         related_questions = []
         for hit in hits:
@@ -144,13 +553,7 @@ class Assistant:
                                "Если пользователь зовет прямо оператора, то отвечай только: 'оператор'"
                                "\n\n\n"
                                "При ответе опирайся на следующие данные:\n"
-                               + "\n\n".join(
-                        "\n".join(
-                            [
-                                f"Вопрос: {hit.payload['question']}\nОтвет: {hit.payload['answer']}"
-                                for hit in hits
-                            ])
-                    )
+                               + context
                 },
                 {
                     "role": "user",
@@ -158,45 +561,304 @@ class Assistant:
                 }
             ]
         }
+        return data, related_questions
 
-        async with aiohttp.ClientSession() as session:
-            response = await session.post(
-                f"{self.__baseurl}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.__access_token}",
-                    "Accept": "application/json",
-                    "Content-Type": "application/json",
-                },
-                data=json.dumps(data),
-                ssl=False
-            )
-            return Assistant.Response(
-                answer=(await response.json())["choices"][0]["message"]["content"],
-                related_questions=related_questions[:max_related]
-            )
+    @staticmethod
+    def __prompt_tokens(data: dict) -> int:
+        return sum(estimate_tokens(message["content"]) for message in data["messages"])
+
+    @authorized
+    async def __process_message(self, message: str, max_related: int, hits) -> Response:
+        data, related_questions = await self.__build_completion(message, hits)
+        response = await self.__completion_breaker.call(
+            self.__api_post, "/chat/completions", data, self.__completion_limiter, self.__completion_timeout
+        )
+        return Assistant.Response(
+            answer=response["choices"][0]["message"]["content"],
+            related_questions=related_questions[:max_related],
+            prompt_tokens=response.get("usage", {}).get("prompt_tokens", self.__prompt_tokens(data)),
+        )
+
+    async def __prepare(self, message: str, max_related: int):
+        """Все, что нужно сделать до обращения к модели: эмбеддинг, кэш ответов, поиск, прямой ответ.
+
+        Возвращает (готовый Response или None, найденные записи, вектор для кэша ответов или None).
+        """
+        # До кэша ответов: иначе ответ по старой базе знаний отдавался бы из кэша, пока не сработает поиск.
+        await self.__check_collection_version()
+        try:
+            query_vec, collection = await self.__embed_query(message)
+        except Exception as e:
+            return await self.__degraded(message, max_related, None, e), None, None
 
-    async def __call__(self, message: str, max_related: int = 5) -> Response:
-        task_id = str(uuid.uuid4())
-        self.__queue.append(task_id)
+        # Кэш ответов хранит векторы основного бэкенда, запасные с ними несравнимы.
+        cacheable = collection == self.__collection
+        cached = self.__response_cache.get(query_vec, max_related) if cacheable else None
+        if cached is not None:
+            return replace(cached, prompt_tokens=0, source="cache"), None, None
+
+        try:
+            hits = await self.__search(message, query_vec, collection, self.__vector_limit, self.__lexical_limit)
+        except Exception as e:
+            return await self.__degraded(message, max_related, None, e), None, None
+
+        # Порог подобран для основного бэкенда эмбеддингов, на запасной его не переносим.
+        direct = self.__direct_answer(hits, max_related) if cacheable else None
+        if direct is not None:
+            return direct, None, None
+
+        # Пока цепь разомкнута, не ставим запрос в очередь к модели, а отвечаем сразу.
+        if self.__completion_breaker.state == CircuitBreaker.OPEN:
+            return await self.__degraded(message, max_related, hits, None), None, None
+
+        return None, hits, query_vec if cacheable else None
+
+    async def __degraded(self, message: str, max_related: int, hits, error: Exception | None) -> Response:
+        """Ответ без модели: лучшая подходящая запись базы знаний, а если ее нет - передача оператору."""
+        self.__degraded_responses += 1
+        if error is not None:
+            logger.warning("GigaChat unavailable, answering in degraded mode: %r", error)
+
+        if hits is None:
+            try:
+                index = await self.__get_lexical_index()
+                hits = index.search(message, limit=self.__lexical_limit, min_score=self.__min_lexical_score)
+            except Exception:
+                logger.exception("Knowledge base lookup failed in degraded mode")
+                hits = []
+
+        for hit in hits:
+            vector_score = getattr(hit, "vector_score", None)
+            if hit.lexical_score is not None or (vector_score or 0) >= self.__context_builder.min_score:
+                return Assistant.Response(
+                    answer=hit.payload["answer"],
+                    related_questions=hit.payload["related_questions"][:max_related],
+                    prompt_tokens=0,
+                    source="degraded",
+                )
 
-        while self.__queue[0] != task_id:
-            await asyncio.sleep(0.1)
+        return Assistant.Response(answer=OPERATOR_HANDOFF, related_questions=[], prompt_tokens=0, source="degraded")
 
-        self.__queue.pop(0)
+    async def __call__(self, message: str, max_related: int = 5, priority: Priority = Priority.CHAT) -> Response:
+        # Одинаковые вопросы, пришедшие одновременно (типично при аварии), обрабатываются один раз.
+        key = (normalize_text(message), max_related)
+        response = await self.__message_flight.do(key, self.__answer, message, max_related, priority)
+        # None - потоковый ответ на тот же вопрос оборвался (например, клиент ушел), отвечаем сами.
+        return response if response is not None else await self.__answer(message, max_related, priority)
 
-        return await self.__process_message(message, max_related)
+    async def __answer(self, message: str, max_related: int, priority: Priority) -> Response:
+        started_at = time.monotonic()
+        ready, hits, cache_key = await self.__prepare(message, max_related)
+        if ready is not None:
+            return ready
+
+        try:
+            response = await self.__scheduler.run(priority, self.__process_message, message, max_related, hits)
+        except SchedulerOverloaded:
+            raise
+        except Exception as e:
+            return await self.__degraded(message, max_related, hits, e)
+
+        if cache_key is not None:
+            self.__response_cache.put(cache_key, response, max_related, time.monotonic() - started_at)
+        return response
+
+    async def stream(self, message: str, max_related: int = 5, priority: Priority = Priority.CHAT):
+        """Отдает ответ по частям: сначала строки-фрагменты, последним - готовый Response.
+
+        Если тот же вопрос уже обрабатывается, ждет готовый ответ и отдает его одним фрагментом.
+        """
+        key = (normalize_text(message), max_related)
+        if self.__message_flight.pending(key):
+            response = await self(message, max_related, priority)
+            yield response.answer
+            yield response
+            return
+
+        outcome = self.__message_flight.claim(key)
+        try:
+            async for item in self.__stream_answer(message, max_related, priority):
+                if isinstance(item, Assistant.Response):
+                    outcome.set_result(item)
+                yield item
+        finally:
+            if not outcome.done():
+                outcome.set_result(None)
+
+    async def __stream_answer(self, message: str, max_related: int, priority: Priority):
+        started_at = time.monotonic()
+        ready, hits, cache_key = await self.__prepare(message, max_related)
+        if ready is None:
+            chunks = []
+            try:
+                async with self.__scheduler.slot(priority):
+                    data, related_questions = await self.__build_completion(message, hits)
+                    async for delta in self.__stream_completion(data):
+                        chunks.append(delta)
+                        yield delta
+            except SchedulerOverloaded:
+                raise
+            except Exception as e:
+                # Начатый ответ подменить уже нельзя.
+                if chunks:
+                    raise
+                ready = await self.__degraded(message, max_related, hits, e)
+
+        if ready is not None:
+            yield ready.answer
+            yield ready
+            return
+
+        response = Assistant.Response(
+            answer="".join(chunks),
+            related_questions=related_questions[:max_related],
+            prompt_tokens=self.__prompt_tokens(data),
+        )
+        if cache_key is not None:
+            self.__response_cache.put(cache_key, response, max_related, time.monotonic() - started_at)
+        yield response
+
+    async def __stream_completion(self, data: dict):
+        breaker = self.__completion_breaker
+        breaker.before_call()
+        outcome_recorded = False
+        events = self.__stream_events(data)
+        timeout = None
+        try:
+            while True:
+                # Таймаут меряет только ожидание GigaChat, а не время, пока получатель обрабатывает фрагмент.
+                try:
+                    event = await asyncio.wait_for(anext(events), timeout)
+                except StopAsyncIteration:
+                    break
+                if event is _STREAM_QUEUED:
+                    timeout = None
+                elif event is _STREAM_SENT:
+                    timeout = self.__completion_timeout
+                else:
+                    timeout = self.__stream_idle_timeout
+                    yield event
+        except Exception as e:
+            breaker.record_failure(e)
+            outcome_recorded = True
+            raise
+        else:
+            breaker.record_success()
+            outcome_recorded = True
+        finally:
+            await events.aclose()
+            # Клиент мог уйти посреди ответа - это не сбой GigaChat.
+            if not outcome_recorded:
+                breaker.release()
+
+    async def __stream_events(self, data: dict):
+        await self.__ensure_token()
+        seen = []
+        while True:
+            token = self.__access_token
+            yield _STREAM_QUEUED
+            async with self.__completion_limiter.slot() as permit:
+                yield _STREAM_SENT
+                async with self.__get_session().post(
+                    f"{self.__baseurl}/chat/completions",
+                    headers={
+                        "Authorization": f"Bearer {token}",
+                        "Accept": "text/event-stream",
+                        "Content-Type": "application/json",
+                    },
+                    data=json.dumps({**data, "stream": True}),
+                ) as response:
+                    permit.responded()
+                    if response.status == 429:
+                        permit.throttled(self.__retry_after(response))
+                    elif response.status < 400:
+                        async for line in response.content:
+                            line = line.decode("utf-8").strip()
+                            if not line.startswith("data:"):
+                                continue
+
+                            payload = line[len("data:"):].strip()
+                            if payload == "[DONE]":
+                                break
+
+                            delta = json.loads(payload)["choices"][0].get("delta", {}).get("content")
+                            if delta:
+                                yield delta
+                        return
+            await self.__prepare_retry("/chat/completions", response.status, token, seen)
+
+    def knowledge_changed(self, upserted: list | None = None, deleted: list | None = None):
+        """Сообщает об изменении базы знаний: upserted - записанные точки, deleted - id удаленных.
+
+        Без аргументов лексический индекс будет перестроен целиком при следующем запросе.
+        """
+        self.__response_cache.clear()
+        self.__qdrant.apply_changes(self.__collection, upserted, deleted)
+        self.__lexical_generation += 1
+        if self.__lexical_index is None:
+            return
+        if upserted is None and deleted is None:
+            self.__lexical_index = None
+            return
+
+        for point in upserted or []:
+            self.__lexical_index.upsert(point.id, point.payload)
+        for point_id in deleted or []:
+            self.__lexical_index.remove(point_id)
 
     async def answers(self, message: str) -> list[str]:
-        query_vec = await self.get_embedding(message)
-        hits = self.__qdrant.query_points(
-            collection_name=self.__collection,
-            query=query_vec,
-            limit=10,
-            with_payload=True,
-        ).points
+        return await self.__scheduler.run(Priority.SUGGESTIONS, self.__answers, message)
+
+    async def __answers(self, message: str) -> list[str]:
+        try:
+            query_vec, collection = await self.__embed_query(message)
+            hits = await self.__search(message, query_vec, collection, limit=10, lexical_limit=10)
+        except Exception as e:
+            logger.warning("Vector search unavailable, suggesting by keywords: %r", e)
+            index = await self.__get_lexical_index()
+            hits = index.search(message, limit=10, min_score=self.__min_lexical_score)
 
         related_questions = []
         for hit in hits:
             related_questions.append(hit.payload["answer"])
 
         return related_questions[:10]
+
+    def metrics(self) -> dict:
+        return {
+            "scheduler": self.__scheduler.stats(),
+            "embeddings": {
+                "backend": self.__embedder.name,
+                "model": self.__embedder.model if self.__embedder.prepared else None,
+                "fallback": self.__fallback_embedder.name if self.__fallback_embedder else None,
+                "fallbacks": self.__embedding_fallbacks,
+            },
+            "circuit_breakers": {
+                "embeddings": self.__embedding_breaker.stats(),
+                "completions": self.__completion_breaker.stats(),
+            },
+            "degraded_responses": self.__degraded_responses,
+            "rate_limiters": {
+                "embeddings": self.__embedding_limiter.stats(),
+                "completions": self.__completion_limiter.stats(),
+            },
+            "context": self.__context_builder.stats(),
+            "direct_answers": {
+                "threshold": self.__direct_answer_threshold,
+                "served": self.__direct_answers,
+            },
+            "lexical_index": {
+                "documents": len(self.__lexical_index) if self.__lexical_index is not None else None,
+                "searches": self.__lexical_searches,
+                "avg_search_ms": round(self.__lexical_time / self.__lexical_searches * 1000, 3)
+                if self.__lexical_searches else 0.0,
+            },
+            "coalescing": {
+                "in_flight": self.__message_flight.in_flight,
+                "coalesced": self.__message_flight.coalesced,
+            },
+            "embedding_cache": self.__embedding_cache.stats() if self.__embedding_cache is not None else None,
+            "embedding_batcher": self.__embedding_batcher.stats(),
+            "response_cache": self.__response_cache.stats(),
+            "vector_store": self.__qdrant.stats(),
+        }
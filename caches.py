@@ -0,0 +1,231 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import replace
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+class EmbeddingCache:
+    """Двухуровневый кэш эмбеддингов: LRU в памяти процесса и SQLite на диске.
+
+    Ключ - хэш модели и нормализованного текста, поэтому процессы с разными
+    моделями (основной и запасной бэкенды) делят один файл, не мешая друг другу.
+    В памяти векторы лежат как array("f") - 4 байта на измерение вместо ~32 у
+    list[float]; уровень в памяти ограничен и числом записей, и max_bytes.
+    """
+
+    def __init__(self, model: str, max_entries: int = 10000, path: str | None = None, max_disk_entries: int = 200000,
+                 max_bytes: int | None = None):
+        self.model = model
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_entries = max_disk_entries
+        self.__memory = OrderedDict()
+        self.__memory_bytes = 0
+        self.__lock = threading.Lock()
+        self.__db = None
+        self.__hits = 0
+        self.__disk_hits = 0
+        self.__misses = 0
+
+        if path:
+            self.__db = sqlite3.connect(path, check_same_thread=False)
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self.__db.commit()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{normalize_text(text)}".encode()).hexdigest()
+
+    async def get(self, text: str) -> list[float] | None:
+        key = self.key(text)
+        vector = self.__memory.get(key)
+        if vector is not None:
+            self.__memory.move_to_end(key)
+            self.__hits += 1
+            return vector.tolist()
+
+        if self.__db is not None:
+            vector = await asyncio.to_thread(self.__disk_get, key)
+            if vector is not None:
+                self.__remember(key, vector)
+                self.__hits += 1
+                self.__disk_hits += 1
+                return vector.tolist()
+
+        self.__misses += 1
+        return None
+
+    async def put(self, text: str, vector: list[float]):
+        key = self.key(text)
+        vector = array("f", vector)
+        self.__remember(key, vector)
+        if self.__db is not None:
+            await asyncio.to_thread(self.__disk_put, key, vector)
+
+    def clear(self):
+        self.__memory.clear()
+        self.__memory_bytes = 0
+        if self.__db is not None:
+            with self.__lock:
+                self.__db.execute("DELETE FROM embeddings")
+                self.__db.commit()
+
+    def close(self):
+        if self.__db is not None:
+            self.__db.close()
+            self.__db = None
+
+    def __remember(self, key: str, vector: array):
+        previous = self.__memory.pop(key, None)
+        if previous is not None:
+            self.__memory_bytes -= self.__size(previous)
+        self.__memory[key] = vector
+        self.__memory_bytes += self.__size(vector)
+        while self.__memory and (
+            len(self.__memory) > self.max_entries
+            or self.max_bytes is not None and self.__memory_bytes > self.max_bytes
+        ):
+            _, evicted = self.__memory.popitem(last=False)
+            self.__memory_bytes -= self.__size(evicted)
+
+    @staticmethod
+    def __size(vector: array) -> int:
+        return len(vector) * vector.itemsize
+
+    def __disk_get(self, key: str) -> array | None:
+        with self.__lock:
+            row = self.__db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        vector = array("f")
+        vector.frombytes(row[0])
+        return vector
+
+    def __disk_put(self, key: str, vector: array):
+        with self.__lock:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                (key, vector.tobytes()),
+            )
+            # Самые старые записи вытесняются, когда таблица превышает лимит.
+            self.__db.execute(
+                "DELETE FROM embeddings WHERE rowid <= "
+                "(SELECT MAX(rowid) FROM embeddings) - ?",
+                (self.max_disk_entries,),
+            )
+            self.__db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.__hits + self.__misses
+        return {
+            "model": self.model,
+            "memory_entries": len(self.__memory),
+            "max_entries": self.max_entries,
+            "memory_bytes": self.__memory_bytes,
+            "max_bytes": self.max_bytes,
+            "persistent": self.__db is not None,
+            "hits": self.__hits,
+            "disk_hits": self.__disk_hits,
+            "misses": self.__misses,
+            "hit_rate": round(self.__hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class SemanticResponseCache:
+    """Кэш готовых ответов ассистента, ключом которого служит эмбеддинг вопроса.
+
+    Векторы хранятся нормализованными в кольцевом буфере numpy, поэтому поиск
+    ближайшего вопроса - одно матричное умножение. Ответ отдается, если
+    косинусная близость не ниже threshold и запись не старше ttl секунд.
+    """
+
+    def __init__(self, threshold: float = 0.97, ttl: float = 900, max_entries: int = 1024):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.__matrix = None
+        self.__expires = np.zeros(max_entries)
+        self.__entries = [None] * max_entries
+        self.__next = 0
+        self.__size = 0
+        self.__hits = 0
+        self.__misses = 0
+        self.__latency_saved = 0.0
+
+    def get(self, vector: list[float], max_related: int):
+        if self.__size == 0:
+            self.__misses += 1
+            return None
+
+        query = self.__normalize(vector)
+        if query is None or query.shape[0] != self.__matrix.shape[1]:
+            self.__misses += 1
+            return None
+
+        scores = self.__matrix[:self.__size] @ query
+        scores[self.__expires[:self.__size] < time.monotonic()] = -np.inf
+        best = int(np.argmax(scores))
+        response, cached_related, latency = self.__entries[best]
+
+        if scores[best] < self.threshold or cached_related < max_related:
+            self.__misses += 1
+            return None
+
+        self.__hits += 1
+        self.__latency_saved += latency
+        return replace(response, related_questions=response.related_questions[:max_related])
+
+    def put(self, vector: list[float], response, max_related: int, latency: float):
+        if self.max_entries == 0:
+            return
+
+        normalized = self.__normalize(vector)
+        if normalized is None:
+            return
+
+        if self.__matrix is None or self.__matrix.shape[1] != normalized.shape[0]:
+            self.__matrix = np.zeros((self.max_entries, normalized.shape[0]), dtype=np.float32)
+            self.__next = 0
+            self.__size = 0
+
+        self.__matrix[self.__next] = normalized
+        self.__expires[self.__next] = time.monotonic() + self.ttl
+        self.__entries[self.__next] = (response, max_related, latency)
+        self.__next = (self.__next + 1) % self.max_entries
+        self.__size = min(self.__size + 1, self.max_entries)
+
+    def clear(self):
+        self.__entries = [None] * self.max_entries
+        self.__next = 0
+        self.__size = 0
+
+    @staticmethod
+    def __normalize(vector):
+        array_vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array_vector)
+        if norm == 0:
+            return None
+        return array_vector / norm
+
+    def stats(self) -> dict:
+        lookups = self.__hits + self.__misses
+        return {
+            "entries": self.__size,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl_s": self.ttl,
+            "hits": self.__hits,
+            "misses": self.__misses,
+            "hit_rate": round(self.__hits / lookups, 4) if lookups else 0.0,
+            "latency_saved_s": round(self.__latency_saved, 3),
+        }
@@ -0,0 +1,417 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+
+
+class Priority(IntEnum):
+    CHAT = 0
+    SUGGESTIONS = 1
+    ADMIN = 2
+
+
+class SchedulerOverloaded(Exception):
+    pass
+
+
+class Scheduler:
+    """Ограничивает число одновременно выполняемых задач с учетом приоритета.
+
+    Ожидающие задачи хранятся в куче (приоритет, порядок поступления), поэтому
+    при освобождении слота запускается самая приоритетная и самая старая из них.
+    """
+
+    def __init__(self, concurrency: int, max_queue: int):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.__running = 0
+        self.__waiters = []
+        self.__counter = itertools.count()
+        self.__submitted = 0
+        self.__rejected = 0
+        self.__completed = 0
+        self.__started = 0
+        self.__total_wait = 0.0
+        self.__max_wait = 0.0
+
+    async def run(self, priority: Priority, func, *args, **kwargs):
+        async with self.slot(priority):
+            return await func(*args, **kwargs)
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority):
+        await self.__acquire(priority)
+        try:
+            yield
+        finally:
+            self.__completed += 1
+            self.__release()
+
+    async def __acquire(self, priority: Priority):
+        self.__submitted += 1
+
+        while self.__waiters and self.__waiters[0][2].done():
+            heapq.heappop(self.__waiters)
+
+        if self.__running < self.concurrency and not self.__waiters:
+            self.__running += 1
+            self.__record_wait(0.0)
+            return
+
+        if self.queue_depth >= self.max_queue:
+            self.__rejected += 1
+            raise SchedulerOverloaded("Слишком много запросов в очереди, попробуйте позже.")
+
+        future = asyncio.get_running_loop().create_future()
+        enqueued_at = time.monotonic()
+        heapq.heappush(self.__waiters, (int(priority), next(self.__counter), future))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот уже был выдан, но задача отменена до старта - возвращаем его.
+            if future.done() and not future.cancelled():
+                self.__release()
+            raise
+
+        self.__record_wait(time.monotonic() - enqueued_at)
+
+    def __release(self):
+        self.__running -= 1
+        while self.__waiters:
+            _, _, future = heapq.heappop(self.__waiters)
+            if future.done():
+                continue
+            self.__running += 1
+            future.set_result(None)
+            break
+
+    def __record_wait(self, wait: float):
+        self.__started += 1
+        self.__total_wait += wait
+        self.__max_wait = max(self.__max_wait, wait)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self.__waiters if not future.done())
+
+    def stats(self) -> dict:
+        depth = {p.name.lower(): 0 for p in Priority}
+        for priority, _, future in self.__waiters:
+            if not future.done():
+                depth[Priority(priority).name.lower()] += 1
+
+        return {
+            "concurrency": self.concurrency,
+            "running": self.__running,
+            "queue_depth": sum(depth.values()),
+            "queue_depth_by_priority": depth,
+            "max_queue": self.max_queue,
+            "submitted": self.__submitted,
+            "rejected": self.__rejected,
+            "completed": self.__completed,
+            "avg_wait_ms": round(self.__total_wait / self.__started * 1000, 3) if self.__started else 0.0,
+            "max_wait_ms": round(self.__max_wait * 1000, 3),
+        }
+
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом в одно выполнение.
+
+    Первый вызов запускает задачу, остальные ждут ее результата (или исключения).
+    Отмена одного из ожидающих не прерывает общую задачу.
+    """
+
+    def __init__(self):
+        self.__calls = {}
+        self.__coalesced = 0
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self.__calls.get(key)
+        if task is not None:
+            self.__coalesced += 1
+        else:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self.__calls[key] = task
+            task.add_done_callback(lambda done: self.__forget(key, done))
+
+        return await asyncio.shield(task)
+
+    def pending(self, key) -> bool:
+        return key in self.__calls
+
+    def claim(self, key) -> asyncio.Future:
+        """Регистрирует вызов с ключом key, результат которого вызывающий установит сам.
+
+        Нужен, когда первый вызов не сводится к одной корутине - например, отдает ответ по частям.
+        Остальные вызовы do(key, ...) ждут future, пока он не завершится.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.__calls[key] = future
+        future.add_done_callback(lambda done: self.__forget(key, done))
+        return future
+
+    def __forget(self, key, task):
+        if self.__calls.get(key) is task:
+            del self.__calls[key]
+        if not task.cancelled():
+            task.exception()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.__calls)
+
+    @property
+    def coalesced(self) -> int:
+        return self.__coalesced
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Размыкатель цепи для вызовов внешнего сервиса.
+
+    После failure_threshold ошибок подряд (таймаут тоже ошибка) цепь размыкается,
+    и все вызовы сразу получают CircuitOpen, не занимая соединений и памяти.
+    Через recovery_timeout секунд пропускается один пробный вызов: его успех
+    замыкает цепь, ошибка - снова размыкает. Исключения из ignore (например,
+    отказ по лимиту запросов) сбоем сервиса не считаются.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30, ignore: tuple = ()):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.ignore = ignore
+        self.__state = self.CLOSED
+        self.__failures = 0
+        self.__opened_at = 0.0
+        self.__trial_running = False
+        self.__opened = 0
+        self.__rejected = 0
+        self.__last_error = None
+
+    @property
+    def state(self) -> str:
+        if self.__state == self.OPEN and time.monotonic() - self.__opened_at >= self.recovery_timeout:
+            return self.HALF_OPEN
+        return self.__state
+
+    def before_call(self):
+        """Бросает CircuitOpen, если вызов сейчас выполнять не нужно."""
+        state = self.state
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and not self.__trial_running:
+            self.__state = self.HALF_OPEN
+            self.__trial_running = True
+            return
+
+        self.__rejected += 1
+        raise CircuitOpen(f"{self.name} временно недоступен")
+
+    def record_success(self):
+        self.__state = self.CLOSED
+        self.__failures = 0
+        self.__trial_running = False
+
+    def record_failure(self, error: BaseException):
+        self.__failures += 1
+        self.__last_error = f"{type(error).__name__}: {error}"
+        if self.__state == self.HALF_OPEN or self.__failures >= self.failure_threshold:
+            self.__state = self.OPEN
+            self.__opened_at = time.monotonic()
+            self.__opened += 1
+        self.__trial_running = False
+
+    def release(self):
+        """Вызов прерван не по вине сервиса (отмена, клиент ушел) - исход не учитываем."""
+        self.__trial_running = False
+
+    async def call(self, func, *args, timeout: float | None = None, **kwargs):
+        self.before_call()
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+        except asyncio.CancelledError:
+            self.release()
+            raise
+        except Exception as e:
+            if isinstance(e, self.ignore):
+                self.release()
+            else:
+                self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.__failures,
+            "opened": self.__opened,
+            "rejected": self.__rejected,
+            "last_error": self.__last_error,
+        }
+
+
+class LimiterPermit:
+    """Разрешение на один вызов; через него вызывающий сообщает, чем вызов закончился."""
+
+    def __init__(self, clock=time.monotonic):
+        self.__clock = clock
+        self.started = clock()
+        self.latency = None
+        self.retry_after = None
+
+    def responded(self):
+        """Фиксирует задержку до ответа сервиса (для потоковых ответов - до заголовков)."""
+        if self.latency is None:
+            self.latency = self.__clock() - self.started
+
+    def throttled(self, retry_after: float):
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """Адаптивный лимит одновременных вызовов внешнего сервиса по схеме AIMD.
+
+    Пока сервис отвечает быстро, лимит растет примерно на единицу за "окно"
+    из limit вызовов. Ответ 429, таймаут или задержка выше latency_tolerance
+    от обычной уменьшают лимит в backoff раз - не чаще одного раза на волну
+    запросов, начатых до предыдущего уменьшения. После 429 новые вызовы
+    не начинаются, пока не истечет Retry-After.
+
+    clock - источник времени для задержек и пауз (в тестах подменяется).
+    """
+
+    def __init__(self, name: str, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 32,
+                 backoff: float = 0.5, latency_tolerance: float = 2.0, clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.__limit = float(initial_limit)
+        self.__in_flight = 0
+        self.__waiters = deque()
+        self.__paused_until = 0.0
+        self.__last_decrease = 0.0
+        self.__baseline = None
+        self.__calls = 0
+        self.__throttled = 0
+        self.__decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self.__limit))
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.__acquire()
+        permit = LimiterPermit(self.clock)
+        try:
+            yield permit
+        except asyncio.TimeoutError:
+            self.__decrease(permit.started)
+            raise
+        except asyncio.CancelledError:
+            # Так приходит таймаут из wait_for снаружи; отмену затянувшегося вызова считаем перегрузкой.
+            if self.__is_slow(self.clock() - permit.started):
+                self.__decrease(permit.started)
+            raise
+        finally:
+            self.__calls += 1
+            if permit.retry_after is not None:
+                self.__on_throttle(permit)
+            elif permit.latency is not None:
+                self.__on_response(permit)
+            self.__release()
+
+    async def __acquire(self):
+        if not self.__waiters and self.__in_flight < self.limit and self.clock() >= self.__paused_until:
+            self.__in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.__waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.__release()
+            raise
+
+    def __release(self):
+        self.__in_flight -= 1
+        self.__wake()
+
+    def __resume(self):
+        remaining = self.__paused_until - self.clock()
+        if remaining > 0:
+            # Таймер цикла может сработать чуть раньше конца паузы: без нового таймера очередь бы зависла.
+            asyncio.get_running_loop().call_later(remaining, self.__resume)
+            return
+        self.__wake()
+
+    def __wake(self):
+        if self.clock() < self.__paused_until:
+            return
+        while self.__waiters and self.__in_flight < self.limit:
+            future = self.__waiters.popleft()
+            if future.done():
+                continue
+            self.__in_flight += 1
+            future.set_result(None)
+
+    def __is_slow(self, latency: float) -> bool:
+        return self.__baseline is not None and latency > self.__baseline * self.latency_tolerance
+
+    def __on_response(self, permit: LimiterPermit):
+        if self.__is_slow(permit.latency):
+            self.__decrease(permit.started)
+        else:
+            self.__limit = min(self.max_limit, self.__limit + 1 / self.__limit)
+
+        # Обычная задержка - медленное скользящее среднее, чтобы разовый всплеск ее не сдвигал.
+        if self.__baseline is None:
+            self.__baseline = permit.latency
+        else:
+            self.__baseline = 0.95 * self.__baseline + 0.05 * permit.latency
+
+    def __on_throttle(self, permit: LimiterPermit):
+        self.__throttled += 1
+        self.__decrease(permit.started)
+        resume_at = self.clock() + permit.retry_after
+        if resume_at > self.__paused_until:
+            self.__paused_until = resume_at
+            asyncio.get_running_loop().call_later(permit.retry_after, self.__resume)
+
+    def __decrease(self, started: float):
+        # Вызовы, начатые до прошлого уменьшения, видели ту же перегрузку - второй раз не реагируем.
+        if started < self.__last_decrease:
+            return
+        self.__limit = max(float(self.min_limit), self.__limit * self.backoff)
+        self.__last_decrease = self.clock()
+        self.__decreases += 1
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.__in_flight,
+            "queue_depth": sum(1 for future in self.__waiters if not future.done()),
+            "calls": self.__calls,
+            "throttled": self.__throttled,
+            "decreases": self.__decreases,
+            "paused_for_s": round(max(0.0, self.__paused_until - self.clock()), 3),
+            "baseline_latency_ms": round(self.__baseline * 1000, 1) if self.__baseline is not None else None,
+        }
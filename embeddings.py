@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import zlib
+
+import numpy as np
+
+
+class EmbeddingBatcher:
+    """Собирает одновременные запросы эмбеддингов в один батч.
+
+    Запросы копятся до max_batch_size штук или до истечения max_delay секунд
+    с момента первого из них, после чего отправляются одним вызовом send_batch.
+    """
+
+    def __init__(self, send_batch, max_batch_size: int = 16, max_delay: float = 0.005):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.__send_batch = send_batch
+        self.__pending = []
+        self.__timer = None
+        self.__tasks = set()
+        self.__batches = 0
+        self.__items = 0
+
+    async def submit(self, text: str) -> list[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.__pending.append((text, future))
+
+        if len(self.__pending) >= self.max_batch_size:
+            self.__flush()
+        elif self.__timer is None:
+            self.__timer = loop.call_later(self.max_delay, self.__flush)
+
+        return await future
+
+    def __flush(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+
+        batch, self.__pending = self.__pending, []
+        batch = [(text, future) for text, future in batch if not future.done()]
+        if not batch:
+            return
+
+        task = asyncio.ensure_future(self.__send(batch))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def __send(self, batch):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.__batches += 1
+        self.__items += len(batch)
+
+        try:
+            vectors = dict(zip(texts, await self.__send_batch(texts)))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for text, future in batch:
+            if not future.done():
+                future.set_result(vectors[text])
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_delay_ms": self.max_delay * 1000,
+            "batches": self.__batches,
+            "items": self.__items,
+            "avg_batch_size": round(self.__items / self.__batches, 2) if self.__batches else 0.0,
+        }
+
+
+class EmbeddingProvider:
+    """Источник эмбеддингов для Assistant.
+
+    remote=True означает сетевой вызов: такие запросы имеет смысл собирать в батчи.
+    """
+
+    name = "base"
+    model = "base"
+    remote = False
+
+    async def prepare(self):
+        """Подготовка, после которой model и embed не обращаются к диску и сети."""
+
+    @property
+    def prepared(self) -> bool:
+        return True
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        raise NotImplementedError
+
+
+class RemoteEmbeddings(EmbeddingProvider):
+    remote = True
+
+    def __init__(self, name: str, model: str, send_batch):
+        self.name = name
+        self.model = model
+        self.__send_batch = send_batch
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        return await self.__send_batch(texts)
+
+
+class LocalEmbeddings(EmbeddingProvider):
+    """Локальные эмбеддинги: TF-IDF по символьным n-граммам с хэшированием в вектор фиксированной длины.
+
+    Веса IDF считаются по вопросам базы знаний. Вычисление идет на CPU без сети,
+    поэтому провайдер годится для офлайн-режима и как запасной при медленном GigaChat.
+    Векторы зависят от корпуса, поэтому в model входит его отпечаток: после правки
+    базы знаний меняются и ключи кэша эмбеддингов, и content_hash записей.
+    """
+
+    name = "local"
+
+    def __init__(self, dimension: int = 1024, ngram_range: tuple[int, int] = (2, 4), corpus_path: str | None = None):
+        self.dimension = dimension
+        self.ngram_range = ngram_range
+        self.__corpus_path = corpus_path
+        self.__idf = None
+        self.__fingerprint = None
+
+    @property
+    def model(self) -> str:
+        # Корпус читается из xlsx: здесь его не разбираем, чтобы не блокировать цикл событий.
+        if self.__fingerprint is None:
+            raise RuntimeError("Имя модели зависит от корпуса IDF: сначала вызовите prepare() или fit()")
+        return f"local-char-ngram-{self.dimension}-{self.__fingerprint}"
+
+    @property
+    def prepared(self) -> bool:
+        return self.__idf is not None
+
+    def fit(self, texts):
+        document_frequency = np.zeros(self.dimension)
+        corpus = sorted(" ".join(str(text).lower().replace("ё", "е").split()) for text in texts)
+        for text in corpus:
+            buckets = {bucket for bucket, _ in self.__hashed_ngrams(text)}
+            document_frequency[list(buckets)] += 1
+        self.__idf = np.log((1 + len(corpus)) / (1 + document_frequency)) + 1
+        self.__fingerprint = hashlib.sha256("\n".join(corpus).encode("utf-8")).hexdigest()[:12]
+        return self
+
+    async def prepare(self):
+        # Разбор xlsx с корпусом - не в цикле событий.
+        if self.__idf is None:
+            await asyncio.to_thread(self.__ensure_fitted)
+
+    def __ensure_fitted(self):
+        if self.__idf is None:
+            self.fit(_read_questions(self.__corpus_path) if self.__corpus_path else [])
+
+    def transform(self, texts: list[str]) -> np.ndarray:
+        self.__ensure_fitted()
+
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for bucket, sign in self.__hashed_ngrams(text):
+                matrix[row, bucket] += sign
+        matrix *= self.__idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        await self.prepare()
+        return self.transform(texts).tolist()
+
+    def __hashed_ngrams(self, text: str):
+        text = f" {' '.join(str(text).lower().replace('ё', 'е').split())} "
+        low, high = self.ngram_range
+        for size in range(low, high + 1):
+            for start in range(len(text) - size + 1):
+                digest = zlib.crc32(text[start:start + size].encode("utf-8"))
+                yield digest % self.dimension, 1.0 if digest & 0x80000000 else -1.0
+
+
+def _read_questions(path: str) -> list[str]:
+    from knowledge import QUESTION_COLUMN, read_excel_rows
+
+    try:
+        return [row[QUESTION_COLUMN] for row in read_excel_rows(path) if row.get(QUESTION_COLUMN)]
+    except FileNotFoundError:
+        return []
@@ -0,0 +1,666 @@
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+import uuid
+from contextlib import aclosing
+from dataclasses import dataclass
+from itertools import islice
+
+import numpy as np
+
+from qdrant_client.models import (
+    CreateAlias,
+    CreateAliasOperation,
+    DeleteAlias,
+    DeleteAliasOperation,
+    Distance,
+    PointIdsList,
+    PointStruct,
+    SetPayload,
+    SetPayloadOperation,
+    VectorParams,
+)
+
+from caches import normalize_text
+
+ID_COLUMN = "Номер вопроса"
+QUESTION_COLUMN = "Вопрос"
+ANSWER_COLUMN = "Ответ"
+RELATED_COLUMN = "Связанные вопросы"
+# Метка в метаданных коллекции, которую меняет каждая запись в базу знаний: по ней процессы
+# Assistant узнают о правках, сделанных командами и другими воркерами.
+KNOWLEDGE_VERSION_KEY = "knowledge_version"
+
+
+def resolve_path(path) -> str:
+    """Путь к существующему файлу: имя "база знаний.xlsx" может храниться в разных формах Unicode (NFC/NFD)."""
+    path = str(path)
+    for candidate in (path, unicodedata.normalize("NFC", path), unicodedata.normalize("NFD", path)):
+        if os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError(path)
+
+
+def read_excel_rows(path):
+    """Построчно читает первый лист Excel-файла, отдавая словари {заголовок: значение}."""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(resolve_path(path), read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else "" for cell in next(rows)]
+        for row in rows:
+            if any(cell is not None for cell in row):
+                yield dict(zip(header, row))
+    finally:
+        workbook.close()
+
+
+def read_csv_rows(path):
+    """Построчно читает CSV с заголовком (UTF-8, разделитель определяется по первой строке)."""
+    with open(resolve_path(path), encoding="utf-8-sig", newline="") as f:
+        try:
+            dialect = csv.Sniffer().sniff(f.readline(), delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        f.seek(0)
+        for row in csv.DictReader(f, dialect=dialect):
+            if any(row.values()):
+                yield {str(key).strip(): value for key, value in row.items()}
+
+
+def read_jsonl_rows(path):
+    """Построчно читает JSONL: один JSON-объект на строку, пустые строки пропускаются."""
+    with open(resolve_path(path), encoding="utf-8-sig") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}, строка {number}: {e.msg}") from e
+
+
+ROW_READERS = {
+    ".xlsx": read_excel_rows,
+    ".csv": read_csv_rows,
+    ".jsonl": read_jsonl_rows,
+}
+
+
+def read_rows(path):
+    """Потоковое чтение источника базы знаний; формат определяется по расширению файла."""
+    suffix = os.path.splitext(str(path))[1].lower()
+    if suffix not in ROW_READERS:
+        raise ValueError(f"Неподдерживаемый формат {suffix or str(path)!r}: ожидается {', '.join(ROW_READERS)}")
+    return ROW_READERS[suffix](path)
+
+
+def row_to_record(row: dict) -> dict:
+    """Строка базы знаний -> {"id", "question", "answer", "related_questions"}.
+
+    Принимает и колонки из Excel ("Номер вопроса", "Вопрос", ...), и ключи самой записи
+    ("id", "question", ...), как их выгружает JSONL. Связанные вопросы - список или строка через "/".
+    """
+    def field(column, key):
+        return row[column] if column in row else row.get(key)
+
+    related = field(RELATED_COLUMN, "related_questions") or ""
+    if isinstance(related, str):
+        related = related.split("/")
+    return {
+        "id": int(field(ID_COLUMN, "id")),
+        "question": str(field(QUESTION_COLUMN, "question")).strip(),
+        "answer": str(field(ANSWER_COLUMN, "answer")).strip(),
+        "related_questions": [str(question).strip() for question in related if str(question).strip()],
+    }
+
+
+async def iter_chunks(records, size: int):
+    """Чанки по size записей из обычного или асинхронного итерируемого.
+
+    Обычный итератор (разбор xlsx/csv, row_to_record) читается в пуле потоков,
+    чтобы чтение файла не блокировало цикл событий, который обслуживает чат.
+    """
+    if hasattr(records, "__aiter__"):
+        chunk = []
+        async for record in records:
+            chunk.append(record)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+        return
+
+    iterator = iter(records)
+    while chunk := await asyncio.to_thread(lambda: list(islice(iterator, size))):
+        yield chunk
+
+
+def knowledge_version_metadata() -> dict:
+    return {KNOWLEDGE_VERSION_KEY: uuid.uuid4().hex}
+
+
+async def bump_knowledge_version(qdrant, collection: str):
+    """Отмечает изменение базы знаний в метаданных коллекции (collection может быть alias)."""
+    await qdrant.update_collection(collection_name=collection, metadata=knowledge_version_metadata())
+
+
+async def read_knowledge_version(qdrant, collection: str) -> tuple:
+    """(метка версии, число точек): число точек замечает и правки сторонних клиентов, метку не меняющих."""
+    info = await qdrant.get_collection(collection)
+    return (info.config.metadata or {}).get(KNOWLEDGE_VERSION_KEY), info.points_count
+
+
+async def knowledge_state(qdrant, collection: str) -> str:
+    """Метка текущего состояния базы знаний: цель alias, версия и число точек.
+
+    Меняется при любой записи через эти модули и при переключении alias, поэтому годится
+    как часть ключа кэша для величин, которые дорого считать по всей коллекции.
+    """
+    if not await qdrant.collection_exists(collection):
+        return "missing"
+    target = await alias_target(qdrant, collection)
+    marker, points = await read_knowledge_version(qdrant, collection)
+    return f"{target or collection}:{marker}:{points}"
+
+
+def content_hash(question: str, model: str) -> str:
+    """Хэш того, от чего зависит вектор записи: текст вопроса и модель эмбеддингов."""
+    return hashlib.sha256(f"{model}\n{normalize_text(question)}".encode("utf-8")).hexdigest()
+
+
+def record_payload(record: dict, model: str | None = None) -> dict:
+    payload = {
+        "question": record["question"],
+        "answer": record["answer"],
+        "related_questions": record["related_questions"],
+    }
+    if model is not None:
+        payload["content_hash"] = content_hash(record["question"], model)
+    return payload
+
+
+class IngestCheckpoint:
+    """Номера уже загруженных чанков, сохраняемые в JSON-файл после каждого чанка.
+
+    Чекпоинт относится к конкретному источнику, коллекции и размеру чанка:
+    если что-то из этого поменялось, загрузка начинается заново.
+    """
+
+    def __init__(self, path: str, key: str):
+        self.path = path
+        self.key = key
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("key") == key:
+                self.done = set(state["done"])
+
+    def mark(self, chunk: int):
+        self.done.add(chunk)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"key": self.key, "done": sorted(self.done)}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.done = set()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+@dataclass
+class IngestReport:
+    rows: int = 0
+    skipped: int = 0
+    chunks: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+async def ingest_knowledge(records, embed, qdrant, collection: str, batch_size: int = 64, concurrency: int = 4,
+                           checkpoint: IngestCheckpoint | None = None, retries: int = 3,
+                           on_chunk=None, model: str | None = None) -> IngestReport:
+    """Загружает записи базы знаний в Qdrant чанками по batch_size.
+
+    records - итерируемые (в том числе асинхронно) словари из row_to_record,
+    читаются лениво через iter_chunks;
+    embed - корутина texts -> vectors (например, Assistant.get_embeddings);
+    qdrant - AsyncQdrant. Одновременно обрабатывается не больше concurrency
+    чанков, в памяти - не больше 2 * concurrency чанков. Уже загруженные
+    чанки из checkpoint пропускаются. Если указана model, в payload
+    сохраняется content_hash для последующей инкрементальной синхронизации.
+    """
+    report = IngestReport()
+    started_at = time.monotonic()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    collection_ready = asyncio.Lock()
+    collection_checked = False
+
+    async def ensure_collection(vector_size: int):
+        nonlocal collection_checked
+        async with collection_ready:
+            if not collection_checked:
+                if not await qdrant.collection_exists(collection):
+                    await qdrant.create_collection(
+                        collection_name=collection,
+                        vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
+                    )
+                collection_checked = True
+
+    async def load_chunk(chunk: list[dict]):
+        for attempt in range(retries):
+            try:
+                vectors = await embed([record["question"] for record in chunk])
+                await ensure_collection(len(vectors[0]))
+                await qdrant.upsert(
+                    collection_name=collection,
+                    points=[
+                        PointStruct(id=record["id"], vector=vector, payload=record_payload(record, model))
+                        for record, vector in zip(chunk, vectors)
+                    ],
+                    wait=True,
+                )
+                return
+            except Exception:
+                if attempt == retries - 1:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+
+    failure = None
+
+    async def worker():
+        nonlocal failure
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                # После первой ошибки только освобождаем очередь, чтобы не блокировать чтение источника.
+                if failure is not None:
+                    continue
+                number, chunk = item
+                try:
+                    await load_chunk(chunk)
+                except Exception as e:
+                    failure = e
+                    continue
+
+                if checkpoint is not None:
+                    checkpoint.mark(number)
+                report.rows += len(chunk)
+                report.chunks += 1
+                if on_chunk is not None:
+                    on_chunk(report, time.monotonic() - started_at)
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        async with aclosing(iter_chunks(records, batch_size)) as chunks:
+            number = 0
+            async for chunk in chunks:
+                if failure is not None:
+                    break
+                if checkpoint is not None and number in checkpoint.done:
+                    report.skipped += len(chunk)
+                else:
+                    await queue.put((number, chunk))
+                number += 1
+
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+
+    if failure is not None:
+        raise failure
+
+    if checkpoint is not None:
+        checkpoint.clear()
+    if report.rows:
+        await bump_knowledge_version(qdrant, collection)
+    report.elapsed = time.monotonic() - started_at
+    return report
+
+
+@dataclass
+class SyncReport:
+    added: int = 0
+    reembedded: int = 0
+    payload_updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    elapsed: float = 0.0
+
+
+async def scroll_payloads(qdrant, collection: str, page_size: int = 1024) -> dict:
+    """id -> payload всех точек коллекции (без векторов)."""
+    payloads = {}
+    if not await qdrant.collection_exists(collection):
+        return payloads
+
+    offset = None
+    while True:
+        points, offset = await qdrant.scroll(
+            collection_name=collection, limit=page_size, offset=offset, with_payload=True, with_vectors=False
+        )
+        payloads.update((point.id, point.payload) for point in points)
+        if offset is None:
+            return payloads
+
+
+async def collection_records(qdrant, collection: str, page_size: int = 256):
+    """Записи базы знаний, восстановленные из payload коллекции (асинхронно, страницами scroll)."""
+    offset = None
+    while True:
+        points, offset = await qdrant.scroll(
+            collection_name=collection, limit=page_size, offset=offset, with_payload=True, with_vectors=False
+        )
+        for point in points:
+            yield {
+                "id": point.id,
+                "question": point.payload["question"],
+                "answer": point.payload.get("answer", ""),
+                "related_questions": point.payload.get("related_questions", []),
+            }
+        if offset is None:
+            return
+
+
+async def max_point_id(qdrant, collection: str, page_size: int = 1024) -> int:
+    """Наибольший целочисленный id в коллекции (0, если коллекция пуста или ее нет)."""
+    if not await qdrant.collection_exists(collection):
+        return 0
+
+    result = 0
+    offset = None
+    while True:
+        points, offset = await qdrant.scroll(
+            collection_name=collection, limit=page_size, offset=offset, with_payload=False, with_vectors=False
+        )
+        result = max([result, *(point.id for point in points if isinstance(point.id, int))])
+        if offset is None:
+            return result
+
+
+async def sync_knowledge(records, embed, qdrant, collection: str, model: str, batch_size: int = 64,
+                         concurrency: int = 4, delete_missing: bool = True, dry_run: bool = False) -> SyncReport:
+    """Приводит коллекцию к содержимому records, пересчитывая эмбеддинги только там, где это нужно.
+
+    Новые записи и записи с изменившимся вопросом (или моделью) - по content_hash - эмбеддятся
+    заново; если изменились только ответ или связанные вопросы, обновляется payload;
+    записи, которых больше нет в источнике, удаляются.
+
+    Источник читается чанками (iter_chunks), и записи для эмбеддинга сразу уходят
+    в ingest_knowledge: в памяти держатся только payload коллекции и несколько чанков.
+    """
+    report = SyncReport()
+    started_at = time.monotonic()
+    existing = await scroll_payloads(qdrant, collection)
+
+    async def changed_records():
+        async for chunk in iter_chunks(records, batch_size):
+            updates = []
+            for record in chunk:
+                payload = record_payload(record, model)
+                current = existing.pop(record["id"], None)
+                if current is None:
+                    report.added += 1
+                    yield record
+                elif current.get("content_hash") != payload["content_hash"]:
+                    report.reembedded += 1
+                    yield record
+                elif any(current.get(key) != value for key, value in payload.items()):
+                    report.payload_updated += 1
+                    updates.append(SetPayloadOperation(set_payload=SetPayload(payload=payload, points=[record["id"]])))
+                else:
+                    report.unchanged += 1
+
+            if updates and not dry_run:
+                await qdrant.batch_update_points(collection_name=collection, update_operations=updates, wait=True)
+
+    if dry_run:
+        async for _ in changed_records():
+            pass
+    else:
+        await ingest_knowledge(
+            changed_records(), embed=embed, qdrant=qdrant, collection=collection,
+            batch_size=batch_size, concurrency=concurrency, model=model,
+        )
+
+    deleted = list(existing) if delete_missing else []
+    report.deleted = len(deleted)
+    if deleted and not dry_run:
+        await qdrant.delete(collection_name=collection, points_selector=PointIdsList(points=deleted), wait=True)
+    # Новые и пересчитанные записи уже отметил ingest_knowledge.
+    if (report.payload_updated or report.deleted) and not dry_run:
+        await bump_knowledge_version(qdrant, collection)
+
+    report.elapsed = time.monotonic() - started_at
+    return report
+
+
+def version_number(alias: str, collection: str) -> int | None:
+    """Номер версии коллекции вида <alias>_v<N>, иначе None."""
+    match = re.fullmatch(rf"{re.escape(alias)}_v(\d+)", collection)
+    return int(match.group(1)) if match else None
+
+
+async def collection_versions(qdrant, alias: str) -> list[str]:
+    """Версии коллекции <alias>_v1, <alias>_v2, ... по возрастанию номера."""
+    collections = (await qdrant.get_collections()).collections
+    versions = [(version_number(alias, c.name), c.name) for c in collections]
+    return [name for number, name in sorted(v for v in versions if v[0] is not None)]
+
+
+async def alias_target(qdrant, alias: str) -> str | None:
+    """Коллекция, на которую сейчас указывает alias (None, если такого alias нет)."""
+    for description in (await qdrant.get_aliases()).aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return None
+
+
+async def switch_alias(qdrant, alias: str, collection: str):
+    """Переключает alias на collection одним запросом: читатели видят либо старую, либо новую версию."""
+    operations = []
+    if await alias_target(qdrant, alias) is not None:
+        operations.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias)))
+    elif await qdrant.collection_exists(alias):
+        # Первый переход с обычной коллекции на версии: имя нужно освободить под alias.
+        # Ее данные к этому моменту скопированы в <alias>_v0 (adopt_collection).
+        await qdrant.delete_collection(alias)
+    operations.append(CreateAliasOperation(create_alias=CreateAlias(collection_name=collection, alias_name=alias)))
+    await qdrant.update_collection_aliases(change_aliases_operations=operations)
+
+
+async def adopt_collection(qdrant, alias: str, page_size: int = 256) -> str | None:
+    """Превращает обычную коллекцию с именем alias в версию <alias>_v0 и ставит на нее alias.
+
+    Точки копируются вместе с векторами, без повторного расчета эмбеддингов. Так первая
+    переиндексация не теряет рабочую коллекцию: v0 остается целью для rollback_knowledge.
+    Возвращает имя версии или None, если переводить нечего.
+    """
+    if await alias_target(qdrant, alias) is not None or not await qdrant.collection_exists(alias):
+        return None
+
+    collection = f"{alias}_v0"
+    info = await qdrant.get_collection(alias)
+    if await qdrant.collection_exists(collection):
+        await qdrant.delete_collection(collection)
+    await qdrant.create_collection(
+        collection_name=collection, vectors_config=info.config.params.vectors, metadata=info.config.metadata,
+    )
+    offset = None
+    while True:
+        points, offset = await qdrant.scroll(
+            collection_name=alias, limit=page_size, offset=offset, with_payload=True, with_vectors=True
+        )
+        if points:
+            await qdrant.upsert(
+                collection_name=collection,
+                points=[PointStruct(id=point.id, vector=point.vector, payload=point.payload) for point in points],
+                wait=True,
+            )
+        if offset is None:
+            break
+
+    await switch_alias(qdrant, alias, collection)
+    return collection
+
+
+async def warm_collection(qdrant, collection: str, samples: int = 16):
+    """Прогоняет по новой коллекции несколько поисков ее же векторами, чтобы индекс был загружен до переключения."""
+    points, _ = await qdrant.scroll(
+        collection_name=collection, limit=samples, with_payload=False, with_vectors=True
+    )
+    for point in points:
+        await qdrant.query_points(collection_name=collection, query=point.vector, limit=5)
+
+
+@dataclass
+class ReindexReport:
+    collection: str
+    previous: str | None
+    ingest: IngestReport
+    dropped: list
+
+
+async def reindex_knowledge(records, embed, qdrant, alias: str, model: str | None = None, batch_size: int = 64,
+                            concurrency: int = 4, keep: int = 2, retries: int = 3, on_chunk=None) -> ReindexReport:
+    """Полная переиндексация без простоя.
+
+    Записи загружаются в новую версию <alias>_v<N+1> рядом с рабочей, она прогревается
+    и только потом alias атомарно переключается на нее. Хранятся keep версий: новая,
+    предыдущая рабочая (для rollback_knowledge) и самые свежие из остальных.
+    Если alias еще нет, а есть обычная коллекция с его именем, она сначала становится версией v0.
+    """
+    await adopt_collection(qdrant, alias)
+    versions = await collection_versions(qdrant, alias)
+    number = version_number(alias, versions[-1]) + 1 if versions else 1
+    collection = f"{alias}_v{number}"
+    previous = await alias_target(qdrant, alias)
+
+    try:
+        ingest = await ingest_knowledge(
+            records, embed=embed, qdrant=qdrant, collection=collection, batch_size=batch_size,
+            concurrency=concurrency, retries=retries, on_chunk=on_chunk, model=model,
+        )
+        await warm_collection(qdrant, collection)
+    except BaseException:
+        # Недостроенная версия никому не видна - просто убираем ее.
+        if await qdrant.collection_exists(collection):
+            await qdrant.delete_collection(collection)
+        raise
+
+    await switch_alias(qdrant, alias, collection)
+
+    others = [name for name in versions if name != previous]
+    dropped = others[:max(len(others) - max(keep - 2, 0), 0)]
+    for name in dropped:
+        await qdrant.delete_collection(name)
+    return ReindexReport(collection=collection, previous=previous, ingest=ingest, dropped=dropped)
+
+
+async def rollback_knowledge(qdrant, alias: str) -> str:
+    """Возвращает alias на предыдущую сохраненную версию коллекции и возвращает ее имя."""
+    current = await alias_target(qdrant, alias)
+    current_number = version_number(alias, current) if current else None
+    older = [
+        name for name in await collection_versions(qdrant, alias)
+        if current_number is None or version_number(alias, name) < current_number
+    ]
+    if not older:
+        raise ValueError(f"Нет версии {alias} старше {current}, на которую можно откатиться")
+    await switch_alias(qdrant, alias, older[-1])
+    return older[-1]
+
+
+SNAPSHOT_VECTORS = "vectors.npy"
+SNAPSHOT_PAYLOADS = "payloads.jsonl"
+SNAPSHOT_META = "meta.json"
+
+
+def dump_snapshot(client, collection: str, path: str, page_size: int = 1024) -> int:
+    """Сохраняет коллекцию в каталог path: матрица векторов float32 (.npy), id и payload в JSONL, meta.json.
+
+    Точки читаются страницами и пишутся в memmap, поэтому память не зависит от размера коллекции.
+    Возвращает число сохраненных точек.
+    """
+    params = client.get_collection(collection).config.params.vectors
+    count = client.count(collection, exact=True).count
+    os.makedirs(path, exist_ok=True)
+
+    vectors = np.lib.format.open_memmap(
+        os.path.join(path, SNAPSHOT_VECTORS), mode="w+", dtype=np.float32, shape=(count, params.size)
+    )
+    written = 0
+    offset = None
+    with open(os.path.join(path, SNAPSHOT_PAYLOADS), "w", encoding="utf-8") as payloads:
+        while True:
+            points, offset = client.scroll(
+                collection_name=collection, limit=page_size, offset=offset, with_payload=True, with_vectors=True
+            )
+            # Если во время выгрузки в коллекцию дописали точки, лишние не поместятся в матрицу.
+            points = points[:count - written]
+            if points:
+                vectors[written:written + len(points)] = np.asarray([point.vector for point in points], dtype=np.float32)
+            for point in points:
+                payloads.write(json.dumps({"id": point.id, "payload": point.payload}, ensure_ascii=False) + "\n")
+            written += len(points)
+            if offset is None or written == count:
+                break
+    vectors.flush()
+    del vectors
+
+    with open(os.path.join(path, SNAPSHOT_META), "w", encoding="utf-8") as f:
+        json.dump({"collection": collection, "count": written, "size": params.size,
+                   "distance": params.distance.value}, f)
+    return written
+
+
+def load_snapshot(client, path: str, collection: str, batch_size: int = 512, recreate: bool = False) -> int:
+    """Загружает снимок из dump_snapshot в коллекцию пакетными upsert, без обращения к модели эмбеддингов.
+
+    Матрица векторов открывается через memmap, в памяти держится один пакет. Возвращает число точек.
+    """
+    with open(os.path.join(path, SNAPSHOT_META), encoding="utf-8") as f:
+        meta = json.load(f)
+    vectors = np.load(os.path.join(path, SNAPSHOT_VECTORS), mmap_mode="r")
+
+    if recreate and client.collection_exists(collection):
+        client.delete_collection(collection)
+    if not client.collection_exists(collection):
+        client.create_collection(
+            collection_name=collection,
+            vectors_config=VectorParams(size=meta["size"], distance=Distance(meta["distance"])),
+        )
+
+    loaded = 0
+    with open(os.path.join(path, SNAPSHOT_PAYLOADS), encoding="utf-8") as payloads:
+        while batch := [json.loads(line) for line in islice(payloads, batch_size)]:
+            client.upsert(
+                collection_name=collection,
+                points=[
+                    PointStruct(id=item["id"], vector=vector.tolist(), payload=item["payload"])
+                    for item, vector in zip(batch, vectors[loaded:loaded + len(batch)])
+                ],
+                wait=True,
+            )
+            loaded += len(batch)
+    client.update_collection(collection_name=collection, metadata=knowledge_version_metadata())
+    return loaded
@@ -0,0 +1,591 @@
+import asyncio
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http.exceptions import ResponseHandlingException
+from qdrant_client.http.models import (
+    CollectionDescription,
+    CollectionsAliasesResponse,
+    CollectionsResponse,
+    QueryResponse,
+    Record,
+    ScoredPoint,
+)
+
+from concurrency import CircuitBreaker, CircuitOpen
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+
+
+def get_qdrant() -> QdrantClient:
+    """Общий для процесса синхронный клиент Qdrant, настроенный через переменные окружения."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            if os.getenv("QDRANT_IN_MEMORY") == "1":
+                _client = QdrantClient(":memory:")
+                if os.getenv("QDRANT_SNAPSHOT"):
+                    # Снимок базы знаний (manage.py dump_knowledge) поднимается без сети и без эмбеддингов.
+                    from knowledge import load_snapshot
+
+                    load_snapshot(_client, os.environ["QDRANT_SNAPSHOT"], os.getenv("QDRANT_COLLECTION", "que"))
+            else:
+                qdrant_host = os.getenv("QDRANT_HOST", "qdrant")
+                qdrant_port = os.getenv("QDRANT_PORT", "6333")
+                _client = QdrantClient(url=os.getenv("QDRANT_URL", f"http://{qdrant_host}:{qdrant_port}"))
+        return _client
+
+
+def get_async_qdrant() -> "AsyncQdrant":
+    global _async_client
+    if _async_client is None:
+        # Локальный клиент в памяти не рассчитан на конкурентный доступ - сериализуем вызовы.
+        workers = 1 if os.getenv("QDRANT_IN_MEMORY") == "1" else int(os.getenv("QDRANT_EXECUTOR_WORKERS", "16"))
+        _async_client = AsyncQdrant(get_qdrant, max_workers=workers)
+    return _async_client
+
+
+class AsyncQdrant:
+    """Асинхронная обертка над QdrantClient: каждый вызов уходит в пул потоков.
+
+    Обертка делит хранилище с синхронным клиентом (в том числе в режиме
+    QDRANT_IN_MEMORY), поэтому записи через settings.QDRANT сразу видны
+    асинхронному коду и наоборот. Сам клиент создается при первом вызове,
+    уже в пуле потоков.
+    """
+
+    def __init__(self, client_factory, max_workers: int = 16):
+        self.__client_factory = client_factory
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="qdrant")
+
+    @property
+    def client(self) -> QdrantClient:
+        return self.__client_factory()
+
+    def __getattr__(self, name):
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.__executor, partial(self.__call, name, *args, **kwargs))
+
+        return call
+
+    def __call(self, name, *args, **kwargs):
+        return getattr(self.client, name)(*args, **kwargs)
+
+    def apply_changes(self, collection: str, upserted: list | None = None, deleted: list | None = None):
+        """Изменения базы знаний уже записаны в Qdrant - локальных копий нет."""
+
+    async def knowledge_version(self, collection: str) -> tuple:
+        from knowledge import read_knowledge_version
+
+        return await read_knowledge_version(self, collection)
+
+    def stats(self) -> dict:
+        return {"backend": "qdrant"}
+
+
+def get_vector_store():
+    """Хранилище, в котором Assistant ищет записи базы знаний; выбирается переменной VECTOR_BACKEND.
+
+    qdrant (по умолчанию) - AsyncQdrant; numpy - LocalVectorStore в памяти процесса;
+    auto - Qdrant, а при его недоступности - LocalVectorStore.
+    """
+    backend = os.getenv("VECTOR_BACKEND", "qdrant")
+    if backend == "qdrant":
+        return get_async_qdrant()
+
+    local = LocalVectorStore(partial(
+        load_numpy_index, snapshot=os.getenv("VECTOR_SNAPSHOT"), snapshot_collection=os.getenv("QDRANT_COLLECTION", "que")
+    ))
+    if backend == "numpy":
+        return local
+    if backend == "auto":
+        breaker = CircuitBreaker(
+            "Qdrant",
+            failure_threshold=int(os.getenv("QDRANT_FAILURE_THRESHOLD", "3")),
+            recovery_timeout=float(os.getenv("QDRANT_RECOVERY_TIMEOUT", "30")),
+        )
+        return FallbackVectorStore(get_async_qdrant(), local, breaker, timeout=float(os.getenv("QDRANT_TIMEOUT", "2")))
+    raise ValueError(f"Неизвестный VECTOR_BACKEND: {backend!r}")
+
+
+class NumpyIndex:
+    """Точный косинусный поиск в памяти процесса для небольших баз знаний.
+
+    Нормированные векторы лежат в непрерывном массиве float32 (из снимка dump_knowledge - через
+    memmap), рядом - id и payload. Поиск - одно матричное умножение, top-k выбирается через
+    argpartition без полной сортировки.
+    """
+
+    def __init__(self, vectors: np.ndarray, ids: list, payloads: list, normalized: bool = False):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not normalized:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        self.__vectors = vectors
+        self.__ids = list(ids)
+        self.__payloads = list(payloads)
+        self.__positions = {point_id: position for position, point_id in enumerate(self.__ids)}
+
+    @classmethod
+    def from_snapshot(cls, path: str) -> "NumpyIndex":
+        """Индекс поверх снимка dump_knowledge; матрица векторов не копируется в память, а отображается."""
+        from knowledge import SNAPSHOT_META, SNAPSHOT_PAYLOADS, SNAPSHOT_VECTORS
+
+        with open(os.path.join(path, SNAPSHOT_META), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["distance"] != "Cosine":
+            raise ValueError(f"Снимок {path} с метрикой {meta['distance']}, поддерживается только Cosine")
+
+        ids, payloads = [], []
+        with open(os.path.join(path, SNAPSHOT_PAYLOADS), encoding="utf-8") as f:
+            for line in f:
+                item = json.loads(line)
+                ids.append(item["id"])
+                payloads.append(item["payload"])
+        # Qdrant нормирует векторы Cosine-коллекций при записи, поэтому снимок уже нормирован.
+        vectors = np.load(os.path.join(path, SNAPSHOT_VECTORS), mmap_mode="r")
+        return cls(vectors, ids, payloads, normalized=True)
+
+    @classmethod
+    def from_qdrant(cls, client: QdrantClient, collection: str, page_size: int = 1024) -> "NumpyIndex":
+        vectors, ids, payloads = [], [], []
+        offset = None
+        while True:
+            points, offset = client.scroll(
+                collection_name=collection, limit=page_size, offset=offset, with_payload=True, with_vectors=True
+            )
+            for point in points:
+                vectors.append(point.vector)
+                ids.append(point.id)
+                payloads.append(point.payload)
+            if offset is None:
+                break
+        dimension = client.get_collection(collection).config.params.vectors.size
+        return cls(np.asarray(vectors, dtype=np.float32).reshape(-1, dimension), ids, payloads)
+
+    def __len__(self) -> int:
+        return len(self.__ids)
+
+    def search(self, query, limit: int) -> list[ScoredPoint]:
+        if not self.__ids or limit <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        scores = self.__vectors @ (query / norm if norm else query)
+
+        limit = min(limit, len(scores))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [
+            ScoredPoint(id=self.__ids[i], version=0, score=float(scores[i]), payload=self.__payloads[i])
+            for i in top
+        ]
+
+    def scroll(self, limit: int, offset: int | None = None) -> tuple[list[Record], int | None]:
+        """Страница записей; offset - позиция в индексе, а не id, как в Qdrant."""
+        start = offset or 0
+        end = min(start + limit, len(self.__ids))
+        records = [Record(id=self.__ids[i], payload=self.__payloads[i]) for i in range(start, end)]
+        return records, end if end < len(self.__ids) else None
+
+    def upsert(self, point_id, vector, payload: dict):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        vector = vector / norm if norm else vector
+        # Отображенный из снимка массив только для чтения: при первой правке копируем его в память.
+        if not self.__vectors.flags.writeable:
+            self.__vectors = np.array(self.__vectors)
+
+        position = self.__positions.get(point_id)
+        if position is None:
+            self.__positions[point_id] = len(self.__ids)
+            self.__ids.append(point_id)
+            self.__payloads.append(payload)
+            self.__vectors = np.vstack([self.__vectors.reshape(-1, len(vector)), vector[None, :]])
+        else:
+            self.__vectors[position] = vector
+            self.__payloads[position] = payload
+
+    def remove(self, point_id):
+        position = self.__positions.pop(point_id, None)
+        if position is None:
+            return
+        self.__vectors = np.delete(self.__vectors, position, axis=0)
+        del self.__ids[position]
+        del self.__payloads[position]
+        self.__positions = {point_id: position for position, point_id in enumerate(self.__ids)}
+
+
+def load_numpy_index(collection: str, snapshot: str | None = None, snapshot_collection: str | None = None) -> NumpyIndex:
+    """NumpyIndex для коллекции: из снимка VECTOR_SNAPSHOT, если он относится к ней, иначе - копия из Qdrant."""
+    if snapshot and collection == snapshot_collection:
+        return NumpyIndex.from_snapshot(snapshot)
+    return NumpyIndex.from_qdrant(get_qdrant(), collection)
+
+
+class LocalVectorStore:
+    """Поиск по NumpyIndex с тем же интерфейсом, что у AsyncQdrant, в той части, которой пользуется Assistant.
+
+    Индекс коллекции загружается при первом обращении через loader(collection).
+    """
+
+    def __init__(self, loader):
+        self.__loader = loader
+        self.__indexes = {}
+        self.__aliases = []
+        self.__load_lock = asyncio.Lock()
+
+    async def index(self, collection: str) -> NumpyIndex:
+        if collection not in self.__indexes:
+            async with self.__load_lock:
+                if collection not in self.__indexes:
+                    self.__indexes[collection] = await asyncio.to_thread(self.__loader, collection)
+        return self.__indexes[collection]
+
+    async def query_points(self, collection_name: str, query, limit: int = 10, **kwargs) -> QueryResponse:
+        return QueryResponse(points=(await self.index(collection_name)).search(query, limit))
+
+    async def scroll(self, collection_name: str, limit: int = 10, offset=None, **kwargs):
+        return (await self.index(collection_name)).scroll(limit, offset)
+
+    async def get_collections(self) -> CollectionsResponse:
+        return CollectionsResponse(collections=[CollectionDescription(name=name) for name in self.__indexes])
+
+    async def get_aliases(self) -> CollectionsAliasesResponse:
+        return CollectionsAliasesResponse(aliases=self.__aliases)
+
+    async def knowledge_version(self, collection: str) -> None:
+        """Локальный индекс меняется только через apply_changes этого процесса - внешней версии нет."""
+        return None
+
+    def remember_aliases(self, response: CollectionsAliasesResponse):
+        """Последние alias, полученные от Qdrant: при его недоступности цель alias не должна "меняться"."""
+        self.__aliases = list(response.aliases)
+
+    def apply_changes(self, collection: str, upserted: list | None = None, deleted: list | None = None):
+        """Переносит правки базы знаний в загруженный индекс; без аргументов индекс будет загружен заново."""
+        index = self.__indexes.get(collection)
+        if index is None:
+            return
+        if upserted is None and deleted is None:
+            del self.__indexes[collection]
+            return
+        for point in upserted or []:
+            index.upsert(point.id, point.vector, point.payload)
+        for point_id in deleted or []:
+            index.remove(point_id)
+
+    def stats(self) -> dict:
+        return {"backend": "numpy", "collections": {name: len(index) for name, index in self.__indexes.items()}}
+
+
+class FallbackVectorStore:
+    """Qdrant с автоматическим переходом на LocalVectorStore, когда Qdrant недоступен.
+
+    Недоступность (ошибка соединения или таймаут) учитывается CircuitBreaker: пока цепь разомкнута,
+    чтение сразу идет в локальный индекс. Пока Qdrant отвечает, локальная копия коллекции
+    загружается в фоне, чтобы было куда переключиться.
+    """
+
+    READ_METHODS = {"query_points", "scroll", "get_collections", "get_aliases"}
+    UNREACHABLE = (ResponseHandlingException, ConnectionError, TimeoutError)
+
+    def __init__(self, primary, fallback: LocalVectorStore, breaker: CircuitBreaker, timeout: float | None = None):
+        self.__primary = primary
+        self.__fallback = fallback
+        self.__breaker = breaker
+        self.__timeout = timeout
+        self.__fallbacks = 0
+        self.__preloads = {}
+
+    def __getattr__(self, name):
+        if name not in self.READ_METHODS:
+            return getattr(self.__primary, name)
+
+        async def call(*args, **kwargs):
+            try:
+                self.__breaker.before_call()
+            except CircuitOpen:
+                return await self.__use_fallback(name, *args, **kwargs)
+
+            try:
+                result = await asyncio.wait_for(getattr(self.__primary, name)(*args, **kwargs), self.__timeout)
+            except asyncio.CancelledError:
+                self.__breaker.release()
+                raise
+            except self.UNREACHABLE as e:
+                self.__breaker.record_failure(e)
+                return await self.__use_fallback(name, *args, **kwargs)
+            except Exception:
+                # Qdrant ответил ошибкой - он доступен, переключаться некуда и незачем.
+                self.__breaker.record_success()
+                raise
+
+            self.__breaker.record_success()
+            if name == "get_aliases":
+                self.__fallback.remember_aliases(result)
+            collection = kwargs.get("collection_name")
+            if collection is not None and collection not in self.__preloads:
+                self.__preloads[collection] = asyncio.create_task(self.__preload(collection))
+            return result
+
+        return call
+
+    async def __use_fallback(self, name, *args, **kwargs):
+        self.__fallbacks += 1
+        return await getattr(self.__fallback, name)(*args, **kwargs)
+
+    async def __preload(self, collection: str):
+        try:
+            await self.__fallback.index(collection)
+        except Exception as e:
+            logger.warning("Failed to preload local vector index for %s: %r", collection, e)
+            self.__preloads.pop(collection, None)
+
+    def apply_changes(self, collection: str, upserted: list | None = None, deleted: list | None = None):
+        if upserted is None and deleted is None:
+            self.__preloads.pop(collection, None)
+        self.__fallback.apply_changes(collection, upserted, deleted)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "auto",
+            "qdrant": self.__breaker.stats(),
+            "fallbacks": self.__fallbacks,
+            "local": self.__fallback.stats(),
+        }
+
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов без обращения к токенизатору модели.
+
+    Знаки препинания считаются отдельными токенами, слова - по токену на
+    каждые 4 символа, что близко к поведению BPE-токенизаторов на русском тексте.
+    """
+    return sum(math.ceil(len(piece) / 4) for piece in _TOKEN_RE.findall(text))
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    if estimate_tokens(text) <= budget:
+        return text
+
+    used = 0
+    for match in _TOKEN_RE.finditer(text):
+        used += math.ceil(len(match.group()) / 4)
+        if used > budget:
+            return text[:match.start()].rstrip() + "…"
+    return text
+
+
+class ContextBuilder:
+    """Собирает контекст для промпта из найденных в Qdrant записей базы знаний.
+
+    Записи ниже min_score отбрасываются, почти совпадающие ответы (по доле общих
+    слов) попадают в контекст один раз, длинные ответы обрезаются до
+    max_answer_tokens, а весь контекст - до max_tokens.
+    """
+
+    def __init__(self, min_score: float = 0.5, max_tokens: int = 1200, max_answer_tokens: int = 300,
+                 duplicate_threshold: float = 0.9):
+        self.min_score = min_score
+        self.max_tokens = max_tokens
+        self.max_answer_tokens = max_answer_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.__builds = 0
+        self.__tokens = 0
+        self.__below_score = 0
+        self.__duplicates = 0
+        self.__truncated = 0
+
+    def build(self, hits) -> tuple[str, list]:
+        """Возвращает текст контекста и записи, которые в него вошли."""
+        entries = []
+        used = []
+        seen = []
+        tokens = 0
+
+        for hit in sorted(hits, key=lambda hit: hit.score, reverse=True):
+            # Для записей, найденных только лексическим поиском, косинусной близости нет.
+            similarity = getattr(hit, "vector_score", hit.score)
+            if similarity is not None and similarity < self.min_score:
+                self.__below_score += 1
+                continue
+
+            words = set(_TOKEN_RE.findall(str(hit.payload["answer"]).lower()))
+            if any(self.__similarity(words, other) >= self.duplicate_threshold for other in seen):
+                self.__duplicates += 1
+                continue
+
+            question = f"Вопрос: {hit.payload['question']}\nОтвет: "
+            remaining = self.max_tokens - tokens - estimate_tokens(question)
+            # Обрывок ответа в пару слов модели не поможет.
+            if remaining < 16:
+                break
+
+            answer = str(hit.payload["answer"])
+            shortened = truncate_to_tokens(answer, min(self.max_answer_tokens, remaining))
+            if shortened != answer:
+                self.__truncated += 1
+
+            entry = question + shortened
+            entries.append(entry)
+            used.append(hit)
+            seen.append(words)
+            tokens += estimate_tokens(entry)
+
+        self.__builds += 1
+        self.__tokens += tokens
+        return "\n\n".join(entries), used
+
+    @staticmethod
+    def __similarity(first: set, second: set) -> float:
+        if not first or not second:
+            return 0.0
+        return len(first & second) / len(first | second)
+
+    def stats(self) -> dict:
+        return {
+            "min_score": self.min_score,
+            "max_tokens": self.max_tokens,
+            "builds": self.__builds,
+            "avg_context_tokens": round(self.__tokens / self.__builds, 1) if self.__builds else 0.0,
+            "below_score": self.__below_score,
+            "duplicates": self.__duplicates,
+            "truncated": self.__truncated,
+        }
+
+
+@dataclass
+class SearchHit:
+    id: int | str
+    payload: dict
+    score: float = 0.0
+    vector_score: float | None = None
+    lexical_score: float | None = None
+
+
+class BM25Index:
+    """Инвертированный индекс в памяти со скорингом BM25 по вопросу и ответу записи.
+
+    У русских слов отбрасываются типичные окончания - грубая замена стеммингу,
+    чтобы "тариф", "тарифа" и "тарифы" совпадали. Латиница и цифры (названия
+    тарифов и моделей оборудования) индексируются целиком.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.__postings = defaultdict(dict)
+        self.__lengths = {}
+        self.__payloads = {}
+        self.__total_length = 0
+
+    def __len__(self):
+        return len(self.__payloads)
+
+    def upsert(self, doc_id, payload: dict):
+        self.remove(doc_id)
+        terms = self.tokenize(f"{payload.get('question', '')} {payload.get('answer', '')}")
+        for term in terms:
+            postings = self.__postings[term]
+            postings[doc_id] = postings.get(doc_id, 0) + 1
+        self.__lengths[doc_id] = len(terms)
+        self.__payloads[doc_id] = payload
+        self.__total_length += len(terms)
+
+    def remove(self, doc_id):
+        if doc_id not in self.__payloads:
+            return
+
+        for term in set(self.tokenize(f"{self.__payloads[doc_id].get('question', '')} "
+                                      f"{self.__payloads[doc_id].get('answer', '')}")):
+            postings = self.__postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.__postings[term]
+        self.__total_length -= self.__lengths.pop(doc_id)
+        del self.__payloads[doc_id]
+
+    def search(self, query: str, limit: int = 10, min_score: float = 0.0) -> list[SearchHit]:
+        documents = len(self.__payloads)
+        if documents == 0:
+            return []
+
+        average_length = self.__total_length / documents or 1
+        scores = defaultdict(float)
+        for term in set(self.tokenize(query)):
+            postings = self.__postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.__lengths[doc_id] / average_length)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [
+            SearchHit(id=doc_id, payload=self.__payloads[doc_id], score=score, lexical_score=score)
+            for doc_id, score in best
+            if score >= min_score
+        ]
+
+    @staticmethod
+    def tokenize(text: str) -> list[str]:
+        terms = []
+        for word in _TOKEN_RE.findall(str(text).lower().replace("ё", "е")):
+            if word.isalpha() and not word.isascii():
+                word = _strip_ending(word)
+            terms.append(word)
+        return terms
+
+
+_ENDINGS = sorted(
+    (
+        "иями ями ами ией ого его ому ему ыми ими ешь ишь ете ите ться тся ать ять еть ить уть "
+        "ой ей ий ый ая яя ое ее ые ие ую юю ов ев ах ях ам ям ом ем ью ья ть ет ит ут ют ат ят "
+        "а я о е ы и у ю ь"
+    ).split(),
+    key=len,
+    reverse=True,
+)
+
+
+def _strip_ending(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def reciprocal_rank_fusion(vector_hits, lexical_hits, k: int = 60, limit: int | None = None) -> list[SearchHit]:
+    """Объединяет выдачу векторного и лексического поиска методом RRF: score = сумма 1 / (k + ранг)."""
+    fused = {}
+    for rank, hit in enumerate(vector_hits, start=1):
+        entry = fused.setdefault(hit.id, SearchHit(id=hit.id, payload=hit.payload))
+        entry.vector_score = hit.score
+        entry.score += 1 / (k + rank)
+    for rank, hit in enumerate(lexical_hits, start=1):
+        entry = fused.setdefault(hit.id, SearchHit(id=hit.id, payload=hit.payload))
+        entry.lexical_score = hit.score
+        entry.score += 1 / (k + rank)
+
+    return sorted(fused.values(), key=lambda hit: hit.score, reverse=True)[:limit]
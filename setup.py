@@ -1,4 +1,3 @@
-import asyncio
 import importlib
 import os
 import subprocess
@@ -6,10 +5,7 @@ import sys
 from pathlib import Path
 
 import django
-import pandas as pd
 from django.core.management import call_command
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, PointStruct, VectorParams
 from django.contrib.auth import get_user_model
 
 try:
@@ -19,8 +15,6 @@ except ImportError:
 
     importlib.import_module("openpyxl")
 
-from assistant import Assistant
-
 DATABASE_HOST = 'localhost'
 DATABASE_PORT = '5432'
 DATABASE_NAME = 'chat_db'
@@ -45,36 +39,6 @@ def create_superuser(username: str, password: str):
     print(f"✅ Суперпользователь '{username}' успешно создан.")
 
 
-async def upload_knowledge_db(qdrant: QdrantClient, assistant: Assistant):
-    df = pd.read_excel(EXCEL_FILE)
-    points = []
-
-    if not qdrant.collection_exists(COLLECTION):
-        qdrant.create_collection(
-            collection_name=COLLECTION,
-            vectors_config=VectorParams(size=1024, distance=Distance.COSINE)
-        )
-
-    for idx, row in df.iterrows():
-        points.append(
-            PointStruct(
-                id=int(row["Номер вопроса"]),
-                vector=await assistant.get_embedding(row["Вопрос"]),
-                payload={
-                    "question": row["Вопрос"],
-                    "answer": row["Ответ"],
-                    "related_questions": list(map(lambda x: x.strip(), row["Связанные вопросы"].split("/"))),
-                },
-            )
-        )
-
-    qdrant.upsert(
-        collection_name=COLLECTION,
-        points=points,
-        wait=True,
-    )
-
-
 def main():
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "DjangoProject.settings")
     os.environ.setdefault(
@@ -91,11 +55,14 @@ def main():
     django.setup()
     call_command("migrate")
 
-    qdrant_url = f"http://{QDRANT_HOST}:{QDRANT_PORT}"
-    qdrant = QdrantClient(url=qdrant_url)
-    assistant = Assistant()
+    from retrieval import get_qdrant
 
-    asyncio.run(upload_knowledge_db(qdrant, assistant))
+    if get_qdrant().collection_exists(COLLECTION):
+        # Повторный запуск пересчитывает эмбеддинги только для новых и измененных вопросов.
+        call_command("sync_knowledge", str(EXCEL_FILE), collection=COLLECTION)
+    else:
+        # Первый запуск создает версию <COLLECTION>_v1 и alias COLLECTION на нее.
+        call_command("reindex_knowledge", str(EXCEL_FILE), alias=COLLECTION)
 
     create_superuser(
         username="admin",
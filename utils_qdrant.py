@@ -2,11 +2,11 @@ import asyncio
 import os
 from pathlib import Path
 
-import pandas as pd
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, PointStruct, VectorParams
 
 from assistant import Assistant
+from knowledge import read_rows, row_to_record, sync_knowledge
+from retrieval import AsyncQdrant
 
 qdrant_host = os.getenv("QDRANT_HOST", "localhost")
 qdrant_port = os.getenv("QDRANT_PORT", "6333")
@@ -25,33 +25,14 @@ EXCEL_FILE = Path("база знаний.xlsx")
 
 
 async def upload_knowledge_db():
-    df = pd.read_excel(EXCEL_FILE)
-    points = []
-
-    if not qdrant.collection_exists(COLLECTION):
-        qdrant.create_collection(
-            collection_name=COLLECTION,
-            vectors_config=VectorParams(size=1024, distance=Distance.COSINE)
-        )
-
-    for idx, row in df.iterrows():
-        points.append(
-            PointStruct(
-                id=int(row["Номер вопроса"]),
-                vector=await assistant.get_embedding(row["Вопрос"]),
-                payload={
-                    "question": row["Вопрос"],
-                    "answer": row["Ответ"],
-                    "related_questions": list(map(lambda x: x.strip(), row["Связанные вопросы"].split("/"))),
-                },
-            )
-        )
-
-    qdrant.upsert(
-        collection_name=COLLECTION,
-        points=points,
-        wait=True,
+    report = await sync_knowledge(
+        (row_to_record(row) for row in read_rows(EXCEL_FILE)),
+        embed=assistant.get_embeddings,
+        qdrant=AsyncQdrant(lambda: qdrant),
+        collection=COLLECTION,
+        model=await assistant.get_embedding_model(),
     )
+    print(report)
 
     # print(await assistant("Привет, как дела?"))
 